@@ -1,5 +1,3 @@
-import eventlet
-
 from flask import Flask
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
@@ -8,13 +6,13 @@ from flask_socketio import SocketIO
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 
-# from Flask-MQTT docs example
-eventlet.monkey_patch()
-
 app = Flask(__name__)
 
 # configure SECRET_KEY, SQLALCHEMY_DATABASE_URI and MQTT credentials in separate config.py file, 'import' them
 app.config.from_pyfile("../instance/config.py")
+# any of them can be overridden by FLASK_-prefixed environment variables
+# e.g. FLASK_SQLALCHEMY_DATABASE_URI, which the tests point at a copy of the database (see tests/conftest.py)
+app.config.from_prefixed_env()
 
 # connecting to and manipulating (CRUD) the app's database
 db = SQLAlchemy(app)
@@ -24,7 +22,9 @@ login_manager = LoginManager(app)
 bcrypt = Bcrypt(app)
 
 # for MQTT, initialising the web app as an MQTT client
-mqtt = Mqtt(app=app, connect_async=True)
+# it connects to the broker once the web app is launched (see run.py), so importing the app
+# (e.g. from manager.py, or the tests) does not connect it
+mqtt = Mqtt(connect_async=True)
 # enabling use of WebSockets in the web app for flow of MQTT alert messages from server to client and vice-versa
 socketio = SocketIO(app)
 
@@ -36,5 +36,4 @@ login_manager.login_view = "home"
 # flash a default message telling the user they need to log in
 login_manager.login_message_category = "info"
 
-from . import mqtts
 from . import routes
@@ -1,3 +1,4 @@
+import calendar
 from datetime import datetime
 import phonenumbers
 
@@ -8,12 +9,13 @@ from wtforms import (
     DateField,
     PasswordField,
     SelectField,
+    SelectMultipleField,
     StringField,
     SubmitField,
     TimeField,
     IntegerField,
 )
-from wtforms.validators import Email, InputRequired, Length, ValidationError
+from wtforms.validators import Email, InputRequired, Length, Optional, ValidationError
 from wtforms_sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
 
 from app.models import Card, Sentry, Shift, PatrolPath, Checkpoint
@@ -227,6 +229,98 @@ class CircuitGenerationForm(FlaskForm):
         return True
 
 
+class ShiftScheduleForm(FlaskForm):
+    """
+    Shift pattern collection form to generate the circuits of many shifts at once
+    """
+
+    from_date = DateField(
+        "From",
+        default=datetime.date(datetime.now()),
+        validators=[InputRequired(), validate_date],
+    )
+    to_date = DateField(
+        "To",
+        default=datetime.date(datetime.now()),
+        validators=[InputRequired(), validate_date],
+    )
+    start_times = StringField(
+        "Shift Start Times",
+        validators=[InputRequired()],
+        description="format: HH:MM, comma-separated e.g. 06:00, 18:00",
+    )
+    weekdays = SelectMultipleField(
+        "Days",
+        choices=list(enumerate(calendar.day_name)),
+        default=list(range(7)),
+        coerce=int,
+        validators=[InputRequired()],
+    )
+    shift_dur_hour = SelectField(
+        "Shift Duration (Hours)",
+        validators=[InputRequired()],
+        choices=range(1, 24),
+        validate_choice=True,
+    )
+    shift_dur_min = SelectField(
+        "Shift Duration (Minutes)",
+        validators=[InputRequired()],
+        choices=range(60),
+        validate_choice=True,
+    )
+    shift_sentries = QuerySelectMultipleField(
+        "Sentries",
+        query_factory=lambda: Sentry.query.all(),
+        allow_blank=False,
+        get_label="full_name",
+        validators=[InputRequired()],
+    )
+    shift_cards = QuerySelectMultipleField(
+        "Cards",
+        query_factory=lambda: Card.query.all(),
+        allow_blank=False,
+        get_label="alias",
+        validators=[InputRequired()],
+    )
+    shift_paths = QuerySelectMultipleField(
+        "Patrol Paths",
+        query_factory=lambda: PatrolPath.query.all(),
+        allow_blank=False,
+        validators=[InputRequired()],
+    )
+    submit = SubmitField("Schedule Shifts")
+
+    def validate_start_times(self, start_times):
+        try:
+            self.parsed_start_times = sorted(
+                {
+                    datetime.strptime(start.strip(), "%H:%M").time()
+                    for start in start_times.data.split(",")
+                    if start.strip()
+                }
+            )
+        except ValueError as error:
+            raise ValidationError("Input start times as HH:MM, comma-separated.") from error
+
+        if not self.parsed_start_times:
+            raise ValidationError("Input at least one start time.")
+
+    def validate(self, extra_validators=None):
+        valid = FlaskForm.validate(self)
+        if not valid:
+            return False
+
+        if self.to_date.data < self.from_date.data:
+            self.to_date.errors.append("Invalid date range.")
+            return False
+
+        if (self.to_date.data - self.from_date.data).days > 366:
+            self.to_date.errors.append("Schedule at most a year at a time.")
+            return False
+
+        return True
+
+
 class CircuitSelectionForm(FlaskForm):
     """
     Circuit selection from pre-defined circuits
@@ -244,6 +338,50 @@ class CircuitSelectionForm(FlaskForm):
     submit = SubmitField("Select Circuit")
 
 
+class ShiftLogFilterForm(FlaskForm):
+    """
+    Date range of the saved shifts to list, submitted as query parameters
+    """
+
+    class Meta:
+        # only filters the listing (GET)
+        csrf = False
+
+    from_date = DateField("From", validators=[Optional()])
+    to_date = DateField("To", validators=[Optional()])
+    submit = SubmitField("Filter")
+
+    def validate_to_date(self, to_date):
+        if self.from_date.data and to_date.data and to_date.data < self.from_date.data:
+            raise ValidationError("End date must be on or after the start date.")
+
+
+class CircuitReplanForm(FlaskForm):
+    """
+    Mid-shift changes to the circuit being monitored, to re-plan the rest of the shift around
+    """
+
+    # choices (the on-duty sentries' cards) are set by the view, from the circuit being monitored
+    off_duty = SelectMultipleField("Sentries Going Off Duty", choices=[])
+    blocked_paths = QuerySelectMultipleField(
+        "Blocked Patrol Paths",
+        query_factory=lambda: PatrolPath.query.all(),
+        allow_blank=False,
+    )
+    submit = SubmitField("Re-plan Shift")
+
+    def validate(self, extra_validators=None):
+        valid = FlaskForm.validate(self)
+        if not valid:
+            return False
+
+        if not self.off_duty.data and not self.blocked_paths.data:
+            self.blocked_paths.errors.append("Select an off-duty sentry or a blocked path.")
+            return False
+
+        return True
+
+
 class CheckpointRegistrationForm(FlaskForm):
     """
     Registration form for Premises' Checkpoints
@@ -0,0 +1,443 @@
+"""
+    Background job runner for circuit generation
+    keeps slow circuit generation off the web app's request handlers by running it on a pool of worker processes
+"""
+
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.sharedctypes import RawArray
+
+from sqlalchemy.exc import IntegrityError
+
+import appcore.utils as utils
+from app import app, db
+
+from .models import Shift
+
+# process pool the circuits are generated on, created on first use so that importing the app
+# (e.g. from manager.py) does not start any worker processes
+EXECUTOR = None
+
+# the worker processes report their progress through a table of shared memory 'slots', one per job
+# (shared memory is used instead of a multiprocessing.Manager as its proxies deadlock under eventlet)
+# a slot is held until none of the job's tasks is running, so this many jobs can be followed at once
+# (jobs submitted while no slot is free are run all the same, without reporting their progress)
+PROGRESS_SLOTS = 64
+# the values held in each slot
+PROGRESS_FIELDS = ("attempts", "covered", "required", "spread", "max_spread")
+# the shared progress table, PROGRESS_SLOTS * len(PROGRESS_FIELDS) doubles
+PROGRESS = None
+# the progress slots not held by any job
+FREE_SLOTS: list[int] = list(range(PROGRESS_SLOTS))
+
+# submitted jobs, {job ID: job info dict}
+# finished jobs are forgotten CIRCUIT_JOB_TTL seconds after they finish (see _evict_jobs)
+# job info format:
+# {
+#     status: "running", "done" or "failed"
+#     submitted: time (epoch) at which the job was submitted
+#     finished: time (epoch) at which the job finished, None while running
+#     total: number of circuits (shifts) to generate
+#     completed: number of circuits generated so far
+#     results: the generated circuit of each sub-circuit of each shift, in submission order
+#     parts_left: number of sub-circuits of each shift still being generated
+#     tasks_left: number of the job's tasks (sub-circuits of all shifts) still running, failed or not
+#     shift_ids: database IDs of the created shifts, once done
+#     message: reason for failure, or a warning about the generated circuits' quality
+#     assignments: the (name, card alias, card ID) sentry assignments, saved with the shifts
+#     slots: the job's progress slots, one per sub-circuit (single-shift jobs only, empty otherwise)
+#            handed back (emptied) once none of the job's tasks is running
+#     progress: the final progress report, once finished
+# }
+JOBS: dict[str, dict] = {}
+
+# progress table as seen by a worker process, set when the worker starts
+_WORKER_PROGRESS = None
+
+
+def _init_worker(progress) -> None:
+    """
+    runs when a worker process starts, keeps a reference to the shared progress table
+    """
+
+    global _WORKER_PROGRESS
+    _WORKER_PROGRESS = progress
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    returns the worker process pool, creating it (and the shared progress table) if need be
+    """
+
+    global EXECUTOR
+    global PROGRESS
+
+    # a pool one of whose worker processes died (e.g. killed for running out of memory) fails every
+    # task submitted to it from then on, it is replaced by a new one
+    if EXECUTOR is not None and EXECUTOR._broken:
+        EXECUTOR.shutdown(wait=False)
+        EXECUTOR = None
+
+    if PROGRESS is None:
+        PROGRESS = RawArray("d", PROGRESS_SLOTS * len(PROGRESS_FIELDS))
+
+    if EXECUTOR is None:
+        EXECUTOR = ProcessPoolExecutor(
+            max_workers=app.config.get("CIRCUIT_WORKERS"),
+            initializer=_init_worker,
+            initargs=(PROGRESS,),
+        )
+
+    return EXECUTOR
+
+
+def _read_progress(slots: list[int]) -> dict:
+    """
+    reads a job's progress from its slots in the shared progress table, empty until the first attempt is done
+    the progress of a shift's sub-circuits is combined (see _combine_quality)
+    """
+
+    qualities = []
+
+    for slot in slots:
+        offset = slot * len(PROGRESS_FIELDS)
+        values = PROGRESS[offset : offset + len(PROGRESS_FIELDS)]
+
+        if not values[0]:
+            return {}
+
+        quality = {field: int(value) for field, value in zip(PROGRESS_FIELDS, values)}
+        quality["max_spread"] = values[-1]
+        quality["valid"] = (
+            quality["covered"] == quality["required"] and quality["spread"] <= quality["max_spread"]
+        )
+        qualities.append(quality)
+
+    return {"attempts": sum(quality.pop("attempts") for quality in qualities)} | _combine_quality(
+        qualities
+    )
+
+
+def _combine_quality(qualities: list[dict]) -> dict:
+    """
+    combines the circuit_quality reports of a shift's sub-circuits, each sub-circuit is judged on its own:
+    paths covered and required add up, the spread (and its target) of the sub-circuit furthest over
+    its target is kept, and the shift is valid only if every sub-circuit is
+    """
+
+    worst = max(qualities, key=lambda quality: quality["spread"] - quality["max_spread"])
+
+    return {
+        "covered": sum(quality["covered"] for quality in qualities),
+        "required": sum(quality["required"] for quality in qualities),
+        "spread": worst["spread"],
+        "max_spread": worst["max_spread"],
+        "valid": all(quality["valid"] for quality in qualities),
+    }
+
+
+def _split_shift(shift_info: dict) -> list[dict]:
+    """
+    splits a shift's generate_circuit keyword arguments into those of each of its sub-circuits
+    """
+
+    circuit_count, sub_circuits = utils.validate_paths(path_dict=shift_info["checkpoints"])
+
+    if circuit_count == 1:
+        return [shift_info]
+
+    return [
+        shift_info | {"sentries": sentries, "checkpoints": checkpoints}
+        for sentries, checkpoints in utils.split_circuit(
+            shift_info["sentries"], shift_info["checkpoints"], sub_circuits
+        )
+    ]
+
+
+def _merge_shift(part_results: list[tuple]) -> tuple:
+    """
+    merges the generated circuits of a shift's sub-circuits, returns the merged circuit and its quality
+    """
+
+    start, end, paths, circuit = utils.merge_circuits([result[:4] for result in part_results])
+    quality = _combine_quality([result[4] for result in part_results])
+    return start, end, paths, circuit, quality
+
+
+def _generate(slot: int, shift_info: dict, candidates: int, time_budget: float):
+    """
+    runs on a worker process, generates the circuit and reports progress to the shared progress table
+    progress is not reported if slot is None
+    """
+
+    on_progress = None
+
+    if slot is not None:
+        offset = slot * len(PROGRESS_FIELDS)
+
+        def on_progress(attempts: int, quality: dict) -> None:
+            # attempts is written last, readers treat a non-zero attempt count as 'progress available'
+            for index, field in enumerate(PROGRESS_FIELDS[1:], start=1):
+                _WORKER_PROGRESS[offset + index] = quality[field]
+            _WORKER_PROGRESS[offset] = attempts
+
+    # if configured, many candidate circuits are generated at once and the best one is kept
+    if candidates > 1:
+        start, end, paths, circuit = utils.generate_circuit_batch(
+            **shift_info, candidates=candidates, time_budget=time_budget, on_progress=on_progress
+        )
+    else:
+        start, end, paths, circuit = utils.generate_circuit(
+            **shift_info, time_budget=time_budget, on_progress=on_progress
+        )
+
+    quality = utils.circuit_quality(path_freqs=paths, checkpoints=shift_info["checkpoints"])
+    return start, end, paths, circuit, quality
+
+
+def save_shifts(assignments: list[tuple], results: list[tuple]) -> tuple[list[int], str]:
+    """
+    creates the database entries for generated circuits in a single transaction
+    returns the created shifts' IDs and a warning message (empty if none)
+    """
+
+    with app.app_context():
+        created_routes = [
+            Shift(
+                shift_start=start,
+                shift_end=end,
+                sentries=assignments,
+                circuit=circuit,
+                path_freqs=paths,
+            )
+            for start, end, paths, circuit, _ in results
+        ]
+
+        # push them to the database at once
+        db.session.add_all(created_routes)
+        db.session.commit()
+
+        shift_ids = [created_route.id for created_route in created_routes]
+
+    # generation is bounded, so let the supervisor know if the best circuits found fall short
+    short = [quality for *_, quality in results if not quality["valid"]]
+
+    if not short:
+        message = ""
+    elif len(results) == 1:
+        quality = short[0]
+        message = (
+            f"Circuit patrols {quality['covered']} of {quality['required']} paths with a "
+            f"frequency spread of {quality['spread']} (target: {quality['max_spread']:.1f} or less). "
+            "Consider a longer shift or fewer paths."
+        )
+    else:
+        message = (
+            f"{len(short)} of {len(results)} circuits do not patrol every path evenly. "
+            "Consider longer shifts or fewer paths."
+        )
+
+    return shift_ids, message
+
+
+def _release_slots(job: dict) -> None:
+    """
+    hands a job's progress slots back for other jobs to use, keeping the job's final progress
+    """
+
+    if job["slots"]:
+        job["progress"] = _read_progress(job["slots"])
+        FREE_SLOTS.extend(job["slots"])
+        job["slots"] = []
+
+
+def _collect_circuit(job_id: str, shift_no: int, part_no: int, future: Future) -> None:
+    """
+    called as each sub-circuit of each of a job's shifts is generated (or fails to be)
+    merges a shift's sub-circuits once all are done, and saves all the job's shifts once the last one is done
+    """
+
+    job = JOBS[job_id]
+
+    # the slots are only handed back once no worker process can write to them any more
+    job["tasks_left"] -= 1
+    if not job["tasks_left"]:
+        _release_slots(job)
+
+    # the job failed before this sub-circuit was generated
+    if job["status"] != "running":
+        return
+
+    if (error := future.exception()) is not None:
+        job["status"] = "failed"
+        job["message"] = f"Circuit generation failed: {error}"
+        job["finished"] = time.time()
+        return
+
+    job["results"][shift_no][part_no] = future.result()
+    job["parts_left"][shift_no] -= 1
+
+    if job["parts_left"][shift_no]:
+        return
+
+    job["results"][shift_no] = _merge_shift(job["results"][shift_no])
+    job["completed"] += 1
+
+    if job["completed"] < job["total"]:
+        return
+
+    try:
+        job["shift_ids"], job["message"] = save_shifts(job["assignments"], job["results"])
+    except IntegrityError:
+        # the transaction is rolled back as the app context is torn down, no shift is saved
+        job["status"] = "failed"
+        job["message"] = "A shift starting at one of those times already exists."
+        return
+    finally:
+        # the circuits are in the database (or discarded), no need to hold on to them
+        job["results"] = None
+        job["finished"] = time.time()
+
+    job["status"] = "done"
+
+
+def _evict_jobs() -> None:
+    """
+    forgets the jobs that finished over CIRCUIT_JOB_TTL seconds ago, so JOBS does not grow for as long as
+    the web app runs. called as jobs are submitted and polled
+    a failed job is kept until its remaining tasks are done, so that they can hand back its progress slots
+    """
+
+    expired = time.time() - app.config.get("CIRCUIT_JOB_TTL", 600)
+
+    # the jobs are collected (and finished) on the executor's thread
+    for job_id, job in list(JOBS.items()):
+        if job["finished"] is not None and job["finished"] < expired and not job["tasks_left"]:
+            JOBS.pop(job_id, None)
+
+
+def _submit(shift_infos: list[dict], track_progress: bool) -> str:
+    """
+    submits a job generating one circuit per shift_info to the worker processes, returns the job's ID
+    each sub-circuit of each shift is generated as a separate task, so they are generated concurrently
+    """
+
+    _evict_jobs()
+
+    executor = _get_executor()
+    job_id = uuid.uuid4().hex
+
+    split_infos = [_split_shift(shift_info) for shift_info in shift_infos]
+    slots = []
+
+    # the job's progress is not reported if there are not enough free slots for all its sub-circuits
+    if track_progress and len(FREE_SLOTS) >= len(split_infos[0]):
+        for _ in split_infos[0]:
+            slot = FREE_SLOTS.pop()
+            # clearing the slot of any progress from the job that last used it
+            offset = slot * len(PROGRESS_FIELDS)
+            PROGRESS[offset : offset + len(PROGRESS_FIELDS)] = [0.0] * len(PROGRESS_FIELDS)
+            slots.append(slot)
+
+    JOBS[job_id] = {
+        "status": "running",
+        "submitted": time.time(),
+        "finished": None,
+        "total": len(shift_infos),
+        "completed": 0,
+        "results": [[None] * len(part_infos) for part_infos in split_infos],
+        "parts_left": [len(part_infos) for part_infos in split_infos],
+        "tasks_left": sum(len(part_infos) for part_infos in split_infos),
+        "shift_ids": [],
+        "message": "",
+        "assignments": shift_infos[0]["sentries"],
+        "slots": slots,
+    }
+
+    for shift_no, part_infos in enumerate(split_infos):
+        for part_no, part_info in enumerate(part_infos):
+            future = executor.submit(
+                _generate,
+                slots[part_no] if slots else None,
+                part_info,
+                app.config.get("CIRCUIT_CANDIDATES", 1),
+                app.config.get("CIRCUIT_TIME_BUDGET"),
+            )
+            future.add_done_callback(
+                lambda done, shift_no=shift_no, part_no=part_no: _collect_circuit(
+                    job_id, shift_no, part_no, done
+                )
+            )
+
+    return job_id
+
+
+def submit_circuit(shift_info: dict) -> str:
+    """
+    submits a circuit generation job, shift_info holds the keyword arguments for generate_circuit
+    the shift is saved to the database automatically once generated, returns the job's ID
+    """
+
+    return _submit([shift_info], track_progress=True)
+
+
+def submit_schedule(shift_infos: list[dict]) -> str:
+    """
+    submits a bulk scheduling job, generating the circuits of many shifts in parallel
+    the shifts are saved to the database in a single transaction once all are generated, returns the job's ID
+    """
+
+    return _submit(shift_infos, track_progress=False)
+
+
+def generate_shifts(shift_infos: list[dict]) -> list[tuple]:
+    """
+    generates the circuits of many shifts in parallel and waits for them all (used by manager.py)
+    returns the generate_circuit outputs along with each circuit's quality, in order
+    """
+
+    split_infos = [_split_shift(shift_info) for shift_info in shift_infos]
+    part_infos = [part_info for parts in split_infos for part_info in parts]
+
+    # a pool of its own, shut down once done so that the calling script can exit
+    with ProcessPoolExecutor(max_workers=app.config.get("CIRCUIT_WORKERS")) as executor:
+        part_results = iter(
+            executor.map(
+                _generate,
+                [None] * len(part_infos),
+                part_infos,
+                [app.config.get("CIRCUIT_CANDIDATES", 1)] * len(part_infos),
+                [app.config.get("CIRCUIT_TIME_BUDGET")] * len(part_infos),
+            )
+        )
+
+        return [_merge_shift([next(part_results) for _ in parts]) for parts in split_infos]
+
+
+def job_status(job_id: str) -> dict:
+    """
+    returns the status and progress of a submitted job, None if there is no such job (or it was forgotten)
+    """
+
+    _evict_jobs()
+
+    if (job := JOBS.get(job_id)) is None:
+        return None
+
+    if "progress" in job:
+        progress = job["progress"]
+    elif job["slots"]:
+        progress = _read_progress(job["slots"])
+    else:
+        progress = {}
+
+    return {
+        "status": job["status"],
+        "elapsed": round((job["finished"] or time.time()) - job["submitted"], 1),
+        "total": job["total"],
+        "completed": job["completed"],
+        "shift_ids": job["shift_ids"],
+        "message": job["message"],
+        "progress": progress,
+    }
@@ -2,10 +2,11 @@ from ast import literal_eval
 from datetime import datetime
 
 from flask_login import UserMixin
-from sqlalchemy import Boolean, Column, Integer, String, Text, ForeignKey, UniqueConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, Index, Integer, String, Text, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import deferred, relationship
 
 from app import db, login_manager
+from appcore.circuits import dump_circuit, load_circuit
 
 
 # to manage supervisor's login session
@@ -39,14 +40,19 @@ class Card(db.Model):
 
 class Shift(db.Model):
     __tablename__ = "shifts"
+    # the shifts still to be monitored (see CircuitSelectionForm in forms.py)
+    # the shift logs are paged by shift_start, indexed by its unique constraint
+    __table_args__ = (Index("ix_shifts_completed_shift_end", "completed", "shift_end"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     shift_start = Column(Integer, nullable=False, unique=True)
     shift_end = Column(Integer, nullable=False)
     _sentries_on_duty = Column(Text, nullable=False)
-    _circuit = Column(Text, nullable=False)
-    _path_freqs = Column(Text, nullable=False)
-    _alarms = Column(Text, nullable=False, default="[]")
+    # the large columns are only loaded (together) when one of them is first read,
+    # so listing shifts doesn't load every shift's circuit
+    _circuit = deferred(Column(Text, nullable=False), group="blobs")
+    _path_freqs = deferred(Column(Text, nullable=False), group="blobs")
+    _alarms = deferred(Column(Text, nullable=False, default="[]"), group="blobs")
     completed = Column(Boolean, nullable=False, default=False)
 
     # since one cannot store data structures (dicts, lists) in the database,
@@ -66,14 +72,15 @@ class Shift(db.Model):
     def sentries(self, on_duty):
         self._sentries_on_duty = str(on_duty)
 
-    # originally a list of dicts
+    # a list of SentryRoute (see circuits.py), stored in its compact JSON form
+    # (circuits saved as 'stringified' lists of dicts are still read, and converted when next saved)
     @property
     def circuit(self):
-        return literal_eval(self._circuit)
+        return load_circuit(self._circuit)
 
     @circuit.setter
     def circuit(self, route):
-        self._circuit = str(route)
+        self._circuit = dump_circuit(route)
 
     # originally a list of tuples
     @property
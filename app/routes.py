@@ -1,17 +1,24 @@
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import contextlib
 
-from flask import flash, redirect, render_template, request, url_for
+from flask import abort, flash, jsonify, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
+from flask_socketio import join_room
 from sqlalchemy.exc import IntegrityError
 
-import app.utils as utils
+import app.jobs as jobs
+import appcore.alerts as alerts
+import appcore.circuits as circuits
+import appcore.metrics as metrics
+import appcore.utils as utils
+import appcore.wire as wire
 from app import app, bcrypt, db, mqtt, socketio
 
 from .forms import (
     CardRegistrationForm,
     CircuitGenerationForm,
+    CircuitReplanForm,
     CircuitSelectionForm,
     LoginForm,
     SentryRegistrationForm,
@@ -19,16 +26,23 @@ from .forms import (
     UpdateSentryForm,
     CheckpointRegistrationForm,
     PathCreationForm,
+    ShiftLogFilterForm,
+    ShiftScheduleForm,
 )
 
 from .models import Card, Sentry, Shift, Supervisor, Checkpoint, PatrolPath
-from .mqtts import (
+from appcore.mqtts import (
     ALARM,
     ALERTS,
+    ALERTS_BATCH,
     CHKS_OVERDUE,
+    CIRCUIT_RESEND,
     CONNECTED,
     DONE,
+    HANDLER_METRICS,
     SHIFT_ON_OFF,
+    MONITOR_CIRCUIT_UPDATE,
+    MONITOR_CIRCUIT_WINDOW,
     MONITOR_SENTRY_CIRCUIT,
     OUTSIDE_SHIFT_SCAN,
 )
@@ -39,10 +53,20 @@ SHIFT_STATUS = False
 CURRENT_CIRCUIT = None
 # stores the generated circuit currently being monitored
 SENTRY_CIRCUIT = None
+# stores the index of SENTRY_CIRCUIT's check-ins by card, checkpoint and time, to mark validated scans
+CIRCUIT_INDEX = None
 # flag indicating whether the current shift has been completed, set if circuit_handler says so
 CIRCUIT_COMPLETED = False
 # stores the path patrol frequency list ('paths' variable in 'generate_route' function in 'utils.py')
 PATHS = None
+# stores the adjacency dictionary of the circuit currently being monitored, used to re-plan it mid-shift
+CHECKPOINTS = None
+# stores the paths ((checkpoint, checkpoint) pairs) blocked mid-shift, avoided by every re-plan of the shift
+BLOCKED_PATHS = set()
+# stores the generator of the windows of the circuit being monitored (see circuit_windows in circuits.py)
+CIRCUIT_STREAM = None
+# stores the time (epoch) up to which the circuit being monitored has been sent to the circuit handler
+STREAMED_UNTIL = 0
 # stores the start time of the generated circuit shift (from the DB)
 START = 0
 # stores the end time of the generated circuit shift (from the DB)
@@ -52,6 +76,9 @@ END = 0
 ALARMS = None
 # flag indicating whether the alarm has been raised or not
 ALARM_TRIGGERED = False
+# stores the IDs of the registered RFID cards, to tell unknown from stolen cards without querying the DB
+# on every invalid scan, reloaded whenever a card is registered, updated or deleted (see reload_registered_cards)
+REGISTERED_CARDS = set()
 
 # CONNECTION FLAGS
 # these will display connected (green) or disconnected (red) on the homepage
@@ -61,14 +88,49 @@ ALARM_TRIGGERED = False
 APP_CONNECTED = False
 # circuit handler connected to broker
 HANDLER_CONNECTED = False
+# connected circuit handler shards (when the handler is sharded), the handler is connected if any is
+HANDLER_SHARDS = set()
 # Checkpoint connection to broker
 CHK_CONNECTED = {}
 
+# METRICS (see metrics.py), rendered on the /metrics endpoint
+WEB_METRICS = metrics.Registry()
+# MQTT messages handled, and how long each took to handle, by topic
+MQTT_MESSAGES = WEB_METRICS.counter(
+    "sentry_web_mqtt_messages_total", "MQTT messages handled by the web app.", ["topic"]
+)
+MQTT_MESSAGE_SECONDS = WEB_METRICS.histogram(
+    "sentry_web_mqtt_message_seconds",
+    "Time taken by the web app to handle an MQTT message.",
+    ["topic"],
+)
+# Socket.IO events sent to the frontend, by event
+SOCKETIO_EMITS = WEB_METRICS.counter(
+    "sentry_web_socketio_emits_total", "Socket.IO events emitted to the frontend.", ["event"]
+)
+# the latest metrics published by the circuit handler (or each shard) {client ID: metric families}
+HANDLER_METRICS_SNAPSHOTS = {}
+# alerts merged or dropped by the full alert queue (see alerts.py), by outcome
+ALERTS_OVERFLOW = WEB_METRICS.counter(
+    "sentry_web_alerts_overflow_total",
+    "Alerts merged or dropped because the alert queue was full.",
+    ["outcome"],
+)
+
+# ALERT DELIVERY (see alerts.py)
+# every logged-in supervisor's browser is in the site's room, and in the room of the shift being monitored
+# alerts of the shift go to the shift's room, the others (e.g. scans outside a shift) to the site's
+SITE_ROOM = "site"
+# Socket.IO session IDs of the logged-in supervisors' browsers, added to a shift's room when it is selected
+SUPERVISOR_SOCKETS = set()
+
 with app.app_context():
     # Loading the default checkpoint connection state for the setup checkpoints
     CHK_CONNECTED = {
         chkpt.id: {"name": chkpt.name, "conn": False} for chkpt in Checkpoint.query.all()
     }
+    # and the registered cards
+    REGISTERED_CARDS = {card.rfid_id for card in Card.query.all()}
 
 
 # UTILITY FUNCTIONS FOR THE FRONTEND
@@ -101,6 +163,127 @@ def derive_time(epoch: int):
     return datetime.fromtimestamp(epoch).strftime("%H:%M:%S")
 
 
+def invalid_scan_tag(reason: str, card_id: str, cards) -> str:
+    """
+    returns the alert tag of an invalid scan, given the circuit handler's reason and the registered cards' IDs
+    (REGISTERED_CARDS)
+    """
+
+    # if card was not on duty, check if card is in database
+    # if so, assume card was stolen
+    # if not, unknown card
+    if reason == "card not on duty":
+        return "UNKNOWN CARD" if card_id not in cards else "STOLEN CARD"
+
+    return reason.upper()
+
+
+def reload_registered_cards() -> None:
+    """
+    reloads the registered cards' IDs from the database, once a card is registered, updated or deleted
+    the set is replaced rather than updated, so the MQTT callbacks always see a complete one
+    """
+
+    global REGISTERED_CARDS
+    REGISTERED_CARDS = {card.rfid_id for card in Card.query.all()}
+
+
+def emit(event: str, data, to: str = None) -> None:
+    """
+    sends an event to the frontend over Socket.IO (to the browsers in room 'to', every browser if None),
+    counted in the metrics
+    """
+
+    SOCKETIO_EMITS.inc(event=event)
+    socketio.emit(event, data=data, to=to)
+
+
+# batches the alerts sent to the frontend, a short window (seconds) at a time
+ALERT_DISPATCHER = alerts.AlertDispatcher(
+    emit=emit,
+    window=app.config.get("ALERT_WINDOW", 0.25),
+    capacity=app.config.get("ALERT_QUEUE_SIZE", 500),
+    policy=app.config.get("ALERT_OVERFLOW", "merge"),
+    on_overflow=lambda outcome: ALERTS_OVERFLOW.inc(outcome=outcome),
+)
+# run as a background task once the web app is launched (see run.py)
+
+
+def shift_room(circuit_id: int) -> str:
+    """
+    returns the Socket.IO room of a shift's alerts
+    """
+
+    return f"shift-{circuit_id}"
+
+
+def send_alert(level: str, tag: str, text: str = "", room: str = None, **fields) -> None:
+    """
+    queues an alert for the frontend (see alerts.py), to 'room' if given,
+    else to the room of the shift being monitored (the site's if there is none)
+    """
+
+    if room is None:
+        room = SITE_ROOM if CURRENT_CIRCUIT is None else shift_room(CURRENT_CIRCUIT)
+
+    ALERT_DISPATCHER.push(room, alerts.alert(level, tag, text, **fields))
+
+
+def send_circuit_deltas(deltas: list[dict]) -> None:
+    """
+    sends changes of the circuit being monitored to its page (view-current-circuit.html), in the shift's room,
+    so the page is updated in place rather than re-rendered
+    each change is one of:
+        {card: card ID, index: of the check-in in the sentry's route, status: "checked" or "overdue"}
+        {completed: true} once the shift is complete
+        {replanned: true} once routes are re-planned (the page is reloaded)
+    """
+
+    if deltas and CURRENT_CIRCUIT is not None:
+        emit("circuit-deltas", deltas, to=shift_room(CURRENT_CIRCUIT))
+
+
+def encode_circuit_message(message: dict):
+    """
+    encodes a circuit message to the circuit handler in the configured wire format (see wire.py)
+    binary by default, JSON if CIRCUIT_WIRE_FORMAT is set to "json" (e.g. to read them while debugging)
+    """
+
+    return wire.encode_message(
+        message, binary=app.config.get("CIRCUIT_WIRE_FORMAT", "binary") != "json"
+    )
+
+
+def publish_circuit_windows(stream):
+    """
+    sends the circuit being monitored to the circuit handler a window at a time as the shift goes on,
+    each window is sent when half of the one before it is left. runs as a background task until the
+    last window is sent, or until another circuit is selected or the circuit is deselected
+    """
+
+    global STREAMED_UNTIL
+
+    lead = app.config.get("CIRCUIT_WINDOW", 3600) / 2
+
+    while True:
+        socketio.sleep(max(STREAMED_UNTIL - lead - datetime.timestamp(datetime.now()), 0))
+
+        # a different circuit (or none) is being monitored now
+        if CIRCUIT_STREAM is not stream:
+            return
+
+        until, final, routes = next(stream)
+        STREAMED_UNTIL = until
+        mqtt.publish(
+            topic=MONITOR_CIRCUIT_WINDOW,
+            payload=encode_circuit_message({"until": until, "final": final, "routes": routes}),
+            qos=2,
+        )
+
+        if final:
+            return
+
+
 # WEB APP ROUTES
 
 
@@ -176,41 +359,124 @@ def create_route():
 
             path_dict = utils.generate_adjacency_graph(path_objs=form.shift_paths.data)
 
-            # TODO:
-            # circuit_count, sub_circuits = utils.validate_paths(path_dict=path_dict)
+            # the paths may form several sub-circuits, each needs at least one sentry
+            circuit_count, _ = utils.validate_paths(path_dict=path_dict)
 
-            if not utils.validate_paths(path_dict=path_dict):
-                flash("Invalid: select paths that form a single, complete circuit.", "danger")
+            if circuit_count > len(assignments):
+                flash(
+                    f"Invalid: the selected paths form {circuit_count} separate sub-circuits, "
+                    "select at least one sentry per sub-circuit.",
+                    "danger",
+                )
                 return redirect(url_for("create_route"))
 
-            # retrieve start time, end time, path patrol frequencies and full circuit from generate_circuit output
-            start, end, paths, circuit = utils.generate_circuit(
-                sentries=assignments,
-                checkpoints=path_dict,
-                start_date=date,
-                start_time=time,
-                shift_dur_hour=hours,
-                shift_dur_min=minutes,
+            shift_info = {
+                "sentries": assignments,
+                "checkpoints": path_dict,
+                "start_date": date,
+                "start_time": time,
+                "shift_dur_hour": hours,
+                "shift_dur_min": minutes,
+            }
+
+            # the circuit is generated on a background worker process and saved to the database once done
+            job_id = jobs.submit_circuit(shift_info=shift_info)
+
+            # flash message and redirect to follow the generation's progress
+            flash("Circuit generation started.", "info")
+            return redirect(url_for("view_circuit_job", job_id=job_id))
+
+    return render_template("generate-route.html", title="Generate Route", form=form)
+
+
+@app.route("/circuit/schedule", methods=["GET", "POST"])
+@login_required  # ensures that supervisor is logged in to access
+def schedule_shifts():
+    """
+    handles the logic of the webpage responsible for generating the circuits of many shifts at once
+    i.e. every shift in a date range following a shift pattern
+    """
+
+    form = ShiftScheduleForm()
+
+    if form.validate_on_submit():
+        sentries = form.shift_sentries.data
+        cards = form.shift_cards.data
+        # number of assigned sentries and cards must be equal, flash message and reload page
+        if len(cards) != len(sentries):
+            flash(
+                "Number of selected sentries and cards must be equal.",
+                "danger",
             )
+        else:
+            assignments = [
+                (sentries[x].full_name, cards[x].alias, cards[x].rfid_id) for x in range(len(cards))
+            ]
+
+            path_dict = utils.generate_adjacency_graph(path_objs=form.shift_paths.data)
+
+            # the paths may form several sub-circuits, each needs at least one sentry
+            circuit_count, _ = utils.validate_paths(path_dict=path_dict)
+
+            if circuit_count > len(assignments):
+                flash(
+                    f"Invalid: the selected paths form {circuit_count} separate sub-circuits, "
+                    "select at least one sentry per sub-circuit.",
+                    "danger",
+                )
+                return redirect(url_for("schedule_shifts"))
 
-            # create a database entry for the generated circuit
-            created_route = Shift(
-                shift_start=start,
-                shift_end=end,
+            shift_infos = utils.plan_shift_schedule(
                 sentries=assignments,
-                circuit=circuit,
-                path_freqs=paths,
+                checkpoints=path_dict,
+                start_date=form.from_date.data,
+                end_date=form.to_date.data,
+                start_times=form.parsed_start_times,
+                weekdays=form.weekdays.data,
+                shift_dur_hour=int(form.shift_dur_hour.data),
+                shift_dur_min=int(form.shift_dur_min.data),
+                taken={start for start, in db.session.query(Shift.shift_start)},
             )
 
-            # push it to the database
-            db.session.add(created_route)
-            db.session.commit()
+            if not shift_infos:
+                flash("No new shifts to schedule in that date range.", "info")
+                return redirect(url_for("schedule_shifts"))
 
-            # flash success message and redirect to view/monitor the route
-            flash("Circuit generated.", "success")
-            return redirect(url_for("view_current_route"))
+            # the circuits are generated in parallel on background worker processes
+            # and all the shifts are saved to the database at once when done
+            job_id = jobs.submit_schedule(shift_infos=shift_infos)
 
-    return render_template("generate-route.html", title="Generate Route", form=form)
+            flash(f"Generating circuits for {len(shift_infos)} shifts.", "info")
+            return redirect(url_for("view_circuit_job", job_id=job_id))
+
+    return render_template("schedule-shifts.html", title="Schedule Shifts", form=form)
+
+
+@app.route("/circuit/jobs/<job_id>")
+@login_required  # ensures that supervisor is logged in to access
+def view_circuit_job(job_id):
+    """
+    renders the webpage for following the progress of a circuit generation job
+    """
+
+    if jobs.job_status(job_id) is None:
+        abort(404)
+
+    return render_template("circuit-job.html", title="Generating Circuit", job_id=job_id)
+
+
+@app.route("/circuit/jobs/<job_id>/status")
+@login_required  # ensures that supervisor is logged in to access
+def circuit_job_status(job_id):
+    """
+    returns the status and progress (attempts, best spread so far) of a circuit generation job as JSON
+    polled by the circuit generation progress webpage
+    """
+
+    if (status := jobs.job_status(job_id)) is None:
+        abort(404)
+
+    return jsonify(status)
 
 
 @app.route("/circuit/view")
@@ -218,6 +484,7 @@ def create_route():
 def view_current_route():
     """
     renders the webpage for viewing the current circuit being monitored
+    the page is then kept up to date by the changes sent to it (see send_circuit_deltas)
     """
 
     if PATHS is None or SENTRY_CIRCUIT is None:
@@ -235,7 +502,7 @@ def view_current_route():
         for path in PATHS
     ]
     sentry_routes = [
-        [CHK_CONNECTED[route["checkpoint"]]["name"] for route in sentry["route"]]
+        [CHK_CONNECTED[checkpoint]["name"] for checkpoint in sentry.checkpoints]
         for sentry in SENTRY_CIRCUIT
     ]
 
@@ -248,6 +515,8 @@ def view_current_route():
         start=START,
         end=END,
         completed=CIRCUIT_COMPLETED,
+        # check-ins expected before then and not checked are overdue
+        overdue_before=int(datetime.timestamp(datetime.now())) - utils.CHECK_IN_WINDOW,
     )
 
 
@@ -260,6 +529,8 @@ def save_current_circuit():
 
     circuit = Shift.query.get_or_404(CURRENT_CIRCUIT)
     circuit.circuit = SENTRY_CIRCUIT
+    # the frequencies change with the routes when the circuit is re-planned mid-shift
+    circuit.path_freqs = PATHS
     db.session.commit()
     flash("Current circuit saved.", "success")
     return redirect(url_for("view_current_route"))
@@ -282,10 +553,27 @@ def select_circuit():
         SHIFT_STATUS = True
         global CURRENT_CIRCUIT
         CURRENT_CIRCUIT = circuit.id
+        # the supervisors' browsers get the shift's alerts
+        for sid in list(SUPERVISOR_SOCKETS):
+            socketio.server.enter_room(sid, shift_room(CURRENT_CIRCUIT), namespace="/")
         global SENTRY_CIRCUIT
         SENTRY_CIRCUIT = circuit.circuit
+        global CIRCUIT_INDEX
+        CIRCUIT_INDEX = circuits.CircuitIndex(SENTRY_CIRCUIT)
         global PATHS
         PATHS = circuit.path_freqs
+        global CHECKPOINTS
+        path_pairs = {path for path, _ in PATHS}
+        CHECKPOINTS = utils.generate_adjacency_graph(
+            path_objs=[
+                path
+                for path in PatrolPath.query.all()
+                if (path.chkpt_src, path.chkpt_dest) in path_pairs
+                or (path.chkpt_dest, path.chkpt_src) in path_pairs
+            ]
+        )
+        global BLOCKED_PATHS
+        BLOCKED_PATHS = set()
         global START
         START = circuit.shift_start
         global END
@@ -301,7 +589,24 @@ def select_circuit():
         mqtt.publish(topic=SHIFT_ON_OFF, payload="ON", qos=2, retain=True)
 
         # send(publish) the current circuit being monitored to the circuit handler
-        mqtt.publish(topic=MONITOR_SENTRY_CIRCUIT, payload=json.dumps(SENTRY_CIRCUIT), qos=2)
+        # only the first window (e.g. the next hour) of check-ins is sent now, the rest follows in the background
+        # as the shift goes on, so the messages are the same size however long the shift
+        global CIRCUIT_STREAM
+        global STREAMED_UNTIL
+        CIRCUIT_STREAM = circuits.circuit_windows(
+            circuit=SENTRY_CIRCUIT,
+            since=int(datetime.timestamp(datetime.now())),
+            window=app.config.get("CIRCUIT_WINDOW", 3600),
+        )
+        until, final, routes = next(CIRCUIT_STREAM)
+        STREAMED_UNTIL = until
+        mqtt.publish(
+            topic=MONITOR_SENTRY_CIRCUIT,
+            payload=encode_circuit_message({"until": until, "final": final, "routes": routes}),
+            qos=2,
+        )
+        if not final:
+            socketio.start_background_task(publish_circuit_windows, CIRCUIT_STREAM)
 
         flash("Shift set!", "success")
         return redirect(url_for("view_current_route"))
@@ -313,6 +618,76 @@ def select_circuit():
     )
 
 
+@app.route("/circuit/replan", methods=["GET", "POST"])
+@login_required  # ensures that supervisor is logged in to access
+def replan_circuit():
+    """
+    handles the logic for webpage displaying interface to re-plan the rest of the shift being monitored
+    i.e. when a sentry goes off duty or a patrol path becomes blocked mid-shift
+    """
+
+    if SENTRY_CIRCUIT is None:
+        flash("Select a shift to monitor first.", "info")
+        return redirect(url_for("select_circuit"))
+
+    now = int(datetime.timestamp(datetime.now()))
+
+    form = CircuitReplanForm()
+    # only sentries still patrolling can go off duty
+    form.off_duty.choices = [
+        (sentry.id, f"{sentry.name} ({sentry.card})")
+        for sentry in SENTRY_CIRCUIT
+        if sentry.times[-1] > now
+    ]
+
+    if form.validate_on_submit():
+        if now >= END:
+            flash("Shift is over, nothing left to re-plan.", "info")
+            return redirect(url_for("view_current_route"))
+
+        global PATHS
+        BLOCKED_PATHS.update((path.chkpt_src, path.chkpt_dest) for path in form.blocked_paths.data)
+
+        # only the routes' tails (from now) are re-planned, the routes are updated in place
+        PATHS, updates = utils.replan_circuit(
+            circuits=SENTRY_CIRCUIT,
+            checkpoints=CHECKPOINTS,
+            path_freqs=PATHS,
+            now=now,
+            shift_end=END,
+            off_duty=set(form.off_duty.data),
+            blocked=BLOCKED_PATHS,
+            until=STREAMED_UNTIL,
+        )
+
+        # re-index the changed routes
+        changed = {update["id"] for update in updates}
+        for route in SENTRY_CIRCUIT:
+            if route.id in changed:
+                CIRCUIT_INDEX.reindex(route)
+
+        # send(publish) only the changed route tails to the circuit handler
+        if updates:
+            mqtt.publish(
+                topic=MONITOR_CIRCUIT_UPDATE,
+                payload=encode_circuit_message({"from": now, "routes": updates}),
+                qos=2,
+            )
+
+        # the circuit's page is reloaded for the re-planned routes
+        if updates:
+            send_circuit_deltas([{"replanned": True}])
+
+        flash(f"Re-planned the routes of {len(updates)} sentries.", "success")
+        return redirect(url_for("view_current_route"))
+
+    return render_template(
+        "replan-circuit.html",
+        title="Re-plan Shift",
+        form=form,
+    )
+
+
 @app.route("/circuit/deselect")
 @login_required  # ensures that supervisor is logged in to access
 def deselect_circuit():
@@ -323,9 +698,21 @@ def deselect_circuit():
     global SHIFT_STATUS
     SHIFT_STATUS = False
     global CURRENT_CIRCUIT
+    if CURRENT_CIRCUIT is not None:
+        # the shift's alerts still queued are sent before its room is closed
+        ALERT_DISPATCHER.flush()
+        socketio.close_room(shift_room(CURRENT_CIRCUIT), namespace="/")
     CURRENT_CIRCUIT = None
     global SENTRY_CIRCUIT
     SENTRY_CIRCUIT = None
+    global CIRCUIT_INDEX
+    CIRCUIT_INDEX = None
+    global CHECKPOINTS
+    CHECKPOINTS = None
+    global BLOCKED_PATHS
+    BLOCKED_PATHS = set()
+    global CIRCUIT_STREAM
+    CIRCUIT_STREAM = None
     global START
     START = 0
     global END
@@ -344,12 +731,44 @@ def deselect_circuit():
 @login_required  # ensures that supervisor is logged in to access
 def view_all_circuits():
     """
-    renders the webpage for viewing all saved circuits
+    renders the webpage for viewing all saved circuits, newest first, a page at a time
+    the pages are keyset-paginated by shift start: ?after=<shift start> for the shifts before it (older),
+    ?before=<shift start> for those after it (newer), optionally filtered by date (from_date, to_date)
     """
 
-    # query all saved shifts/circuits from the database
-    shifts = Shift.query.all()
-    return render_template("view-all-circuits.html", circuits=shifts)
+    form = ShiftLogFilterForm(formdata=request.args)
+    page_size = app.config.get("SHIFT_LOG_PAGE_SIZE", 25)
+
+    # filter by the dates the shifts start on
+    shifts = Shift.query
+    if form.validate():
+        if form.from_date.data:
+            since = datetime.combine(form.from_date.data, datetime.min.time())
+            shifts = shifts.filter(Shift.shift_start >= int(since.timestamp()))
+        if form.to_date.data:
+            until = datetime.combine(form.to_date.data + timedelta(days=1), datetime.min.time())
+            shifts = shifts.filter(Shift.shift_start < int(until.timestamp()))
+
+    # newest first, a page at a time
+    page, newer, older = utils.keyset_page(
+        shifts,
+        Shift.shift_start,
+        page_size,
+        before=request.args.get("before", type=int),
+        after=request.args.get("after", type=int),
+    )
+
+    return render_template(
+        "view-all-circuits.html",
+        circuits=page,
+        form=form,
+        newer=newer,
+        older=older,
+        # kept in the links to the other pages
+        filters={
+            name: request.args[name] for name in ("from_date", "to_date") if name in request.args
+        },
+    )
 
 
 @app.route("/circuit/logs/<int:shift_id>")
@@ -366,7 +785,7 @@ def view_one_circuit(shift_id):
         for path in shift.path_freqs
     ]
     sentry_routes = [
-        [CHK_CONNECTED[route["checkpoint"]]["name"] for route in sentry["route"]]
+        [CHK_CONNECTED[checkpoint]["name"] for checkpoint in sentry.checkpoints]
         for sentry in shift.circuit
     ]
     return render_template(
@@ -504,6 +923,7 @@ def register_card():
         card = Card(rfid_id=form.rfid_id.data.lower(), alias=form.alias.data)
         db.session.add(card)
         db.session.commit()
+        reload_registered_cards()
         flash("Card registered successfully.", "success")
         return redirect(url_for("home"))
 
@@ -530,7 +950,10 @@ def update_card(card_id):
     if form.validate_on_submit():
         # save changes to DB
         form.populate_obj(card)
+        # card IDs are kept in lowercase, as when registered
+        card.rfid_id = card.rfid_id.lower()
         db.session.commit()
+        reload_registered_cards()
         flash("Card information updated.", "success")
         return redirect(url_for("home"))
 
@@ -552,6 +975,7 @@ def delete_card(card_id):
     card = Card.query.get_or_404(card_id)
     db.session.delete(card)
     db.session.commit()
+    reload_registered_cards()
     flash("Card Deleted.", "danger")
     return redirect(url_for("view_all_cards"))
 
@@ -681,6 +1105,19 @@ def logout():
     return redirect(url_for("home"))
 
 
+@app.route("/metrics")
+def view_metrics():
+    """
+    the web app's metrics, and the latest ones of the circuit handler (or each shard), labelled by handler,
+    in the Prometheus text format, for Prometheus (or an operator) to scrape
+    """
+
+    sources = [(WEB_METRICS.collect(), {})] + [
+        (families, {"handler": handler}) for handler, families in HANDLER_METRICS_SNAPSHOTS.items()
+    ]
+    return metrics.render(sources), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
 @mqtt.on_connect()
 def on_mqtt_connect(client, userdata, flags, rc):
     """
@@ -692,7 +1129,16 @@ def on_mqtt_connect(client, userdata, flags, rc):
     # rc = return code (CONNACK). on successful connection, rc = 0; subscribe to everything
     if rc == 0:
         APP_CONNECTED = True
-        for topic in [CHKS_OVERDUE, CONNECTED, ALERTS, DONE, OUTSIDE_SHIFT_SCAN]:
+        for topic in [
+            CHKS_OVERDUE,
+            CONNECTED,
+            ALERTS,
+            ALERTS_BATCH,
+            DONE,
+            OUTSIDE_SHIFT_SCAN,
+            CIRCUIT_RESEND,
+            HANDLER_METRICS,
+        ]:
             mqtt.subscribe(topic=topic, qos=2)
 
 
@@ -704,6 +1150,7 @@ def on_mqtt_disconnect():
 
 
 @mqtt.on_message()
+@metrics.measure_messages(messages=MQTT_MESSAGES, seconds=MQTT_MESSAGE_SECONDS)
 def on_mqtt_message(client, userdata, message):
     """
     callback event handler, called when a message is published on any subscribed topic
@@ -737,6 +1184,16 @@ def on_mqtt_message(client, userdata, message):
                 case "circuit-handler":
                     global HANDLER_CONNECTED
                     HANDLER_CONNECTED = bool(connected)
+                    if not connected:
+                        HANDLER_METRICS_SNAPSHOTS.pop(client, None)
+                case _ if client.startswith("circuit-handler-"):
+                    # one of the handler's shards (see circuit_handler.py)
+                    if connected:
+                        HANDLER_SHARDS.add(client)
+                    else:
+                        HANDLER_SHARDS.discard(client)
+                        HANDLER_METRICS_SNAPSHOTS.pop(client, None)
+                    HANDLER_CONNECTED = bool(HANDLER_SHARDS)
                 case _:
                     if client[:11] == "Checkpoint-":
                         chkid = int(client[11:])
@@ -760,11 +1217,18 @@ def on_mqtt_message(client, userdata, message):
         # this will be in layout.html so the message can be flashed regardless of what webpage the supervisor is on
 
         id, chk, time, _ = list(payload.values())
+
+        # mark the check-in overdue on the circuit's page
+        if CIRCUIT_INDEX is not None:
+            found = CIRCUIT_INDEX.find(card=id, checkpoint=chk, time=time, window=0)
+            if found is not None:
+                send_circuit_deltas([{"card": id, "index": found[1], "status": "overdue"}])
+
         # since time is stored as epoch, convert it to a readable format
         time = datetime.fromtimestamp(time).strftime("%H:%M:%S")
 
-        # HTML message to display
-        message = f"<strong>OVERDUE CHECK-IN!</strong> Sentry with card ID: {id.upper()} expected at checkpoint {chk} at {time}."
+        # message to display
+        text = f"Sentry with card ID: {id.upper()} expected at checkpoint {chk} at {time}."
 
         # set global alarm triggered flag
         ALARM_TRIGGERED = True
@@ -774,7 +1238,7 @@ def on_mqtt_message(client, userdata, message):
         mqtt.publish(topic=ALARM, payload="ON", qos=2)
 
         # send the message to the frontend to be displayed
-        socketio.emit("alert-msgs", data={"alert_level": "alert-danger", "message": message})
+        send_alert("danger", "OVERDUE CHECK-IN", text, card=id, checkpoint=chk)
 
     elif topic == ALERTS:
         payload: dict = json.loads(message.payload)
@@ -796,33 +1260,34 @@ def on_mqtt_message(client, userdata, message):
             # remove the 'valid' and 'reason' keys from the payload dict, then send to be updated
             # i.e pick last 3 (indices 2, 3 and 4 -> chk, id and time)
             scan_info = list(payload.values())[2:]
-            utils.update_circuit(circuits=SENTRY_CIRCUIT, scan_info=scan_info)
+            position = None
+            if CIRCUIT_INDEX is not None:
+                position = utils.update_circuit(index=CIRCUIT_INDEX, scan_info=scan_info)
 
-            message = f"<strong>SUCCESSFUL CHECK-IN!</strong> Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}."
+            text = f"Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}."
 
             # send the message to the frontend
-            socketio.emit("alert-msgs", data={"alert_level": "alert-success", "message": message})
+            send_alert("success", "SUCCESSFUL CHECK-IN", text, card=id, checkpoint=chk)
             # and to the checkpoint
             mqtt.publish(topic=chk_publish_topic, payload=1, qos=2)
 
-        else:
-            # if card was not on duty, check if card is in database
-            # if so, assume card was stolen
-            # if not, unknown card
+            if position is not None:
+                # mark the check-in on the circuit's page
+                send_circuit_deltas([{"card": id, "index": position, "status": "checked"}])
+            else:
+                # the handler validated a check-in the circuit being monitored does not have
+                # (e.g. the handler monitors another circuit), so it can't be marked
+                app.logger.warning("unmatched check-in: %s", payload)
+                text = (
+                    f"Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}, "
+                    "not in the circuit being monitored."
+                )
+                send_alert("warning", "UNMATCHED CHECK-IN", text, card=id, checkpoint=chk)
 
+        else:
+            # if card was not on duty, check if card is registered
             # else, show alert message
-            if reason == "card not on duty":
-                # query all registered RFID cards from the database
-                app.app_context().push()
-                cards = Card.query.all()
-                # obtaining their card IDs
-                cards = [card.rfid_id for card in cards]
-
-                # if card is in database but should not be on duty, assume card is stolen
-                # if not, card is unknown
-                tag = "UNKNOWN CARD" if id not in cards else "STOLEN CARD"
-            else:
-                tag = reason.upper()
+            tag = invalid_scan_tag(reason=reason, card_id=id, cards=REGISTERED_CARDS)
 
             # raise alarm
             ALARM_TRIGGERED = True
@@ -845,41 +1310,117 @@ def on_mqtt_message(client, userdata, message):
             mqtt.publish(topic=ALARM, payload="ON", qos=2)
 
             # send message to frontend
-            message = f"<strong>{tag}!</strong> Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}."
-            socketio.emit("alert-msgs", data={"alert_level": "alert-danger", "message": message})
+            text = f"Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}."
+            send_alert("danger", tag, text, card=id, checkpoint=chk)
+
+    # alerts of a batch of scans (e.g. buffered by a checkpoint while it was disconnected), applied at once
+    elif topic == ALERTS_BATCH:
+        payload: list = json.loads(message.payload)
+
+        # expected payload (JSON string): a list of alerts of the same form as those on ALERTS,
+        # in order of scan time
+        # the scans are in the past, so no responses are sent to the checkpoints
+
+        valid = [list(result.values())[2:] for result in payload if result["valid"]]
+        invalid = [list(result.values())[1:] for result in payload if not result["valid"]]
+
+        if valid:
+            deltas = []
+            if CIRCUIT_INDEX is not None:
+                for scan_info in valid:
+                    position = utils.update_circuit(index=CIRCUIT_INDEX, scan_info=scan_info)
+                    if position is not None:
+                        deltas.append(
+                            {"card": scan_info[1], "index": position, "status": "checked"}
+                        )
+            unmatched = len(valid) - len(deltas)
+
+            send_alert("success", f"{len(valid)} BUFFERED CHECK-INS VALIDATED")
+            # mark the check-ins on the circuit's page, all at once
+            send_circuit_deltas(deltas)
+
+            # reported once for the whole batch
+            if unmatched:
+                app.logger.warning("%d unmatched buffered check-ins", unmatched)
+                text = "Not in the circuit being monitored."
+                send_alert("warning", f"{unmatched} UNMATCHED CHECK-INS", text)
+
+        if invalid:
+            # raise alarm, once for the whole batch
+            ALARM_TRIGGERED = True
+            if ALARMS is not None:
+                ALARMS.append(datetime.now().strftime("%H:%M:%S"))
+            mqtt.publish(topic=ALARM, payload="ON", qos=2)
+
+            # send a message per invalid scan to the frontend (delivered together, see alerts.py)
+            for reason, chk, id, time in invalid:
+                tag = invalid_scan_tag(reason=reason, card_id=id, cards=REGISTERED_CARDS)
+                time = datetime.fromtimestamp(time).strftime("%H:%M:%S")
+                text = (
+                    f"Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}."
+                )
+                send_alert("danger", tag, text, card=id, checkpoint=chk)
 
     # alert that there has been a scan when no shift is ongoing
     elif topic == OUTSIDE_SHIFT_SCAN:
-        # inform supervisor on frontend
-        socketio.emit(
-            "alert-msgs",
-            data={
-                "alert_level": "alert-danger",
-                "message": "<strong>SCAN DETECTED OUTSIDE SHIFT PERIOD!</strong>",
-            },
-        )
+        # inform supervisors on frontend, site-wide since no shift is ongoing
+        send_alert("danger", "SCAN DETECTED OUTSIDE SHIFT PERIOD", room=SITE_ROOM)
 
         # retrieve the scanned card's info transferred for identification
         payload: dict = json.loads(message.payload)
         chk, id, time = list(payload.values())
         time = datetime.fromtimestamp(time).strftime("%H:%M:%S")
 
-        # obtain all saved cards
-        app.app_context().push()
-        cards = Card.query.all()
-        # obtaining their card IDs
-        cards = [card.rfid_id for card in cards]
-
-        # assume card is either unknown (if not in DB) or stolen (if in DB)
-        tag = "UNKNOWN CARD" if id not in cards else "STOLEN CARD"
+        # assume card is either unknown (if not registered) or stolen (if registered)
+        tag = "UNKNOWN CARD" if id not in REGISTERED_CARDS else "STOLEN CARD"
 
         # raise alarm
         ALARM_TRIGGERED = True
         mqtt.publish(topic=ALARM, payload="ON", qos=2)
 
         # send message to frontend
-        message = f"<strong>{tag}!</strong> Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}."
-        socketio.emit("alert-msgs", data={"alert_level": "alert-danger", "message": message})
+        text = f"Sentry with card ID: {id.upper()} checked in at checkpoint {chk} at {time}."
+        send_alert("danger", tag, text, room=SITE_ROOM, card=id, checkpoint=chk)
+
+    # the circuit handler lost (or never had) the circuit being monitored, e.g. it restarted mid-shift
+    elif topic == CIRCUIT_RESEND:
+        # the handler has the circuit up to a given time, and missed the windows sent after it
+        # e.g. it restored the circuit from disk, payload of the form {since: end (epoch) of its circuit}
+        if SENTRY_CIRCUIT is not None and message.payload:
+            since = json.loads(message.payload)["since"]
+            until = max(STREAMED_UNTIL, since)
+            # the windows sent after 'since' as one, the handler skips the check-ins it already has
+            final, routes = circuits.circuit_window(
+                circuit=SENTRY_CIRCUIT, since=since, until=until
+            )
+            mqtt.publish(
+                topic=MONITOR_CIRCUIT_WINDOW,
+                payload=encode_circuit_message({"until": until, "final": final, "routes": routes}),
+                qos=2,
+            )
+
+        elif SENTRY_CIRCUIT is not None:
+            # the circuit from now up to where it has been streamed so far, the rest follows as usual
+            now = int(datetime.timestamp(datetime.now()))
+            until = max(STREAMED_UNTIL, now)
+            final, routes = circuits.circuit_window(circuit=SENTRY_CIRCUIT, since=now, until=until)
+            mqtt.publish(
+                topic=MONITOR_SENTRY_CIRCUIT,
+                payload=encode_circuit_message({"until": until, "final": final, "routes": routes}),
+                qos=2,
+            )
+
+    # the circuit handler's (or a shard's) metrics, rendered on /metrics alongside the web app's
+    elif topic == HANDLER_METRICS:
+        payload: dict = json.loads(message.payload)
+
+        # expected payload (JSON string) of the form:
+        # {
+        #   id: client ID of the handler (shard)
+        #   metrics: its metric families (see Registry.collect in metrics.py)
+        # }
+
+        HANDLER_METRICS_SNAPSHOTS[payload["id"]] = payload["metrics"]
 
     elif topic == DONE:
         global CIRCUIT_COMPLETED
@@ -893,8 +1434,33 @@ def on_mqtt_message(client, userdata, message):
         mqtt.publish(topic=SHIFT_ON_OFF, payload="OFF", qos=2, retain=True)
 
         # send message to frontend
-        message = "<strong>CIRCUIT COMPLETE!</strong> Save and exit."
-        socketio.emit("alert-msgs", data={"alert_level": "alert-success", "message": message})
+        send_alert("success", "CIRCUIT COMPLETE", "Save and exit.")
+        send_circuit_deltas([{"completed": True}])
+
+
+@socketio.on("connect")
+def join_alert_rooms():
+    """
+    adds a logged-in supervisor's browser to the rooms of the alerts it is sent (see alerts.py)
+    i.e. the site's room, and the room of the shift being monitored if any
+    """
+
+    if not current_user.is_authenticated:
+        return
+
+    SUPERVISOR_SOCKETS.add(request.sid)
+    join_room(SITE_ROOM)
+    if CURRENT_CIRCUIT is not None:
+        join_room(shift_room(CURRENT_CIRCUIT))
+
+
+@socketio.on("disconnect")
+def leave_alert_rooms():
+    """
+    forgets a supervisor's browser once it disconnects (Socket.IO takes it out of its rooms)
+    """
+
+    SUPERVISOR_SOCKETS.discard(request.sid)
 
 
 @socketio.on("silence-alarm")
@@ -0,0 +1,7 @@
+"""
+    the platform's modules that don't depend on Flask, shared by the web app (the app package) and the rest:
+    circuit generation (utils.py) and its data structures (circuits.py, samplers.py), the wire format (wire.py),
+    metrics (metrics.py), alert batching (alerts.py) and the MQTT topics (mqtts.py)
+    kept out of the app package so that the circuit handler, the command line tools (benchmark.py, loadtest.py)
+    and the tests import them without Flask, the web app's configuration or its database
+"""
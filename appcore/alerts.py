@@ -0,0 +1,121 @@
+"""
+    delivery of alerts (overdue check-ins, invalid scans, ...) to the supervisors' browsers over Socket.IO
+    the MQTT callbacks queue structured alerts, which are sent a short window at a time: each window's alerts
+    to a room (the site, or a shift) as one "alerts" event, so an alarm storm (e.g. every sentry overdue at once)
+    is a handful of frames rather than hundreds
+    the queue is bounded, once full new alerts are merged into queued ones or dropped (see AlertDispatcher)
+"""
+
+import threading
+import time
+
+# severity of each alert level (bootstrap's alert-<level>), the least severe alerts are dropped first
+LEVELS = {"success": 0, "info": 0, "warning": 1, "danger": 2}
+
+
+def alert(level: str, tag: str, text: str = "", **fields) -> dict:
+    """
+    returns a structured alert: its level, tag (e.g. OVERDUE CHECK-IN) and text, and the fields identifying
+    what it is about (e.g. card, checkpoint, time), rendered by the frontend (layout.html)
+    'count' is the number of alerts merged into it
+    """
+
+    return {"level": level, "tag": tag, "text": text, "count": 1} | fields
+
+
+class AlertDispatcher:
+    """
+    queues alerts by room and emits each room's queued alerts as one event, every 'window' seconds
+    (at once if 'window' is 0), with emit("alerts", alerts, to=room)
+    at most 'capacity' alerts are queued, what happens to an alert pushed once it is full depends on 'policy':
+        "merge": merged into the latest queued alert of the same room and tag (its count added up, its fields
+            the latest alert's), or handled as "drop" if there is none
+        "drop": the least severe queued alert is dropped to make room for it, or it is dropped itself
+            if it is no more severe than any queued alert
+    'on_overflow' is called with "merged" or "dropped" for each alert pushed once the queue is full
+    """
+
+    def __init__(self, emit, window=0.25, capacity=500, policy="merge", on_overflow=None):
+        if policy not in ("merge", "drop"):
+            raise ValueError(f"unknown alert overflow policy: {policy}")
+
+        self.emit = emit
+        self.window = window
+        self.capacity = capacity
+        self.policy = policy
+        self.on_overflow = on_overflow
+        # {room: [alert, ...]}, in order of arrival
+        self._queued = {}
+        self._size = 0
+        # alerts are pushed by the MQTT callbacks, and sent by the dispatcher's own task
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+
+    def push(self, room: str, alert: dict) -> None:
+        """
+        queues an alert for the browsers in 'room'
+        """
+
+        with self._lock:
+            if self._size < self.capacity:
+                self._queued.setdefault(room, []).append(alert)
+                self._size += 1
+                outcome = None
+            else:
+                outcome = self._overflow(room, alert)
+
+        if outcome is not None and self.on_overflow is not None:
+            self.on_overflow(outcome)
+
+        if not self.window:
+            self.flush()
+        else:
+            self._pending.set()
+
+    def _overflow(self, room: str, alert: dict) -> str:
+        """
+        applies the overflow policy to an alert pushed once the queue is full
+        """
+
+        if self.policy == "merge":
+            for queued in reversed(self._queued.get(room, ())):
+                if queued["tag"] == alert["tag"]:
+                    queued.update(alert, count=queued["count"] + alert["count"])
+                    return "merged"
+
+        # the least severe queued alert (the first found of those)
+        least = None
+        for queued_room, alerts in self._queued.items():
+            for index, queued in enumerate(alerts):
+                if least is None or LEVELS[queued["level"]] < LEVELS[least[2]["level"]]:
+                    least = (queued_room, index, queued)
+
+        if least is not None and LEVELS[alert["level"]] > LEVELS[least[2]["level"]]:
+            del self._queued[least[0]][least[1]]
+            self._queued.setdefault(room, []).append(alert)
+
+        return "dropped"
+
+    def flush(self) -> None:
+        """
+        sends every queued alert, one event per room
+        """
+
+        with self._lock:
+            queued, self._queued, self._size = self._queued, {}, 0
+            self._pending.clear()
+
+        for room, alerts in queued.items():
+            if alerts:
+                self.emit("alerts", alerts, to=room)
+
+    def run(self) -> None:
+        """
+        sends the queued alerts a window at a time, run as a background task
+        waits for the first alert of each window, so nothing is sent (and nothing wakes up) while there are none
+        """
+
+        while True:
+            self._pending.wait()
+            time.sleep(self.window)
+            self.flush()
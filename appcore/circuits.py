@@ -0,0 +1,413 @@
+"""
+    Compact (columnar) representation of a generated sentry circuit, i.e. each sentry's route
+    used by the route generation functions in utils.py, stored in the database (see Shift in models.py)
+    and sent to the circuit handler, the web app's index of the circuit being monitored,
+    and the circuit handler's index of the check-ins it expects
+"""
+
+import json
+from array import array
+from ast import literal_eval
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import itemgetter
+from typing import NamedTuple
+
+
+class CheckIn(NamedTuple):
+    """
+    a single check-in of a sentry's route, in the form read by the templates
+    (route.checkpoint, route.time, route.checked)
+    """
+
+    id: str
+    checkpoint: int
+    time: int
+    checked: bool
+
+
+class SentryRoute:
+    """
+    a sentry's route, stored as columns instead of one dict per check-in:
+    the checkpoint IDs and expected times (epoch) of the check-ins, and a bitset of which were checked
+    i.e. check-in i is (checkpoints[i], times[i], is_checked(i)), the card ID is kept once for the route
+    """
+
+    __slots__ = ("name", "card", "id", "checkpoints", "times", "_checked")
+
+    def __init__(
+        self,
+        name: str,
+        card: str,
+        id: str,
+        checkpoints=(),
+        times=(),
+        checked: bytes = b"",
+    ):
+        # sentry-on-duty name, alias of assigned card, ID of assigned card
+        self.name = name
+        self.card = card
+        self.id = id
+        self.checkpoints = array("l", checkpoints)
+        self.times = array("q", times)
+        # one bit per check-in, set once the sentry has validly checked in
+        self._checked = bytearray(checked)
+        self._checked.extend(bytes((len(self.checkpoints) + 7) // 8 - len(self._checked)))
+
+    def __len__(self) -> int:
+        return len(self.checkpoints)
+
+    def append(self, checkpoint: int, time: int) -> None:
+        """
+        adds a check-in (not yet checked) to the end of the route
+        """
+
+        self.checkpoints.append(checkpoint)
+        self.times.append(time)
+        if len(self.checkpoints) > len(self._checked) * 8:
+            self._checked.append(0)
+
+    def is_checked(self, index: int) -> bool:
+        """
+        whether the sentry has validly checked in at the check-in at 'index'
+        """
+
+        return bool(self._checked[index >> 3] & (1 << (index & 7)))
+
+    def check(self, index: int) -> None:
+        """
+        marks the check-in at 'index' as validly checked in
+        """
+
+        self._checked[index >> 3] |= 1 << (index & 7)
+
+    def truncate(self, index: int) -> None:
+        """
+        drops every check-in from 'index' onwards
+        """
+
+        del self.checkpoints[index:]
+        del self.times[index:]
+        del self._checked[(index + 7) // 8 :]
+        if index & 7:
+            self._checked[-1] &= (1 << (index & 7)) - 1
+
+    def split(self, time: int) -> int:
+        """
+        returns the index of the first check-in expected after 'time' (epoch)
+        """
+
+        return bisect_right(self.times, time)
+
+    def paths(self, start: int = 1) -> list[tuple[int, int]]:
+        """
+        returns the paths patrolled to reach the check-ins from 'start' onwards
+        """
+
+        return [
+            (self.checkpoints[index - 1], self.checkpoints[index])
+            for index in range(max(start, 1), len(self.checkpoints))
+        ]
+
+    @property
+    def route(self) -> list[CheckIn]:
+        """
+        the route as a list of check-ins, for rendering in the templates
+        """
+
+        return [
+            CheckIn(self.id, checkpoint, time, self.is_checked(index))
+            for index, (checkpoint, time) in enumerate(zip(self.checkpoints, self.times))
+        ]
+
+    def check_ins(self, start: int = 0) -> list[dict]:
+        """
+        returns the check-ins from 'start' onwards as check-in info dicts
+        {id, checkpoint, time, checked}, as queued by the circuit handler
+        """
+
+        return [
+            {
+                "id": self.id,
+                "checkpoint": self.checkpoints[index],
+                "time": self.times[index],
+                "checked": self.is_checked(index),
+            }
+            for index in range(start, len(self.checkpoints))
+        ]
+
+    def to_dict(self, start: int = 0, stop: int = None) -> dict:
+        """
+        returns the route (check-ins 'start' up to, not including, 'stop') as a compact JSON-serialisable dict
+        times are stored as the first time followed by the differences between consecutive times
+        (i.e. path durations, far shorter than epoch times), the checked bitset as a hex string
+        """
+
+        if stop is None:
+            stop = len(self.checkpoints)
+        times = self.times[start:stop]
+
+        # the checked bits of the check-ins from 'start' to 'stop', shifted down to start at bit 0
+        if start % 8 == 0:
+            checked = self._checked[start // 8 : (stop + 7) // 8]
+            if (stop - start) & 7 and checked:
+                checked[-1] &= (1 << ((stop - start) & 7)) - 1
+        else:
+            checked = bytearray((stop - start + 7) // 8)
+            for index in range(start, stop):
+                if self.is_checked(index):
+                    checked[(index - start) >> 3] |= 1 << ((index - start) & 7)
+
+        return {
+            "name": self.name,
+            "card": self.card,
+            "id": self.id,
+            "checkpoints": self.checkpoints[start:stop].tolist(),
+            "times": [times[0], *(later - earlier for earlier, later in zip(times, times[1:]))]
+            if times
+            else [],
+            "checked": checked.hex(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SentryRoute":
+        """
+        rebuilds a route from to_dict's output
+        also accepts the original (legacy) form, a dict with a 'route' list of check-in info dicts
+        """
+
+        if "route" in data:
+            route = cls(data.get("name"), data.get("card"), data["id"])
+            for check_in in data["route"]:
+                route.append(check_in["checkpoint"], check_in["time"])
+                if check_in["checked"]:
+                    route.check(len(route) - 1)
+            return route
+
+        return cls(
+            data.get("name"),
+            data.get("card"),
+            data["id"],
+            data["checkpoints"],
+            accumulate(data["times"]),
+            bytes.fromhex(data.get("checked", "")),
+        )
+
+
+def circuit_window(circuit: list[SentryRoute], since: int, until: int) -> tuple[bool, list[dict]]:
+    """
+    returns whether the circuit ends by 'until' (epoch), and each sentry's check-ins expected
+    after 'since' up to 'until' (SentryRoute.to_dict)
+    """
+
+    final = all(not route.times or route.times[-1] <= until for route in circuit)
+    return final, [
+        route.to_dict(start=route.split(since), stop=max(route.split(until), route.split(since)))
+        for route in circuit
+    ]
+
+
+def circuit_windows(circuit: list[SentryRoute], since: int, window: int):
+    """
+    resumable generator over a circuit's check-ins after 'since' (epoch), 'window' seconds at a time
+    yields (until, final, routes): the end of the window, whether it is the last window, and each sentry's
+    check-ins within the window (SentryRoute.to_dict), so a whole shift is never sent at once
+    each window starts where the last one ended by time rather than by position in the routes,
+    so routes re-planned in between (see replan_circuit in utils.py) are picked up as they are
+    """
+
+    until = since
+
+    while True:
+        since, until = until, until + window
+        final, routes = circuit_window(circuit, since, until)
+
+        yield until, final, routes
+
+        if final:
+            return
+
+
+def dump_circuit(circuit: list) -> str:
+    """
+    serialises a circuit (list of SentryRoute, or of legacy route dicts) to compact JSON text
+    """
+
+    return json.dumps(
+        [
+            (route if isinstance(route, SentryRoute) else SentryRoute.from_dict(route)).to_dict()
+            for route in circuit
+        ],
+        separators=(",", ":"),
+    )
+
+
+def load_circuit(text: str) -> list[SentryRoute]:
+    """
+    deserialises a circuit saved by dump_circuit
+    circuits saved before the compact form were 'stringified' python lists of dicts, read with literal_eval
+    """
+
+    try:
+        routes = json.loads(text)
+    except ValueError:
+        routes = literal_eval(text)
+
+    return [SentryRoute.from_dict(route) for route in routes]
+
+
+class CircuitIndex:
+    """
+    index of the check-ins of the circuit being monitored by the web app, by card, then checkpoint,
+    then expected time, so a validated scan's check-in is found by bisection rather than by walking every route
+    the check-ins are marked in the routes themselves (SentryRoute.check)
+    """
+
+    def __init__(self, circuit: list[SentryRoute]):
+        # {card ID: (route, {checkpoint: (times, indices)})}
+        # each checkpoint's expected times sorted, with the indices of those check-ins in the route
+        self._cards = {}
+        for route in circuit:
+            self.reindex(route)
+
+    def reindex(self, route: SentryRoute) -> None:
+        """
+        (re)indexes a route's check-ins, e.g. once its tail is re-planned
+        """
+
+        checkpoints = {}
+        # a route's check-ins are in time order, so are each checkpoint's
+        for index, (checkpoint, time) in enumerate(zip(route.checkpoints, route.times)):
+            times, indices = checkpoints.setdefault(checkpoint, (array("q"), array("l")))
+            times.append(time)
+            indices.append(index)
+
+        self._cards[route.id] = (route, checkpoints)
+
+    def find(self, card: str, checkpoint: int, time: int, window: int):
+        """
+        the route and index of the soonest check-in of 'card' at 'checkpoint' expected within 'window' seconds
+        of 'time', None if there is none
+        """
+
+        route, checkpoints = self._cards.get(card, (None, {}))
+        times, indices = checkpoints.get(checkpoint, ((), ()))
+        position = bisect_left(times, time - window)
+        if position < len(times) and times[position] <= time + window:
+            return route, indices[position]
+        return None
+
+
+class CheckInIndex:
+    """
+    index of the check-ins queued by the circuit handler, by card and by (card, checkpoint),
+    each sorted by expected time, so a scan is matched against the few check-ins of its card
+    around the scan time (bisect) rather than against the whole queue
+    the indexed check-ins are the queue's own dicts, so a check-in checked here is checked in the queue too
+    """
+
+    def __init__(self, check_ins=()):
+        # {card ID: (times, check-ins)} and {(card ID, checkpoint): (times, check-ins)}
+        # both lists of each entry sorted by (and kept in step with) the check-ins' expected times
+        self._by_card = {}
+        self._by_checkpoint = {}
+
+        # check-ins are mostly indexed all at once (a queue, a snapshot), so in time order each entry's
+        # lists are built by appending rather than by add()'s insertion
+        for check_in in sorted(check_ins, key=itemgetter("time")):
+            time = check_in["time"]
+            for index, key in (
+                (self._by_card, check_in["id"]),
+                (self._by_checkpoint, (check_in["id"], check_in["checkpoint"])),
+            ):
+                entry = index.get(key)
+                if entry is None:
+                    entry = index[key] = ([], [])
+                entry[0].append(time)
+                entry[1].append(check_in)
+
+    def _entries(self, check_in: dict):
+        return (
+            (self._by_card, check_in["id"]),
+            (self._by_checkpoint, (check_in["id"], check_in["checkpoint"])),
+        )
+
+    def add(self, check_in: dict) -> None:
+        """
+        indexes a queued check-in
+        """
+
+        for index, key in self._entries(check_in):
+            times, check_ins = index.setdefault(key, ([], []))
+            # check-ins are mostly added in time order, i.e. at the end
+            position = bisect_right(times, check_in["time"])
+            times.insert(position, check_in["time"])
+            check_ins.insert(position, check_in)
+
+    def remove(self, check_in: dict) -> None:
+        """
+        drops a check-in from the index, e.g. once it is popped off the queue
+        """
+
+        for index, key in self._entries(check_in):
+            if key not in index:
+                continue
+
+            times, check_ins = index[key]
+            position = bisect_left(times, check_in["time"])
+            # several check-ins may be expected at the same time, the very same dict is removed
+            while position < len(times) and check_ins[position] is not check_in:
+                position += 1
+            if position < len(times):
+                del times[position]
+                del check_ins[position]
+            if not times:
+                del index[key]
+
+    @staticmethod
+    def _soonest(entry, time: int, window: int):
+        """
+        the soonest check-in of an index entry expected within 'window' seconds of 'time', if any
+        """
+
+        times, check_ins = entry
+        position = bisect_left(times, time - window)
+        if position < len(times) and times[position] <= time + window:
+            return check_ins[position]
+        return None
+
+    def find(self, card: str, checkpoint: int, time: int, window: int):
+        """
+        the soonest check-in of 'card' at 'checkpoint' expected within 'window' seconds of 'time', if any
+        """
+
+        entry = self._by_checkpoint.get((card, checkpoint), ((), ()))
+        return self._soonest(entry, time, window)
+
+    def find_all(self, card: str, checkpoint: int, times: list[int], window: int) -> list:
+        """
+        the soonest check-in of 'card' at 'checkpoint' expected within 'window' seconds of each of 'times'
+        (sorted), None for those without one, found in a single merge pass over the card's check-ins
+        """
+
+        expected_times, check_ins = self._by_checkpoint.get((card, checkpoint), ((), ()))
+        found = []
+        position = 0
+
+        for time in times:
+            # the scans are sorted, so each search starts where the previous one ended
+            position = bisect_left(expected_times, time - window, lo=position)
+            found.append(
+                check_ins[position]
+                if position < len(expected_times) and expected_times[position] <= time + window
+                else None
+            )
+
+        return found
+
+    def expected(self, card: str, time: int, window: int) -> bool:
+        """
+        whether 'card' is expected at any checkpoint within 'window' seconds of 'time'
+        """
+
+        return self._soonest(self._by_card.get(card, ((), ())), time, window) is not None
@@ -0,0 +1,221 @@
+"""
+    Prometheus-style metrics of the web app and the circuit handler (counters, gauges and histograms),
+    rendered in the Prometheus text format on the web app's /metrics endpoint
+    the circuit handler publishes its metrics over MQTT (HANDLER_METRICS, see mqtts.py) every few seconds,
+    and the web app renders the latest ones of each handler (shard) alongside its own
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from .mqtts import split_shift_topic
+
+# content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds (seconds) of the histograms' buckets, Prometheus' defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    """
+    a metric family: a value per combination of its labels' values
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # {label values: value}
+        self._values = {}
+        # updated by the message callbacks, read by the endpoint (or the publishing loop)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def clear(self) -> None:
+        """
+        drops the values of every combination of labels, e.g. of shifts no longer monitored
+        """
+
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> list[list]:
+        """
+        the family's samples, [name, {label: value}, value]
+        """
+
+        with self._lock:
+            return [
+                [
+                    self.name,
+                    dict(zip(self.labels, key)),
+                    value.copy() if isinstance(value, list) else value,
+                ]
+                for key, value in self._values.items()
+            ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # [count per bucket (not cumulative) ... values above the last bucket, sum]
+            counts = self._values.setdefault(key, [0] * (len(BUCKETS) + 1) + [0.0])
+            counts[bisect_left(BUCKETS, value)] += 1
+            counts[-1] += value
+
+    def samples(self) -> list[list]:
+        samples = []
+        for name, labels, counts in super().samples():
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), counts):
+                cumulative += count
+                samples.append([f"{name}_bucket", labels | {"le": str(bound)}, cumulative])
+            samples.append([f"{name}_sum", labels, counts[-1]])
+            samples.append([f"{name}_count", labels, cumulative])
+        return samples
+
+
+class Registry:
+    """
+    the metrics of a process (the web app, or a circuit handler)
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def _register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=()) -> Histogram:
+        return self._register(Histogram(name, help, labels))
+
+    def collect(self) -> list[dict]:
+        """
+        every metric family with its samples, JSON-serialisable (as published by the circuit handler)
+        """
+
+        return [
+            {
+                "name": metric.name,
+                "type": metric.type,
+                "help": metric.help,
+                "samples": metric.samples(),
+            }
+            for metric in self.metrics
+        ]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(text: str) -> str:
+    # quotes are left as they are in help text
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    # Python spells infinity and NaN 'inf' and 'nan'
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(value)
+
+
+def render(sources: list[tuple[list[dict], dict]]) -> str:
+    """
+    renders metric families in the Prometheus text format
+    'sources' is a list of (families (Registry.collect), labels added to each of their samples) e.g. of
+    the web app and of each handler shard, the samples of a family found in several sources rendered together
+    """
+
+    families = {}
+    for collected, extra_labels in sources:
+        for family in collected:
+            entry = families.setdefault(family["name"], (family, []))
+            entry[1].extend(
+                (name, labels | extra_labels, value) for name, labels, value in family["samples"]
+            )
+
+    lines = []
+    for name, (family, samples) in families.items():
+        lines.append(f"# HELP {name} {_escape_help(family['help'])}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for sample_name, labels, value in samples:
+            label_text = ",".join(f'{label}="{_escape(str(v))}"' for label, v in labels.items())
+            value = _format_value(value)
+            lines.append(
+                f"{sample_name}{{{label_text}}} {value}" if labels else f"{sample_name} {value}"
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+def topic_label(topic: str) -> str:
+    """
+    the topic a message is counted under: per-shift topics under their topic without the shift key,
+    and every client's connected topic under one, so there are a handful of topics however many shifts
+    and clients there are
+    """
+
+    if topic.endswith("/connected"):
+        return "sentry-platform/+/connected"
+    return split_shift_topic(topic)[0]
+
+
+def measure_messages(messages: Counter, seconds: Histogram):
+    """
+    decorates an MQTT message callback (client, userdata, message) to count the messages it handles,
+    and time how long it takes to handle them, by topic (topic_label)
+    """
+
+    def decorator(callback):
+        @wraps(callback)
+        def measured(client, userdata, message):
+            started = time.perf_counter()
+            try:
+                return callback(client, userdata, message)
+            finally:
+                topic = topic_label(message.topic)
+                messages.inc(topic=topic)
+                seconds.observe(time.perf_counter() - started, topic=topic)
+
+        return measured
+
+    return decorator
@@ -0,0 +1,92 @@
+# SUBSCRIBE:
+
+# topic(s) to receive when a scan is overdue, for each checkpoint A, B, C, D
+CHKS_OVERDUE = "sentry-platform/circuit-handler/overdue-scan"
+
+# topic to receive a scan to validate
+SENTRY_SCAN_INFO = "sentry-platform/checkpoints/sentry-scan-info"
+
+# topic to receive a batch (JSON array) of scans to validate at once
+# e.g. the scans a checkpoint buffered while disconnected, uploaded once it reconnects
+SENTRY_SCAN_BATCH = "sentry-platform/checkpoints/sentry-scan-batch"
+
+# topic to receive connected message from circuit handler
+CONNECTED = "sentry-platform/+/connected"
+
+# topic to receive alerts from the circuit handler
+ALERTS = "sentry-platform/circuit-handler/alerts"
+
+# topic to receive the alerts of a batch of scans (SENTRY_SCAN_BATCH) at once from the circuit handler
+ALERTS_BATCH = "sentry-platform/circuit-handler/alerts-batch"
+
+# topic to receive message if the shift is done
+DONE = "sentry-platform/circuit-handler/circuit-complete"
+
+# topic to receive a circuit handler's request to re-send the circuit being monitored
+# e.g. when the handler restarts, or a handler shard takes over the shift (sharded handler)
+CIRCUIT_RESEND = "sentry-platform/circuit-handler/circuit-resend"
+
+# topic to receive the circuit handler's (or each shard's) metrics on, every few seconds (see metrics.py)
+HANDLER_METRICS = "sentry-platform/circuit-handler/metrics"
+
+# topic to receive message on an outside-of-shift scan
+OUTSIDE_SHIFT_SCAN = "sentry-platform/checkpoints/outside-shift-scan"
+
+# PUBLISH
+
+# topic to publish the shift started/over message
+SHIFT_ON_OFF = "sentry-platform/backend-server/shift-status"
+
+# topic to publish alarm/no alarm
+ALARM = "sentry-platform/backend-server/alarm"
+
+# topic to send the generated sentry circuit to the circuit handler
+MONITOR_SENTRY_CIRCUIT = "sentry-platform/backend-server/sentry-circuit"
+
+# topic to send the re-planned part of the sentry circuit (changed route tails only) to the circuit handler
+MONITOR_CIRCUIT_UPDATE = "sentry-platform/backend-server/sentry-circuit-update"
+
+# topic to send the next window (time span) of the sentry circuit being monitored to the circuit handler
+MONITOR_CIRCUIT_WINDOW = "sentry-platform/backend-server/sentry-circuit-window"
+
+
+# PER-SHIFT TOPICS
+
+# the circuit handler monitors many shifts (e.g. of different sites) at once
+# each shift's messages are sent/received on '<topic>/<shift key>', e.g. ".../sentry-circuit/site-a-42"
+# the topics above, without a shift key, are those of the default shift (the web app's single shift)
+SHIFT_TOPICS = (
+    SHIFT_ON_OFF,
+    ALARM,
+    MONITOR_SENTRY_CIRCUIT,
+    MONITOR_CIRCUIT_UPDATE,
+    MONITOR_CIRCUIT_WINDOW,
+    SENTRY_SCAN_INFO,
+    SENTRY_SCAN_BATCH,
+    CHKS_OVERDUE,
+    ALERTS,
+    ALERTS_BATCH,
+    DONE,
+    CIRCUIT_RESEND,
+)
+
+
+def shift_topic(topic: str, shift: str) -> str:
+    """
+    returns the topic of the given shift (key), the topic itself for the default shift ("")
+    """
+
+    return f"{topic}/{shift}" if shift else topic
+
+
+def split_shift_topic(topic: str) -> tuple[str, str | None]:
+    """
+    splits a per-shift topic into (topic, shift key), the shift key being "" for the default shift
+    and None if the topic is not a per-shift topic
+    """
+
+    if topic in SHIFT_TOPICS:
+        return topic, ""
+
+    base, _, shift = topic.rpartition("/")
+    return (base, shift) if base in SHIFT_TOPICS else (topic, None)
@@ -0,0 +1,132 @@
+"""
+    Data structures used by the route generation algorithm (see generate_circuit in utils.py)
+    to pick the next path of a sentry's route quickly
+"""
+
+import random
+import sys
+
+
+class PathSampler:
+    """
+    weighted random sampler over the paths out of a single checkpoint, backed by a Fenwick (binary indexed) tree
+    picking a path and changing a path's weight both take O(log d) time for a checkpoint with d paths,
+    unlike random.choices which rebuilds the cumulative weights on every pick
+    """
+
+    # when the total weight falls below this, all weights are scaled back up
+    # (repeatedly halving weights would otherwise underflow to zero on very long shifts)
+    RESCALE_BELOW = 1.0
+    RESCALE_BY = float(2**60)
+
+    def __init__(self, weights: list[float]):
+        self.size = len(weights)
+        self.weights = [float(weight) for weight in weights]
+
+        # highest power of two not above the size, the starting step of the tree search in sample()
+        self._top = 1 << (self.size.bit_length() - 1) if self.size else 0
+        self._build()
+
+    def _build(self) -> None:
+        """
+        builds the Fenwick tree from the weights in O(d)
+        """
+
+        # tree[i] holds the sum of weights[i - lowbit(i) : i] (1-indexed)
+        self._tree = [0.0] + self.weights
+        for index in range(1, self.size + 1):
+            parent = index + (index & -index)
+            if parent <= self.size:
+                self._tree[parent] += self._tree[index]
+
+    def total(self) -> float:
+        """
+        returns the sum of all weights
+        """
+
+        index = self.size
+        total = 0.0
+        while index:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def update(self, index: int, weight: float) -> None:
+        """
+        sets the weight of the path at 'index'
+        """
+
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+
+        index += 1
+        while index <= self.size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def scale(self, index: int, factor: float) -> None:
+        """
+        multiplies the weight of the path at 'index' by 'factor' (e.g. halves it after it has been taken)
+        """
+
+        self.update(index, self.weights[index] * factor)
+
+        if self.total() < self.RESCALE_BELOW:
+            self.weights = [weight * self.RESCALE_BY for weight in self.weights]
+            self._build()
+
+    def sample(self, rng: random.Random) -> int:
+        """
+        picks the index of a path at random, with probability proportional to its weight
+        """
+
+        target = rng.random() * self.total()
+
+        # descends the tree, finding the first index whose cumulative weight exceeds the target
+        position = 0
+        step = self._top
+        while step:
+            following = position + step
+            if following <= self.size and self._tree[following] <= target:
+                position = following
+                target -= self._tree[following]
+            step >>= 1
+
+        # guards against floating point rounding pushing the search past the last path
+        return min(position, self.size - 1)
+
+
+class CircuitGraph:
+    """
+    the adjacency dictionary (see generate_adjacency_graph in utils.py) preprocessed once per generation
+    so that attempts and steps do not rebuild lists out of it
+    """
+
+    def __init__(self, checkpoints: dict[int, list[tuple]]):
+        # all circuit checkpoints
+        self.checkpoints: list[int] = list(checkpoints.keys())
+        # each checkpoint's immediate neighbours, and the durations of the paths to them (same order)
+        self.neighbours: dict[int, tuple] = {
+            checkpoint: tuple(neighbour for neighbour, _ in check_paths)
+            for checkpoint, check_paths in checkpoints.items()
+        }
+        self.durations: dict[int, tuple] = {
+            checkpoint: tuple(duration for _, duration in check_paths)
+            for checkpoint, check_paths in checkpoints.items()
+        }
+        # all (directed) paths in the circuit
+        self.paths: list[tuple[int, int]] = [
+            (checkpoint, neighbour)
+            for checkpoint, neighbours in self.neighbours.items()
+            for neighbour in neighbours
+        ]
+
+    def samplers(self) -> dict[int, PathSampler]:
+        """
+        returns a fresh path sampler for every checkpoint, with all paths weighted equally
+        """
+
+        return {
+            checkpoint: PathSampler([sys.maxsize] * len(neighbours))
+            for checkpoint, neighbours in self.neighbours.items()
+        }
@@ -0,0 +1,930 @@
+"""
+    A set of utility functions used by the web app for certain operations
+"""
+
+import math
+import random
+import time
+from collections import Counter, deque
+from datetime import date, datetime, timedelta
+from datetime import time as time_of_day
+
+import numpy as np
+
+from .circuits import CircuitIndex, SentryRoute
+from .samplers import CircuitGraph
+
+# TIME WILL BE MANIPULATED IN EPOCH TIME - EASIER TO DO MATH (for the check-in timestamps and check-in window)
+
+
+# check-in window - x seconds before and after the set check-in time within which a scan is considered valid
+CHECK_IN_WINDOW = 30
+
+
+# route generation algorithm, builds the circuit constructively so that it finishes in bounded time
+# criteria for a valid route:
+# 1. all paths i.e A-B, B-C, C-D and D-A are patrolled
+# 2. the difference in frequency of the most patrolled path and the least
+#     patrolled path should not exceed the sqare root of the path count
+
+# WORKING OF THE ALGORITHM:
+# example route:
+# (abstract) A-B, B-C, C-D, D-A == [(A, B), (B, C), (C, D), (D, A)] (programmatic) -> [(first, second), ...]
+# the second path begins at the end of the first path (the following path begins at the end of the previous path)
+# at the beginning, no path is set so the 'second' is blank
+
+# meaning that, if no second checkpoint is set then the shift is yet to begin
+# hence the shift begins at 'start' defined above instead of at 'second'
+# so, 'first' is assigned to 'start'
+# if the shift has began, a second checkpoint must have been set
+# hence for the new path, 'first' is assigned to 'second' from the previous path
+
+# the 'second' checkpoint is picked from the immediate neighbours of 'first' defined in the adjacency dictionary
+# coverage and balance are built into the pick instead of being checked after the fact:
+# 1. if 'first' still has a path that nobody has patrolled yet, one of those paths is taken
+# 2. else, if some path elsewhere in the circuit is still unpatrolled, the sentry heads towards
+#     the nearest checkpoint that has one (shortest hop count, found by breadth-first search)
+# 3. else (every path is covered), the path is picked at random, weighted against how often each path
+#     has already been patrolled (a path's weight is halved every time it is taken), which keeps the
+#     path frequencies balanced. each checkpoint has its own weighted sampler (see samplers.py) so that
+#     picking a path and halving its weight stay cheap however long the shift
+
+# the two checkpoints are paired together, e.g. if 'first' is A and 'second' is B
+# they are paired as (A, B) and added to paths
+# therefore paths becomes [(A, B),...] and so on
+
+# for the check-in info, the time taken to patrol the path e.g. (A, B)
+# is got from the durations dictionary above, and added to the current shift time
+# e.g if it takes 600 seconds then current shift time (epoch) + 600
+# this means that for path (A, B), a sentry is expected at checkpoint B in the next 600 seconds
+# i.e. at current time + 600 seconds
+# the destination checkpoint and this derived timestamp are then added to the check-in info dictionary
+# along with marking checked as False as the sentry has not had a valid check-in
+
+# the current shift time is then updated to reflect the time offset
+# such that timings for subsequent paths use the offset time
+# as a reference to derive timestamps, mimicking a continuous shift
+
+# this process is done repeatedly until the current shift time goes beyond the shift end time, with each
+# check-in info dictionary stored in the routes list
+
+# after that, the same process is carried out for all sentries-on-duty (all IDs)
+# sentries start at different checkpoints (spread round-robin over the shuffled checkpoints)
+
+# after this, the frequency of occurrence of each path is obtained from the paths list and cross-checked
+# against the two criteria above (see circuit_quality)
+# a short shift or a very large circuit may make the criteria unattainable, so at most MAX_CIRCUIT_ATTEMPTS
+# circuits are built and the best one (most paths covered, then smallest frequency spread) is returned
+
+
+# upper bound on the number of complete circuits built before the best one so far is returned
+MAX_CIRCUIT_ATTEMPTS = 25
+
+
+def circuit_quality(path_freqs: list[tuple], checkpoints: dict[int, list[tuple]]) -> dict:
+    """
+    reports how close a generated circuit is to the valid route criteria
+    unpatrolled paths count as a frequency of 0 when calculating the spread
+    """
+
+    # Calculating the total possible paths
+    req_path_count = sum(len(check_paths) for check_paths in list(checkpoints.values()))
+
+    freqs = [freq for _, freq in path_freqs]
+    covered = len(freqs)
+
+    if not freqs:
+        spread = 0
+    elif covered < req_path_count:
+        spread = max(freqs)
+    else:
+        spread = max(freqs) - min(freqs)
+
+    max_spread = math.sqrt(req_path_count)
+
+    return {
+        "covered": covered,
+        "required": req_path_count,
+        "spread": spread,
+        "max_spread": max_spread,
+        "valid": covered == req_path_count and spread <= max_spread,
+    }
+
+
+def _next_hop_to_uncovered(
+    first: int, graph: CircuitGraph, uncovered_from: Counter, rng: random.Random
+) -> int:
+    """
+    breadth-first search from 'first' towards the nearest checkpoint that still has an unpatrolled path
+    returns the index (in checkpoints[first]) of the neighbour to move to next
+    """
+
+    # maps each reached checkpoint to the index of the first hop (out of 'first') used to reach it
+    first_hops: dict[int, int] = {first: None}
+    queue = deque()
+
+    for index, neighbour in enumerate(graph.neighbours[first]):
+        if neighbour not in first_hops:
+            first_hops[neighbour] = index
+            queue.append(neighbour)
+
+    while queue:
+        checkpoint = queue.popleft()
+        if uncovered_from[checkpoint]:
+            return first_hops[checkpoint]
+
+        for neighbour in graph.neighbours[checkpoint]:
+            if neighbour not in first_hops:
+                first_hops[neighbour] = first_hops[checkpoint]
+                queue.append(neighbour)
+
+    # unreachable unpatrolled paths (should not happen on a validated circuit), fall back to any neighbour
+    return rng.randrange(len(graph.neighbours[first]))
+
+
+def _patrol_route(
+    route: SentryRoute,
+    checkpoint: int,
+    current_time: int,
+    shift_end: int,
+    graph: CircuitGraph,
+    samplers: dict,
+    uncovered: set,
+    uncovered_from: Counter,
+    rng: random.Random,
+    paths: list[tuple[int, int]],
+) -> None:
+    """
+    walks a single sentry from 'checkpoint' at 'current_time' until the end of the shift, see the algorithm above
+    the check-ins along the way are appended to 'route', and the patrolled paths to 'paths'
+    """
+
+    # second, explained above
+    second: int = None
+
+    while current_time < shift_end:
+        first: int = checkpoint if second is None else second
+        # if second is None, assign to start instead
+
+        # a checkpoint cut off from the rest of the circuit (e.g. all its paths blocked), the sentry stays put
+        if not graph.neighbours[first]:
+            break
+
+        # pick second from immediate neighbours together with the path duration, explained above
+        if uncovered_from[first]:
+            pick = rng.choice(
+                [
+                    index
+                    for index, neighbour in enumerate(graph.neighbours[first])
+                    if (first, neighbour) in uncovered
+                ]
+            )
+        elif uncovered:
+            pick = _next_hop_to_uncovered(first, graph, uncovered_from, rng)
+        else:
+            pick = samplers[first].sample(rng)
+        samplers[first].scale(pick, 0.5)
+        second = graph.neighbours[first][pick]
+        path_duration = graph.durations[first][pick]
+
+        # pair the two checkpoints to form a path
+        path: tuple[int, int] = (first, second)
+
+        if path in uncovered:
+            uncovered.remove(path)
+            uncovered_from[first] -= 1
+
+        # update the current time path to reflect the time offset (time taken to patrol generated path)
+        current_time += path_duration
+
+        # create a route entry for the current sentry
+        route.append(second, current_time)
+
+        # add the current path to paths list
+        paths.append(path)
+
+
+def generate_circuit(
+    sentries: list[tuple[str, str, str]],
+    checkpoints: dict[int, list[tuple]],
+    start_date: datetime,
+    start_time: datetime,
+    shift_dur_hour: int,
+    shift_dur_min: int,
+    time_budget: float = None,
+    on_progress=None,
+    seed: int = None,
+):
+    """
+    generates a random sentry circuit/route, see the algorithm description above
+    stops early once 'time_budget' seconds have elapsed (at least one circuit is always built)
+    'on_progress', if given, is called after every attempt with the attempt count and the best circuit's quality
+    'seed' makes the generated circuit reproducible
+    """
+
+    started = time.monotonic()
+    rng = random.Random(seed)
+
+    # the adjacency dictionary is preprocessed once, and reused by every attempt
+    graph = CircuitGraph(checkpoints)
+
+    # necessary epoch times to evaluate - start of shift and end of shift
+    # combines sent date and sent time
+    shift_start: int = int(datetime.timestamp(datetime.combine(start_date, start_time)))
+    shift_dur: int = (shift_dur_hour * 60 * 60) + (shift_dur_min * 60)
+    shift_end: int = shift_start + shift_dur
+
+    # best circuit generated so far, ranked by (paths covered, -frequency spread)
+    best = None
+    best_rank = None
+    best_quality = None
+
+    for attempt in range(1, MAX_CIRCUIT_ATTEMPTS + 1):
+        # ind_routes list stores each sentry's route, for record-keeping/reference
+        # each route is a SentryRoute (see circuits.py) holding:
+        #     name: sentry-on-duty name
+        #     card: alias of assigned card
+        #     id: ID of assigned card
+        #     the sentry's check-ins, as columns i.e.
+        #         checkpoints: checkpoint at which above sentry is expected
+        #         times: time at which the sentry is expected (epoch)
+        #         checked (bitset): whether the sentry has validly checked in or not
+        # done in the outer loop (marked by IDs)
+
+        # the check-ins will be used to handle belated check-ins
+
+        ind_routes: list[SentryRoute] = []
+
+        # starting checkpoints are spread over the circuit, shuffled so every attempt differs
+        starting_checkpoints = rng.sample(graph.checkpoints, len(graph.checkpoints))
+
+        # For calculating weights for randomising path to take, one weighted sampler per checkpoint
+        samplers = graph.samplers()
+
+        # paths that have not been patrolled yet, and how many of them leave each checkpoint
+        uncovered = set(graph.paths)
+        uncovered_from = Counter(first for first, _ in uncovered)
+
+        # paths list stores each generated patrol path as the full route is generated
+        # will be used to count the patrol frequencies for each path
+
+        paths: list[tuple[int, int]] = []
+
+        for sentry_no, (name, alias, card) in enumerate(sentries):
+            # routes will be generated one sentry (ID) at a time
+            # all sentry shifts should start at the same time i.e. at the beginning of the shift
+            current_time: int = shift_start
+
+            # each route will start at a different checkpoint, and check-in info is stored in routes list
+            starting_checkpoint: int = starting_checkpoints[sentry_no % len(starting_checkpoints)]
+
+            # individual check-in info is stored at beginning of shift
+            # time stored as epoch time
+            route = SentryRoute(name, alias, card, [starting_checkpoint], [current_time])
+
+            # the rest of the route, explained above
+            _patrol_route(
+                route=route,
+                checkpoint=starting_checkpoint,
+                current_time=current_time,
+                shift_end=shift_end,
+                graph=graph,
+                samplers=samplers,
+                uncovered=uncovered,
+                uncovered_from=uncovered_from,
+                rng=rng,
+                paths=paths,
+            )
+
+            # add sentry's route to individual routes (ind_routes) list
+            # each attempt builds new routes, so they need not be copied
+            ind_routes.append(route)
+
+        # generates and returns a list of path frequencies from paths list in descending order, format: [(path, frequency), ...]
+        # e.g. ( ('Chk A', 'Chk B'), 20 ) -> the path from Chk A to Chk B was patrolled 20 times in total
+        path_freqs = Counter(paths).most_common()
+
+        # Checking that all paths i.e A-B, B-C, C-D and D-A are patrolled and
+        # Confirming the difference in frequency of the most patrolled path and the least
+        #  patrolled path should not exceed the sqare root of the path count
+        quality = circuit_quality(path_freqs=path_freqs, checkpoints=checkpoints)
+        rank = (quality["covered"], -quality["spread"])
+
+        if best is None or rank > best_rank:
+            best = path_freqs, ind_routes
+            best_rank = rank
+            best_quality = quality
+
+        if on_progress is not None:
+            on_progress(attempt, best_quality)
+
+        if quality["valid"]:
+            break  # if valid then stop generating
+
+        if time_budget is not None and time.monotonic() - started >= time_budget:
+            break  # out of time, settle for the best circuit so far
+
+    path_freqs, ind_routes = best
+
+    # info for database storage
+    return shift_start, shift_end, path_freqs, ind_routes
+
+
+def expand_shift_pattern(
+    start_date: date, end_date: date, start_times: list[time_of_day], weekdays: list[int]
+) -> list[tuple[date, time_of_day]]:
+    """
+    lists the (date, start time) of every shift in a date range (inclusive) following a shift pattern
+    i.e. the shift start times on each day, and the days of the week (Monday = 0) with shifts
+    """
+
+    shifts = []
+    day = start_date
+
+    while day <= end_date:
+        if day.weekday() in weekdays:
+            shifts.extend((day, start_time) for start_time in sorted(start_times))
+        day += timedelta(days=1)
+
+    return shifts
+
+
+def plan_shift_schedule(
+    sentries: list[tuple[str, str, str]],
+    checkpoints: dict[int, list[tuple]],
+    start_date: date,
+    end_date: date,
+    start_times: list[time_of_day],
+    weekdays: list[int],
+    shift_dur_hour: int,
+    shift_dur_min: int,
+    taken: set[int],
+) -> list[dict]:
+    """
+    lists the generate_circuit keyword arguments of every shift following a shift pattern (see expand_shift_pattern)
+    shifts that have already started, or that start at a time in 'taken' (epoch), are left out
+    """
+
+    now = datetime.now()
+    shift_infos = []
+
+    for day, start_time in expand_shift_pattern(start_date, end_date, start_times, weekdays):
+        shift_start = datetime.combine(day, start_time)
+        if shift_start < now or int(datetime.timestamp(shift_start)) in taken:
+            continue
+
+        shift_infos.append(
+            {
+                "sentries": sentries,
+                "checkpoints": checkpoints,
+                "start_date": day,
+                "start_time": start_time,
+                "shift_dur_hour": shift_dur_hour,
+                "shift_dur_min": shift_dur_min,
+            }
+        )
+
+    return shift_infos
+
+
+# MID-SHIFT RE-PLANNING
+
+# if a sentry goes off duty or a path becomes blocked while a shift is being monitored, only the future
+# part (tail) of the affected routes is generated again, past check-ins (and their checked state) are kept
+# each route is split at the current time: the sentry's last expected checkpoint (the last check-in at or
+# before now) is where the new tail starts from, at the current time
+# 1. an off-duty sentry's tail is dropped, and the tails of the sentries in the same part of the circuit
+#    (the ones that can reach where it is, or where its tail goes) are all re-planned to share its load
+# 2. a sentry whose tail crosses a blocked path has its tail re-planned, other tails are left as they are
+# the new tails are built with the same walk as generate_circuit (see _patrol_route) over the circuit minus
+# the blocked paths, starting from the paths the kept tails leave unpatrolled and the kept tails' frequencies
+# blocking paths may cut the circuit into sub-circuits (see validate_paths), as may the supervisor's choice
+# of paths (see split_circuit), each sub-circuit's unpatrolled paths are only left to the sentries in it
+# the work done is proportional to the remaining part of the shift, not the whole shift
+
+
+def replan_circuit(
+    circuits: list[SentryRoute],
+    checkpoints: dict[int, list[tuple]],
+    path_freqs: list[tuple],
+    now: int,
+    shift_end: int,
+    off_duty: set[str] = frozenset(),
+    blocked: set[tuple[int, int]] = frozenset(),
+    until: int = None,
+    seed: int = None,
+) -> tuple[list[tuple], list[dict]]:
+    """
+    re-plans the rest of the shift from 'now' (epoch) for sentries going off duty (card IDs in 'off_duty')
+    and around blocked paths ((checkpoint, checkpoint) pairs in 'blocked', either direction)
+    updates the routes in 'circuits' in place, returns the updated path frequencies and the changed tails:
+    [{on_duty: false if the sentry went off duty, + the new check-ins after 'now' (SentryRoute.to_dict)}, ...]
+    if 'until' (epoch) is given, the changed tails only go up to it (the part of the circuit already
+    sent to the circuit handler, the rest is sent with the following windows, see circuit_windows)
+    """
+
+    rng = random.Random(seed)
+
+    # blocked paths are closed in both directions
+    closed = set(blocked) | {(second, first) for first, second in blocked}
+    open_paths = {
+        checkpoint: [
+            (neighbour, duration)
+            for neighbour, duration in check_paths
+            if (checkpoint, neighbour) not in closed
+        ]
+        for checkpoint, check_paths in checkpoints.items()
+    }
+    graph = CircuitGraph(open_paths)
+
+    # the sub-circuit each checkpoint is in, once the blocked paths are closed
+    _, sub_circuits = validate_paths(open_paths)
+    sub_circuit_of = {
+        checkpoint: number for number, chks in enumerate(sub_circuits) for checkpoint in chks
+    }
+
+    # splitting each route into the part that is kept and the tail after the current time
+    # the first check-in (start of shift) is always kept, so a route always has a last expected checkpoint
+    splits = [max(route.split(now), 1) for route in circuits]
+
+    # the sub-circuits the off-duty sentries' load is in: where they are now, and where their tails go
+    relieved = {
+        sub_circuit_of[checkpoint]
+        for route, split in zip(circuits, splits)
+        if route.id in off_duty
+        for checkpoint in route.checkpoints[split - 1 :]
+    }
+
+    affected = [
+        route.id in off_duty
+        # 1. every other sentry still patrolling in those sub-circuits takes up a share of the load
+        or (sub_circuit_of[route.checkpoints[split - 1]] in relieved and split < len(route))
+        # 2. the tail crosses a blocked path
+        or any(path in closed for path in route.paths(split))
+        for route, split in zip(circuits, splits)
+    ]
+
+    # the frequencies and coverage left by the tails that are kept
+    freqs = Counter(dict(path_freqs))
+    samplers = graph.samplers()
+    # unpatrolled paths per sub-circuit, so that a sentry is only ever led to the ones it can reach
+    uncovered: list[set] = [set() for _ in sub_circuits]
+    for first, second in graph.paths:
+        uncovered[sub_circuit_of[first]].add((first, second))
+
+    for route, split, replan in zip(circuits, splits, affected):
+        if replan:
+            freqs.subtract(route.paths(split))
+            continue
+
+        for first, second in route.paths(split):
+            uncovered[sub_circuit_of[first]].discard((first, second))
+            samplers[first].scale(graph.neighbours[first].index(second), 0.5)
+
+    uncovered_from = Counter(first for part in uncovered for first, _ in part)
+
+    updates: list[dict] = []
+    paths: list[tuple[int, int]] = []
+
+    for route, split, replan in zip(circuits, splits, affected):
+        if not replan:
+            continue
+
+        on_duty = route.id not in off_duty
+        route.truncate(split)
+
+        # the new tail starts from the last expected checkpoint
+        if on_duty:
+            _patrol_route(
+                route=route,
+                checkpoint=route.checkpoints[-1],
+                current_time=max(route.times[-1], now),
+                shift_end=shift_end,
+                graph=graph,
+                samplers=samplers,
+                uncovered=uncovered[sub_circuit_of[route.checkpoints[-1]]],
+                uncovered_from=uncovered_from,
+                rng=rng,
+                paths=paths,
+            )
+
+        stop = None if until is None else max(route.split(until), split)
+        updates.append({"on_duty": on_duty} | route.to_dict(start=split, stop=stop))
+
+    freqs.update(paths)
+    path_freqs = [(path, freq) for path, freq in freqs.most_common() if freq > 0]
+
+    return path_freqs, updates
+
+
+def update_circuit(index: CircuitIndex, scan_info: list) -> int | None:
+    """
+    updates the circuit on a valid scan by setting the checked flag for a check-in item to True
+    makes the green dot appear on the frontend
+    the check-in is looked up in the circuit's index (see CircuitIndex in circuits.py)
+    returns the index of the check-in in the sentry's route, None if the scan matched no check-in of the circuit
+    """
+
+    chk, id, time = scan_info
+
+    # if scan is valid (right sentry, right checkpoint, right time), the check-in is found
+    found = index.find(card=id, checkpoint=chk, time=time, window=CHECK_IN_WINDOW)
+    if found is None:
+        return None
+
+    route, position = found
+    route.check(position)
+    return position
+
+
+def keyset_page(query, column, page_size: int, before: int = None, after: int = None) -> tuple:
+    """
+    a page of the rows of a (SQLAlchemy) query, newest first by 'column' (unique, e.g. the shifts' start)
+    the rows just before 'after' (older page), just after 'before' (newer page), or the newest
+    returns the page and whether there are newer and older rows than its own
+    keyset-paginated i.e. each page is an index range scan, however far back it is
+    """
+
+    if before is not None:
+        # the rows just after 'before', read oldest first
+        page = query.filter(column > before).order_by(column).limit(page_size).all()[::-1]
+    elif after is not None:
+        # the rows just before 'after'
+        page = query.filter(column < after).order_by(column.desc()).limit(page_size).all()
+    else:
+        # the newest rows
+        page = query.order_by(column.desc()).limit(page_size).all()
+
+    # whether there are newer or older rows than the page's
+    newer = older = False
+    if page:
+        key = column.key
+        newer = query.session.query(query.filter(column > getattr(page[0], key)).exists()).scalar()
+        older = query.session.query(query.filter(column < getattr(page[-1], key)).exists()).scalar()
+
+    return page, newer, older
+
+
+def generate_adjacency_graph(path_objs: list) -> dict:
+    """
+    generate_adjacency_graph creates a graph (dict) of each checkpoint and its immediate neighbours
+    from the queried list of PatrolPath objects that were created and saved in the database
+    """
+
+    # this list will be used to store each original path and its reverse/mirror path
+    path_list = []
+
+    # saving each original path and its reverse/mirror path to the list above
+    for path_obj in path_objs:
+        path_list.extend(
+            (
+                (
+                    path_obj.chkpt_src,
+                    path_obj.chkpt_dest,
+                    path_obj.duration,
+                ),
+                (
+                    path_obj.chkpt_dest,
+                    path_obj.chkpt_src,
+                    path_obj.duration,
+                ),
+            )
+        )
+
+    # instantiating the dict to store the adjecency graph
+    path_dict = {}
+
+    # creating the adjacency graph
+    # premises adjacency and duration dictionary
+    # i.e. mapping each checkpoint and its immediate neighbours plus the duration to patrol the path in seconds
+
+    # of the form:
+    # path_dict = {
+    #     "A": [("B", 90), ("D", 70)],
+    #     "B": [("A", 90), ("C", 90), ("E", 70)],
+    #     "C": [("B", 90), ("F", 70)],
+    #     "D": [("E", 90), ("A", 70), ("G", 60)],
+    #     "E": [("D", 90), ("F", 90), ("B", 70), ("H", 60)],
+    #     "F": [("E", 90), ("C", 70), ("I", 60)],
+    #     "G": [("H", 90), ("D", 60)],
+    #     "H": [("G", 90), ("I", 90), ("E", 60)],
+    #     "I": [("H", 90), ("F", 60)],
+    # }
+
+    for path in path_list:
+        if path[0] in path_dict:
+            neighbours = path_dict[path[0]]
+            neighbours.append((path[1], path[2]))
+            path_dict[path[0]] = neighbours
+        else:
+            path_dict[path[0]] = [(path[1], path[2])]
+
+    return path_dict
+
+
+def validate_paths(
+    path_dict: dict[int, list[tuple]], visited: set = None
+) -> tuple[int, list[list[int]]]:
+    """
+    validate_paths finds the 'sub-circuits' (disconnected groups of checkpoints) within the circuit
+    the supervisor has selected, in a single pass. works on the principle of iterative depth-first search
+    returns the number of sub-circuits and the checkpoints in each, a complete circuit has exactly one
+    """
+
+    # declaring a set that will store the confirmed checkpoints (confirmed = part of an explored sub-circuit)
+    if visited is None:
+        visited = set()
+
+    # declaring a variable to store the number of circuits present
+    circuit_count: int = 0
+
+    # declaring a list to store checkpoints in each sub-circuits
+    sub_circuits: list[list[int]] = []
+
+    # every checkpoint not yet part of an explored sub-circuit starts a new one
+    for first_checkpoint in path_dict:
+        if first_checkpoint in visited:
+            continue
+
+        chks: list = []
+
+        # instantiating the stack for DFS
+        stack: list = [first_checkpoint]
+
+        # for as long as the stack is not empty, traversal continues
+        # this ensures that all paths emanating from the given checkpoint (node) are explored
+        while stack:
+            checkpoint = stack.pop()
+
+            # if the checkpoint (node) has already been 'visited' (i.e. is part of this sub-circuit)
+            # ignore it, investigate next checkpoint
+            if checkpoint in visited:
+                continue
+
+            # if the checkpoint is being 'seen' for the first time, add to visited and to this sub-circuit
+            visited.add(checkpoint)
+            chks.append(checkpoint)
+
+            # add the current checkpoint's neighbouring checkpoints to the stack for DFS
+            stack.extend(neighbours[0] for neighbours in path_dict[checkpoint])
+
+        sub_circuits.append(chks)
+        circuit_count += 1
+
+    return circuit_count, sub_circuits
+
+
+# SUB-CIRCUITS
+
+# if the selected paths form more than one sub-circuit (e.g. separate buildings on a large campus),
+# each sub-circuit is patrolled by its own group of sentries, sized in proportion to the number of paths
+# in the sub-circuit (at least one sentry each)
+# each sub-circuit's routes are generated independently (and concurrently, see jobs.py), then merged
+# into a single circuit for the shift
+
+
+def split_circuit(
+    sentries: list[tuple[str, str, str]],
+    checkpoints: dict[int, list[tuple]],
+    sub_circuits: list[list[int]],
+) -> list[tuple[list[tuple], dict[int, list[tuple]]]]:
+    """
+    assigns sentries to sub-circuits in proportion to their size (number of paths)
+    returns a (sentries, adjacency dictionary) pair per sub-circuit
+    raises a ValueError if there are fewer sentries than sub-circuits
+    """
+
+    if len(sentries) < len(sub_circuits):
+        raise ValueError(
+            f"{len(sub_circuits)} sub-circuits need at least as many sentries, got {len(sentries)}"
+        )
+
+    sizes = [sum(len(checkpoints[checkpoint]) for checkpoint in chks) for chks in sub_circuits]
+    total = sum(sizes)
+
+    # every sub-circuit gets one sentry, the rest are shared out by largest remainder
+    spare = len(sentries) - len(sub_circuits)
+    shares = [spare * size / total for size in sizes]
+    counts = [1 + int(share) for share in shares]
+
+    by_remainder = sorted(
+        range(len(sub_circuits)), key=lambda index: shares[index] - int(shares[index]), reverse=True
+    )
+    for index in by_remainder[: len(sentries) - sum(counts)]:
+        counts[index] += 1
+
+    parts = []
+    assigned = 0
+
+    for chks, count in zip(sub_circuits, counts):
+        parts.append(
+            (
+                sentries[assigned : assigned + count],
+                {checkpoint: checkpoints[checkpoint] for checkpoint in chks},
+            )
+        )
+        assigned += count
+
+    return parts
+
+
+def merge_circuits(parts: list[tuple]) -> tuple:
+    """
+    merges the generate_circuit outputs of the sub-circuits of a shift into a single output of the same form
+    """
+
+    shift_start, shift_end, _, _ = parts[0]
+
+    path_freqs = sorted(
+        (path_freq for _, _, part_freqs, _ in parts for path_freq in part_freqs),
+        key=lambda path_freq: path_freq[1],
+        reverse=True,
+    )
+    ind_routes = [route for *_, part_routes in parts for route in part_routes]
+
+    return shift_start, shift_end, path_freqs, ind_routes
+
+
+# BATCH (VECTORISED) CIRCUIT GENERATION
+
+# instead of building one circuit at a time, many candidate circuits are built at once as NumPy arrays
+# every sentry of every candidate takes one step of its random walk per iteration, so the Python-level
+# loop runs once per step of the longest route instead of once per step of every route of every candidate
+
+# the adjacency dictionary is first converted into padded arrays, one row per checkpoint:
+# neighbours[i, j] -> index of the j-th neighbour of checkpoint i (-1 as padding)
+# durations[i, j]  -> time taken to patrol that path
+# edge_ids[i, j]   -> ID of that (directed) path, used to count patrol frequencies per candidate
+
+# the same weighting as the single-circuit generator is used: a path's weight halves each time
+# it is patrolled within a candidate, i.e. weight = 0.5 ** (times patrolled)
+
+# once every walk has passed the end of the shift, coverage and frequency spread are computed
+# for all candidates at once, and only the best candidate is converted back to the usual output format
+
+
+def generate_circuit_batch(
+    sentries: list[tuple[str, str, str]],
+    checkpoints: dict[int, list[tuple]],
+    start_date: datetime,
+    start_time: datetime,
+    shift_dur_hour: int,
+    shift_dur_min: int,
+    candidates: int = 64,
+    seed: int = None,
+    time_budget: float = None,
+    on_progress=None,
+):
+    """
+    generates random sentry circuits 'candidates' at a time and returns the best one
+    like generate_circuit, rounds of candidates are generated until one is valid, MAX_CIRCUIT_ATTEMPTS
+    rounds have been generated or 'time_budget' seconds have elapsed
+    output is of the same form as generate_circuit
+    """
+
+    started = time.monotonic()
+    rng = np.random.default_rng(seed)
+
+    shift_start: int = int(datetime.timestamp(datetime.combine(start_date, start_time)))
+    shift_dur: int = (shift_dur_hour * 60 * 60) + (shift_dur_min * 60)
+    shift_end: int = shift_start + shift_dur
+
+    # converting the adjacency dictionary into padded arrays, explained above
+    checkpoints_in_circuit = list(checkpoints.keys())
+    chk_index = {checkpoint: index for index, checkpoint in enumerate(checkpoints_in_circuit)}
+    max_degree = max(len(check_paths) for check_paths in checkpoints.values())
+    # number of paths out of each checkpoint, the rest of its row (up to max_degree) is padding
+    degrees = np.array(
+        [len(checkpoints[checkpoint]) for checkpoint in checkpoints_in_circuit], dtype=np.int32
+    )
+
+    neighbours = np.full((len(checkpoints_in_circuit), max_degree), -1, dtype=np.int32)
+    durations = np.zeros((len(checkpoints_in_circuit), max_degree), dtype=np.int64)
+    edge_ids = np.full((len(checkpoints_in_circuit), max_degree), -1, dtype=np.int32)
+    edge_paths: list[tuple[int, int]] = []
+
+    for first, check_paths in checkpoints.items():
+        for pick, (second, path_duration) in enumerate(check_paths):
+            neighbours[chk_index[first], pick] = chk_index[second]
+            durations[chk_index[first], pick] = path_duration
+            edge_ids[chk_index[first], pick] = len(edge_paths)
+            edge_paths.append((first, second))
+
+    req_path_count = len(edge_paths)
+    sentry_count = len(sentries)
+
+    # index of the candidate each walker belongs to, shape (candidates, sentries)
+    cand_index = np.broadcast_to(np.arange(candidates)[:, None], (candidates, sentry_count))
+
+    # best candidate generated so far: its rank (paths covered, -frequency spread), path counts and walks
+    best = None
+    best_rank = None
+    best_quality = None
+
+    for attempt in range(1, MAX_CIRCUIT_ATTEMPTS + 1):
+        # every candidate spreads its sentries' starting checkpoints over a random ordering of the checkpoints
+        orderings = rng.random((candidates, len(checkpoints_in_circuit))).argsort(axis=1)
+        position = orderings[:, np.arange(sentry_count) % len(checkpoints_in_circuit)]
+        position = position.astype(np.int32)
+        # time into the shift (seconds) of each walker
+        elapsed = np.zeros((candidates, sentry_count), dtype=np.int64)
+        # patrol frequency of each path, per candidate
+        counts = np.zeros((candidates, req_path_count), dtype=np.int32)
+
+        # every step's positions and times are recorded, along with which walkers were still patrolling
+        step_positions = [position]
+        step_times = [elapsed]
+        step_active = [np.ones((candidates, sentry_count), dtype=bool)]
+
+        while (active := elapsed < shift_dur).any():
+            # weights of every path out of every walker's current checkpoint, shape (candidates, sentries, degree)
+            walker_edges = edge_ids[position]
+            walker_counts = counts[cand_index[..., None], np.maximum(walker_edges, 0)]
+            is_path = walker_edges >= 0
+            # halved for every time a path was taken, counted from the checkpoint's least taken path
+            # (the same odds, scaled up like PathSampler's weights) so they can't all underflow to 0
+            # on long shifts: the least taken path always weighs 1
+            least = np.where(is_path, walker_counts, np.iinfo(np.int32).max).min(
+                axis=2, keepdims=True
+            )
+            weights = np.where(is_path, 0.5 ** (walker_counts - least), 0.0)
+
+            # weighted random pick of a path for every walker (inverse transform sampling)
+            cumulative = weights.cumsum(axis=2)
+            threshold = rng.random((candidates, sentry_count, 1)) * cumulative[..., -1:]
+            # never past the checkpoint's last path (onto padding), e.g. through rounding
+            pick = np.minimum((cumulative <= threshold).sum(axis=2), degrees[position] - 1)
+
+            # count the patrolled paths of walkers still on shift
+            picked_edges = np.take_along_axis(walker_edges, pick[..., None], axis=2)[..., 0]
+            np.add.at(counts, (cand_index[active], picked_edges[active]), 1)
+
+            # move the walkers still on shift along the picked paths
+            elapsed = np.where(active, elapsed + durations[position, pick], elapsed)
+            position = np.where(active, neighbours[position, pick], position)
+
+            step_positions.append(position)
+            step_times.append(elapsed)
+            step_active.append(active)
+
+        # scoring all candidates at once, unpatrolled paths count as a frequency of 0
+        covered = (counts > 0).sum(axis=1)
+        spread = np.where(
+            covered == req_path_count,
+            counts.max(axis=1) - counts.min(axis=1),
+            counts.max(axis=1),
+        )
+        # round's best candidate: most paths covered, then smallest frequency spread
+        round_best = np.lexsort((spread, -covered))[0]
+        rank = (int(covered[round_best]), -int(spread[round_best]))
+
+        if best is None or rank > best_rank:
+            best = (
+                counts[round_best],
+                np.stack(step_positions)[:, round_best],
+                np.stack(step_times)[:, round_best],
+                np.stack(step_active)[:, round_best],
+            )
+            best_rank = rank
+            best_quality = {
+                "covered": rank[0],
+                "required": req_path_count,
+                "spread": -rank[1],
+                "max_spread": math.sqrt(req_path_count),
+                "valid": rank[0] == req_path_count and -rank[1] <= math.sqrt(req_path_count),
+            }
+
+        if on_progress is not None:
+            on_progress(attempt * candidates, best_quality)
+
+        if best_quality["valid"]:
+            break  # if valid then stop generating
+
+        if time_budget is not None and time.monotonic() - started >= time_budget:
+            break  # out of time, settle for the best circuit so far
+
+    # converting the best candidate to the generate_circuit output format
+    best_counts, positions, times, actives = best
+
+    ind_routes: list[SentryRoute] = []
+    checkpoint_ids = np.array(checkpoints_in_circuit)
+
+    for sentry_no, (name, alias, card) in enumerate(sentries):
+        on_shift = actives[:, sentry_no]
+        ind_routes.append(
+            SentryRoute(
+                name,
+                alias,
+                card,
+                checkpoint_ids[positions[on_shift, sentry_no]].tolist(),
+                (shift_start + times[on_shift, sentry_no]).tolist(),
+            )
+        )
+
+    path_freqs = [
+        (edge_paths[edge], int(best_counts[edge]))
+        for edge in np.argsort(-best_counts, kind="stable")
+        if best_counts[edge]
+    ]
+
+    return shift_start, shift_end, path_freqs, ind_routes
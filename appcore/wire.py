@@ -0,0 +1,157 @@
+"""
+    Wire format of the circuit messages sent by the web app to the circuit handler
+    (MONITOR_SENTRY_CIRCUIT, MONITOR_CIRCUIT_WINDOW and MONITOR_CIRCUIT_UPDATE, see mqtts.py)
+
+    each message is a dict of a few top-level fields (e.g. until, final) and 'routes', a list of routes
+    in compact form (see SentryRoute.to_dict in circuits.py), sent either as JSON (readable, for debugging)
+    or in a versioned binary form, decoded back into the very same dict:
+
+    magic "SW", version (u8), length (u16) of the top-level fields, the top-level fields (JSON)
+    number of strings, then each string's length and the string (UTF-8)
+    number of routes, then each route:
+        name, card and ID (indices + 1 into the strings, 0 for none), on duty (0, 1 or 2 for none),
+        number of check-ins n, the n checkpoints, first time and (n - 1) time differences if n > 0,
+        checked bitset (ceil(n / 8) bytes)
+
+    every number after the header is a varint (LEB128, zigzag-coded so negative numbers stay short)
+    i.e. checkpoint IDs and path durations take a byte or two each rather than a JSON number and comma
+    names, cards and IDs are dictionary-coded i.e. each is sent once
+"""
+
+import json
+import struct
+
+MAGIC = b"SW"
+VERSION = 1
+
+HEADER = struct.Struct("<2sBH")
+
+
+def _write_varint(buffer: bytearray, value: int) -> None:
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(payload: bytes, offset: int) -> tuple[int, int]:
+    """
+    returns the varint at 'offset' and the offset after it
+    """
+
+    value = shift = 0
+    while True:
+        byte = payload[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), offset
+        shift += 7
+
+
+def encode_message(message: dict, binary: bool = True) -> bytes | str:
+    """
+    encodes a circuit message, in the binary form or as JSON
+    """
+
+    if not binary:
+        return json.dumps(message, separators=(",", ":"))
+
+    fields = json.dumps(
+        {field: value for field, value in message.items() if field != "routes"},
+        separators=(",", ":"),
+    ).encode()
+
+    # dictionary-coded strings {string: index}
+    strings = {}
+
+    def string_index(value) -> int:
+        return 0 if value is None else strings.setdefault(value, len(strings)) + 1
+
+    routes = message.get("routes", [])
+    body = bytearray()
+    _write_varint(body, len(routes))
+
+    for route in routes:
+        count = len(route["checkpoints"])
+        on_duty = route.get("on_duty")
+        for value in (
+            string_index(route.get("name")),
+            string_index(route.get("card")),
+            string_index(route["id"]),
+            2 if on_duty is None else int(on_duty),
+            count,
+            *route["checkpoints"],
+            *route["times"],
+        ):
+            _write_varint(body, value)
+        body += bytes.fromhex(route.get("checked", "")).ljust((count + 7) // 8, b"\0")
+
+    table = bytearray()
+    _write_varint(table, len(strings))
+    for string in strings:
+        encoded = string.encode()
+        _write_varint(table, len(encoded))
+        table += encoded
+
+    return HEADER.pack(MAGIC, VERSION, len(fields)) + fields + bytes(table) + bytes(body)
+
+
+def decode_message(payload: bytes | str) -> dict:
+    """
+    decodes a circuit message sent in either form (told apart by the magic bytes)
+    raises a ValueError if it is in the binary form, but of an unknown version
+    """
+
+    if isinstance(payload, str) or not payload.startswith(MAGIC):
+        return json.loads(payload)
+
+    _, version, fields_length = HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError(f"Unsupported circuit message version: {version}.")
+
+    offset = HEADER.size
+    message = json.loads(payload[offset : offset + fields_length])
+    offset += fields_length
+
+    string_count, offset = _read_varint(payload, offset)
+    strings = [None]
+    for _ in range(string_count):
+        length, offset = _read_varint(payload, offset)
+        strings.append(payload[offset : offset + length].decode())
+        offset += length
+
+    route_count, offset = _read_varint(payload, offset)
+    routes = []
+    for _ in range(route_count):
+        values = []
+        for _ in range(5):
+            value, offset = _read_varint(payload, offset)
+            values.append(value)
+        name, card, id, on_duty, count = values
+
+        checkpoints = []
+        for _ in range(count):
+            checkpoint, offset = _read_varint(payload, offset)
+            checkpoints.append(checkpoint)
+        times = []
+        for _ in range(count):
+            time, offset = _read_varint(payload, offset)
+            times.append(time)
+        checked = payload[offset : offset + (count + 7) // 8].hex()
+        offset += (count + 7) // 8
+
+        route = {} if on_duty == 2 else {"on_duty": bool(on_duty)}
+        route |= {
+            "name": strings[name],
+            "card": strings[card],
+            "id": strings[id],
+            "checkpoints": checkpoints,
+            "times": times,
+            "checked": checked,
+        }
+        routes.append(route)
+
+    message["routes"] = routes
+    return message
@@ -0,0 +1,335 @@
+#!/usr/bin/python3
+"""
+    Benchmarks the circuit generation functions in appcore/utils.py over synthetic premises
+    (grids, rings and random planar graphs) of growing size, sentry counts and shift lengths
+
+    e.g.
+    $   python benchmark.py --output bench.json
+    $   python benchmark.py --quick --output new.json --compare bench.json
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime, timedelta
+from statistics import median
+
+import numpy as np
+
+import appcore.utils as utils
+from appcore.circuits import dump_circuit
+
+# stands in for the PatrolPath database model, generate_adjacency_graph only reads these three attributes
+SyntheticPath = namedtuple("SyntheticPath", ["chkpt_src", "chkpt_dest", "duration"])
+
+# range of path durations (seconds) of the synthetic premises, similar to the paths seeded by manager.py
+MIN_DURATION = 60
+MAX_DURATION = 600
+
+
+# SYNTHETIC PREMISES
+# each builder returns the (undirected) patrol paths between 'size' checkpoints, with random durations
+
+
+def grid_paths(size: int, rng: random.Random) -> list[SyntheticPath]:
+    """
+    rectangular grid, as close to square as possible, like the 3x3 grid seeded by manager.py
+    """
+
+    width = math.ceil(math.sqrt(size))
+    paths = []
+
+    for chk in range(size):
+        # path rightwards and downwards, the reverse paths are added by generate_adjacency_graph
+        if (chk + 1) % width and chk + 1 < size:
+            paths.append(SyntheticPath(chk, chk + 1, rng.randint(MIN_DURATION, MAX_DURATION)))
+        if chk + width < size:
+            paths.append(SyntheticPath(chk, chk + width, rng.randint(MIN_DURATION, MAX_DURATION)))
+
+    return paths
+
+
+def ring_paths(size: int, rng: random.Random) -> list[SyntheticPath]:
+    """
+    single loop around the premises (e.g. a perimeter fence), the sparsest connected circuit
+    """
+
+    return [
+        SyntheticPath(chk, (chk + 1) % size, rng.randint(MIN_DURATION, MAX_DURATION))
+        for chk in range(size)
+    ]
+
+
+def planar_paths(size: int, rng: random.Random) -> list[SyntheticPath]:
+    """
+    random connected planar graph: a grid with a random diagonal across every cell (a triangulation),
+    thinned out by dropping random paths that are not needed to keep the premises connected
+    """
+
+    width = math.ceil(math.sqrt(size))
+    candidates = []
+
+    for chk in range(size):
+        col = chk % width
+        right = chk + 1 if (col + 1) < width and chk + 1 < size else None
+        down = chk + width if chk + width < size else None
+
+        if right is not None:
+            candidates.append((chk, right))
+        if down is not None:
+            candidates.append((chk, down))
+        # one of the two diagonals of the cell, never both, so no paths cross
+        if right is not None and down is not None and down + 1 < size:
+            candidates.append((chk, down + 1) if rng.random() < 0.5 else (right, down))
+
+    rng.shuffle(candidates)
+
+    # random spanning tree first (union-find), then each remaining path is kept with even odds
+    parents = list(range(size))
+
+    def root(chk: int) -> int:
+        while parents[chk] != chk:
+            parents[chk] = parents[parents[chk]]
+            chk = parents[chk]
+        return chk
+
+    kept = []
+    for first, second in candidates:
+        first_root, second_root = root(first), root(second)
+        if first_root != second_root:
+            parents[first_root] = second_root
+            kept.append((first, second))
+        elif rng.random() < 0.5:
+            kept.append((first, second))
+
+    return [
+        SyntheticPath(first, second, rng.randint(MIN_DURATION, MAX_DURATION))
+        for first, second in kept
+    ]
+
+
+PREMISES = {"grid": grid_paths, "ring": ring_paths, "planar": planar_paths}
+
+GENERATORS = {"single": utils.generate_circuit, "batch": utils.generate_circuit_batch}
+
+# (sizes, sentry counts, shift lengths in hours) of the default and the quick benchmark
+DEFAULT_MATRIX = ([9, 100, 400, 1600, 2500], [2, 10, 40], [1, 8, 12])
+QUICK_MATRIX = ([9, 100, 400], [2, 10], [1, 8])
+
+# cases faster than this (seconds) are too noisy to count as regressions when comparing results
+NOISE_FLOOR = 0.01
+
+
+# MEASUREMENTS
+
+
+def measure_case(
+    shape: str,
+    size: int,
+    sentry_count: int,
+    hours: int,
+    generator: str,
+    repeats: int,
+    seed: int,
+    time_budget: float,
+) -> dict:
+    """
+    benchmarks generating a single shift's circuit on one synthetic premises
+    wall times are the median over 'repeats' runs, peak memory is measured on a separate traced run
+    (tracing slows the run down, so it is not timed)
+    """
+
+    path_objs = PREMISES[shape](size, random.Random(seed))
+    sentries = [(f"Sentry {no}", f"Card {no}", f"{no:011d}") for no in range(sentry_count)]
+    # a shift starting tomorrow, so that no part of it is in the past
+    start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+
+    def run(repeat: int) -> dict:
+        timings = {}
+
+        started = time.perf_counter()
+        checkpoints = utils.generate_adjacency_graph(path_objs=path_objs)
+        timings["adjacency_s"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        utils.validate_paths(path_dict=checkpoints)
+        timings["validate_s"] = time.perf_counter() - started
+
+        # attempts (retries of the validity loop) and the final quality are reported through on_progress
+        progress = {}
+
+        def on_progress(attempts: int, quality: dict):
+            progress.update(quality, attempts=attempts)
+
+        started = time.perf_counter()
+        output = GENERATORS[generator](
+            sentries=sentries,
+            checkpoints=checkpoints,
+            start_date=start.date(),
+            start_time=start.time(),
+            shift_dur_hour=hours,
+            shift_dur_min=0,
+            time_budget=time_budget,
+            on_progress=on_progress,
+            seed=seed + repeat,
+        )
+        timings["generate_s"] = time.perf_counter() - started
+
+        return timings | {"progress": progress, "output": output}
+
+    runs = [run(repeat) for repeat in range(repeats)]
+
+    tracemalloc.start()
+    run(0)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    _, _, path_freqs, ind_routes = runs[0]["output"]
+    progress = runs[0]["progress"]
+
+    return {
+        "case": f"{shape}-{size}-{sentry_count}s-{hours}h-{generator}",
+        "shape": shape,
+        "checkpoints": size,
+        "paths": 2 * len(path_objs),
+        "sentries": sentry_count,
+        "shift_hours": hours,
+        "generator": generator,
+        "repeats": repeats,
+        "adjacency_s": median(run["adjacency_s"] for run in runs),
+        "validate_s": median(run["validate_s"] for run in runs),
+        "generate_s": median(run["generate_s"] for run in runs),
+        "attempts": progress["attempts"],
+        "valid": progress["valid"],
+        "covered": progress["covered"],
+        "spread": progress["spread"],
+        "peak_memory_bytes": peak_memory,
+        "check_ins": sum(len(route) for route in ind_routes),
+        # as the circuit and path frequencies are stored in the database (see models.py)
+        "output_bytes": len(dump_circuit(ind_routes)) + len(str(path_freqs)),
+    }
+
+
+def environment() -> dict:
+    """
+    records what the results were measured on, to tell apart differences between versions and machines
+    """
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> int:
+    """
+    prints the time ratio (current / baseline) of every case in both result sets
+    returns the number of cases slower than the baseline by more than 'threshold' (e.g. 0.2 -> 20%)
+    """
+
+    previous = {result["case"]: result for result in baseline}
+    regressions = 0
+
+    print(f"\n{'case':<36}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for result in results:
+        if (old := previous.get(result["case"])) is None:
+            continue
+
+        ratio = result["generate_s"] / old["generate_s"] if old["generate_s"] else math.inf
+        flag = ""
+        if ratio > 1 + threshold and result["generate_s"] >= NOISE_FLOOR:
+            regressions += 1
+            flag = "  <- slower"
+        elif old["valid"] and not result["valid"]:
+            regressions += 1
+            flag = "  <- no longer valid"
+
+        print(
+            f"{result['case']:<36}{old['generate_s']:>11.4f}s{result['generate_s']:>11.4f}s"
+            f"{ratio:>8.2f}{flag}"
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks sentry circuit generation.")
+    parser.add_argument("--quick", action="store_true", help="smaller matrix, for a quick check")
+    parser.add_argument("--shapes", nargs="+", choices=PREMISES, default=list(PREMISES))
+    parser.add_argument("--sizes", nargs="+", type=int, help="numbers of checkpoints")
+    parser.add_argument("--sentries", nargs="+", type=int, help="numbers of sentries on duty")
+    parser.add_argument("--hours", nargs="+", type=int, help="shift lengths in hours")
+    parser.add_argument("--generators", nargs="+", choices=GENERATORS, default=["single"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--time-budget", type=float, default=None, help="seconds per circuit (default: none)"
+    )
+    parser.add_argument("--output", help="file to write the results to (JSON)")
+    parser.add_argument("--compare", help="earlier results file (JSON) to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="slowdown counted as a regression"
+    )
+    args = parser.parse_args()
+
+    sizes, sentry_counts, shift_hours = QUICK_MATRIX if args.quick else DEFAULT_MATRIX
+    sizes = args.sizes or sizes
+    sentry_counts = args.sentries or sentry_counts
+    shift_hours = args.hours or shift_hours
+
+    results = []
+    print(f"{'case':<36}{'generate':>12}{'attempts':>10}{'valid':>7}{'peak MiB':>10}")
+
+    for shape in args.shapes:
+        for size in sizes:
+            for sentry_count in sentry_counts:
+                for hours in shift_hours:
+                    for generator in args.generators:
+                        result = measure_case(
+                            shape=shape,
+                            size=size,
+                            sentry_count=sentry_count,
+                            hours=hours,
+                            generator=generator,
+                            repeats=args.repeats,
+                            seed=args.seed,
+                            time_budget=args.time_budget,
+                        )
+                        results.append(result)
+                        print(
+                            f"{result['case']:<36}{result['generate_s']:>11.4f}s"
+                            f"{result['attempts']:>10}{str(result['valid']):>7}"
+                            f"{result['peak_memory_bytes'] / 2**20:>10.1f}"
+                        )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"environment": environment(), "results": results}, output, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline)["results"], args.threshold)
+        print(f"\n{regressions} regression(s)")
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,38 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
 import json
-import time
 from collections import deque
 from datetime import datetime
+from heapq import heappop, heappush, merge
 from operator import itemgetter
-import threading
 
 import paho.mqtt.client as mqtt
 from dotenv import dotenv_values
 
-from app.mqtts import (
+from appcore.mqtts import (
     ALARM,
     ALERTS,
+    ALERTS_BATCH,
+    CIRCUIT_RESEND,
     DONE,
+    HANDLER_METRICS,
+    MONITOR_CIRCUIT_UPDATE,
+    MONITOR_CIRCUIT_WINDOW,
     MONITOR_SENTRY_CIRCUIT,
+    SENTRY_SCAN_BATCH,
     SENTRY_SCAN_INFO,
     SHIFT_ON_OFF,
     CHKS_OVERDUE,
+    shift_topic,
+    split_shift_topic,
 )
-from app.utils import CHECK_IN_WINDOW
+import appcore.metrics as metrics
+from appcore.circuits import CheckInIndex, SentryRoute
+from appcore.utils import CHECK_IN_WINDOW
+from appcore.wire import decode_message
+from handler_store import HandlerStore, dump_queue, load_queue
 
 # CLIENT CREDENTIALS
 
@@ -30,156 +45,678 @@ mqtt_configs = dict(dotenv_values(".env"))
 
 # broker's hostname
 MQTT_HOST = mqtt_configs.get("MQTT_HOST")
+# broker's port
+MQTT_PORT = 1883
 # broker's username
 MQTT_UNAME = mqtt_configs.get("MQTT_UNAME")
 # broker's password
 MQTT_PASS = mqtt_configs.get("MQTT_PASS")
 
+# SHARDING
+# several handler processes (shards) can split the shifts being monitored between them
+# each shard is launched with its own shard ID (--shard, or HANDLER_SHARD in '.env'), its client ID
+# is then 'circuit-handler-<shard ID>'
+# every shard receives every message, but only the shard owning a shift keeps its check-ins,
+# validates its scans and analyses it; the owner of each shift is picked out of the connected shards
+# by rendezvous hashing, so when a shard joins or leaves only the shifts it gains or loses move
+
+# this shard's ID, None if the handler is not sharded (it then owns every shift)
+SHARD_ID = mqtt_configs.get("HANDLER_SHARD")
+
+# connected shards (IDs), learnt from each other's (retained) connected messages
+SHARDS = set()
+
+# seconds a shard waits on connecting, once subscribed to the shards' connected messages, before it
+# subscribes to the shifts' topics, so it knows the other shards before it receives the (retained)
+# shift statuses and decides which shifts it owns
+PRESENCE_SETTLE = 1
+# the pending subscription to the shifts' topics (asyncio.TimerHandle), while the shard's presence settles
+SETTLING = None
+
 # global variables to store shift/circuit information
+# many shifts (e.g. of different sites) are monitored at once, each keyed by the shift key of its topics
+# (see shift_topic in mqtts.py), "" for the default shift on the topics without a shift key
 
-# circuit's time-validating queue
-CHECKIN_QUEUE = None
 
-# on-duty cards (IDs)
-CARDS = None
+class MonitoredShift:
+    """
+    a shift being monitored: its circuit's check-ins and status flags
+    """
 
-# shift ongoing (true) or shift over (false)
-SHIFT_STATUS = False
+    def __init__(self):
+        # circuit's time-validating queue
+        self.queue = None
+        # the queued check-ins indexed by card and checkpoint, to validate scans against (see circuits.py)
+        self.index = None
+        # on-duty cards (IDs), a set as every scan is checked against it
+        self.cards = set()
+        # the circuit arrives a window (time span) of check-ins at a time
+        # whether the last window of the circuit has been received
+        self.final_window = False
+        # end (epoch) of the circuit received so far, i.e. of its last window
+        self.until = None
+        # shift ongoing (true) or shift over (false)
+        self.status = False
+        # alarm on or off flag
+        self.alarm_on = False
+        # whether the circuit has been reported done
+        self.done = False
+        # when the shift is next due to be analysed (its entry in DEADLINES), None if not scheduled
+        self.deadline = None
+
+
+# shifts being monitored {shift key: MonitoredShift}
+SHIFTS = {}
+
+# the shift each on-duty card is on duty in {card ID: shift key}, to route scans on the default scan topic
+# a card on duty in two shifts at once is taken to be in the latest one
+CARD_SHIFTS = {}
+
+# heap of (deadline, shift key), when each shift's soonest check-in window elapses
+# a single analyser serves every shift, sleeping until the soonest deadline of all
+DEADLINES = []
+
+# the handler runs on a single asyncio event loop (see launch_circuit_handler): the MQTT client's socket,
+# the analyser and every message callback, so the shifts' state has a single owner and needs no lock
+
+# set whenever a shift's queue (or shift/alarm status) changes, to wake the analyser early
+WAKE_ANALYSER = asyncio.Event()
+
+# set once the client's socket closes, to reconnect
+DISCONNECTED = asyncio.Event()
+
+# seconds to wait before (re)connecting to the broker
+RECONNECT_DELAY = 5
+
+# the client's housekeeping task, running while its socket is open
+MAINTENANCE = None
+
+# METRICS (see metrics.py), published every METRICS_INTERVAL seconds for the web app to render on /metrics
+METRICS = metrics.Registry()
+METRICS_INTERVAL = 15
+# MQTT messages handled, and how long each took to handle, by topic
+MQTT_MESSAGES = METRICS.counter(
+    "sentry_handler_mqtt_messages_total", "MQTT messages handled by the circuit handler.", ["topic"]
+)
+MQTT_MESSAGE_SECONDS = METRICS.histogram(
+    "sentry_handler_mqtt_message_seconds",
+    "Time taken by the circuit handler to handle an MQTT message.",
+    ["topic"],
+)
+# check-ins queued, and how far behind the analyser is on popping them, by shift
+QUEUE_DEPTH = METRICS.gauge(
+    "sentry_handler_checkin_queue_depth", "Check-ins queued by the circuit handler.", ["shift"]
+)
+QUEUE_LAG = METRICS.gauge(
+    "sentry_handler_checkin_queue_lag_seconds",
+    "Time since the soonest queued check-in's window elapsed, 0 if it has not yet.",
+    ["shift"],
+)
+SHIFTS_MONITORED = METRICS.gauge(
+    "sentry_handler_shifts", "Shifts monitored by the circuit handler (shard)."
+)
+# time between a check-in's window elapsing and it being reported overdue
+OVERDUE_DELAY = METRICS.histogram(
+    "sentry_handler_overdue_delay_seconds",
+    "Time between a check-in's window elapsing and it being reported overdue.",
+)
 
-# alarm on or off flag
-ALARM_ON_OFF = False
+# the shifts' state on disk (see handler_store.py), reloaded when the handler restarts
+# kept at HANDLER_STATE in '.env' (by default, in the instance folder), not kept if set but empty
+STORE = None
 
 # DEFINING MQTT TOPICS
 
 # SUBSCRIBE:
 
+# each of these is also received per shift, on '<topic>/<shift key>'
+
 # topic to receive the shift started/over message - SHIFT_ON_OFF
 
 # topic to receive a scan to validate - SENTRY_SCAN_INFO
 
+# topic to receive a batch of scans to validate at once - SENTRY_SCAN_BATCH
+
 # topic to receive the generated sentry circuit - MONITOR_SENTRY_CIRCUIT
 
+# topic to receive the following windows of the circuit being monitored - MONITOR_CIRCUIT_WINDOW
+
+# topic to receive the re-planned route tails of a circuit being monitored - MONITOR_CIRCUIT_UPDATE
+
 # topic to receive the alarm signal - ALARM
 
 
 # PUBLISH:
 
 # topic to publish on when connected to the broker
+# (each shard publishes on its own, 'sentry-platform/circuit-handler-<shard ID>/connected')
 CONNECTED = "sentry-platform/circuit-handler/connected"
 
+# topic the shards' connected messages are received on
+SHARDS_CONNECTED = "sentry-platform/+/connected"
+
+# client ID of the handler, and prefix of the shards' client IDs
+CLIENT_ID_PREFIX = "circuit-handler"
+
+# topic to request the circuit of a shift on, when this handler has none of its check-ins
+# (or the windows of it sent after a given time, when it has some) - CIRCUIT_RESEND
+
+# each of these is published on the topic of the shift concerned, '<topic>/<shift key>'
+
 # topic to publish when the circuit is exhausted - DONE
 
+# topic to publish overdue check-ins on - CHKS_OVERDUE
+
 # topic to publish relevant scan results to the broker - ALERTS
 
+# topic to publish the results of a batch of scans to the broker, at once - ALERTS_BATCH
+
 
 # DEFINING UTILITY FUNCTIONS
 
 
-def generate_checkins(circuits: list[dict]):
+def shard_owner(key: str, shards) -> str | None:
+    """
+    picks the shard owning a shift (key) out of the given shards, by rendezvous (highest random weight) hashing
+    """
+
+    return max(
+        shards,
+        key=lambda shard: hashlib.blake2b(f"{shard}/{key}".encode(), digest_size=8).digest(),
+        default=None,
+    )
+
+
+def owns(key: str) -> bool:
+    """
+    whether this handler owns the shift (key), always true if the handler is not sharded
+    """
+
+    return SHARD_ID is None or shard_owner(key, SHARDS | {SHARD_ID}) == SHARD_ID
+
+
+def rebalance(client: mqtt.Client) -> None:
+    """
+    drops the check-ins of the shifts this shard no longer owns, once the connected shards change,
+    and requests the circuits of the ongoing shifts it now owns but has no check-ins of
+    """
+
+    gained = []
+    for key, shift in SHIFTS.items():
+        if not owns(key):
+            # the cards are kept, to keep routing scans to the shift's owner
+            if shift.queue is not None:
+                shift.queue = None
+                shift.index = None
+                save_shift(key)
+        elif shift.status and shift.queue is None:
+            gained.append(key)
+
+    for key in gained:
+        client.publish(topic=shift_topic(CIRCUIT_RESEND, key), payload=None, qos=2)
+
+
+def request_circuit(client: mqtt.Client, key: str, shift: MonitoredShift) -> None:
+    """
+    requests the circuit of a shift that started before this handler (shard) connected:
+    all of it if the handler has none of its check-ins, else the windows sent after the end of the circuit
+    it has (e.g. restored from disk), as those sent while it was down or disconnected were missed
+    """
+
+    if shift.queue is None or shift.until is None:
+        client.publish(topic=shift_topic(CIRCUIT_RESEND, key), payload=None, qos=2)
+    elif not shift.final_window:
+        client.publish(
+            topic=shift_topic(CIRCUIT_RESEND, key),
+            payload=json.dumps({"since": shift.until}),
+            qos=2,
+        )
+
+
+def set_cards(key: str, cards: set) -> None:
+    """
+    sets the cards on duty in the given shift, replacing those of the circuit it was monitoring
+    """
+
+    shift = SHIFTS[key]
+    remove_cards(key, shift.cards)
+    shift.cards = cards
+    CARD_SHIFTS.update((card, key) for card in cards)
+
+
+def save_shift(key: str) -> None:
+    """
+    snapshots the shift's state to disk, whenever its queue is rebuilt (or dropped)
+    """
+
+    if STORE is None:
+        return
+
+    shift = SHIFTS[key]
+    STORE.save(
+        key,
+        {
+            "status": shift.status,
+            "alarm_on": shift.alarm_on,
+            "final_window": shift.final_window,
+            "done": shift.done,
+            "until": shift.until,
+            "cards": sorted(shift.cards),
+            "routes": None if shift.queue is None else dump_queue(shift.queue),
+        },
+    )
+
+
+def log_shift(key: str, event: str, *entries) -> None:
+    """
+    appends what happened to the shift since its last snapshot to its log on disk
+    'check' [card, checkpoint, time]: the check-in was checked
+    'expire' time: every check-in whose window elapsed by 'time' was popped off the queue
+    'flags' {status, alarm_on, final_window, done}: the shift's flags changed
+    """
+
+    if STORE is not None:
+        STORE.log(key, event, *entries)
+
+
+def log_flags(key: str) -> None:
+    shift = SHIFTS[key]
+    log_shift(
+        key,
+        "flags",
+        {
+            "status": shift.status,
+            "alarm_on": shift.alarm_on,
+            "final_window": shift.final_window,
+            "done": shift.done,
+        },
+    )
+
+
+def pop_expired(shift: MonitoredShift, time_now: int):
+    """
+    pops every check-in whose check-in window has elapsed by 'time_now' off the shift's queue (and index)
+    """
+
+    # popped off the index too, so scans are never validated against expired check-ins
+    while shift.queue and time_now > shift.queue[0]["time"] + CHECK_IN_WINDOW:
+        current = shift.queue.popleft()
+        shift.index.remove(current)
+        yield current
+
+
+def restore_shifts() -> None:
+    """
+    reloads the shifts being monitored before the handler (re)started, each shift's snapshot
+    with its log replayed onto it, check-ins (and checked flags) in the past included
+    check-ins whose windows elapsed while the handler was down are then reported overdue as usual
+    """
+
+    for key, (state, events) in STORE.load().items():
+        shift = SHIFTS[key] = MonitoredShift()
+        shift.status = state["status"]
+        shift.alarm_on = state["alarm_on"]
+        shift.final_window = state["final_window"]
+        shift.done = state["done"]
+        # snapshots taken before the end of the circuit was stored have none
+        shift.until = state.get("until")
+        set_cards(key, set(state["cards"]))
+
+        if state["routes"] is not None:
+            shift.queue = deque(load_queue(state["routes"]))
+            shift.index = CheckInIndex(shift.queue)
+
+        for event, data in events:
+            if event == "check" and shift.index is not None:
+                card, chk, time = data
+                check_in = shift.index.find(card, chk, time, 0)
+                if check_in is not None:
+                    check_in["checked"] = True
+            elif event == "expire" and shift.queue is not None:
+                # already reported before the restart
+                for _ in pop_expired(shift, data):
+                    pass
+            elif event == "flags":
+                for flag, value in data.items():
+                    setattr(shift, flag, value)
+
+        schedule_shift(key, shift)
+
+
+def schedule_shift(key: str, shift: MonitoredShift) -> None:
+    """
+    schedules the shift to be analysed once its soonest check-in window elapses
+    (or straight away, if its circuit is exhausted) and wakes the analyser
+    must be called whenever the shift's queue or status changes
+    """
+
+    if not shift.status or shift.done or shift.queue is None:
+        return
+
+    # an exhausted circuit is done straight away, unless the next window of check-ins
+    # (or the alarm being silenced) is yet to arrive, which reschedules the shift
+    if not shift.queue and (not shift.final_window or shift.alarm_on):
+        return
+
+    # the window elapses once the current (whole) second is past the check-in time + window
+    deadline = shift.queue[0]["time"] + CHECK_IN_WINDOW + 1 if shift.queue else 0
+
+    # an entry already due sooner will reschedule the shift when analysed
+    if shift.deadline is None or deadline < shift.deadline:
+        shift.deadline = deadline
+        heappush(DEADLINES, (deadline, key))
+        WAKE_ANALYSER.set()
+
+
+def remove_cards(key: str, cards) -> None:
+    """
+    takes the cards off duty in the given shift
+    """
+
+    for card in cards:
+        if CARD_SHIFTS.get(card) == key:
+            del CARD_SHIFTS[card]
+
+
+def generate_checkins(key: str, circuits: list[dict]):
     """
     generates a queue of instantaneous check-in info dicts i.e. check-ins
     used to check overdue scans and trigger alarms if necessary
     """
 
     check_ins = []
-    global CARDS
-    CARDS = [circuit["id"] for circuit in circuits]
+    # each sentry's route arrives in its compact form (see circuits.py)
+    routes = [SentryRoute.from_dict(circuit) for circuit in circuits]
+    shift = SHIFTS[key]
 
-    # accessing each dict in the list
-    for circuit in circuits:
+    # a new circuit for the shift replaces the one being monitored
+    set_cards(key, {route.id for route in routes})
+
+    # accessing each route in the list
+    for route in routes:
         # before a check-in is added to the check-ins list, the time is first validated
         # i.e. check-ins with past/expired timestamps are irrelevant and hence discarded
         # the check-ins list is extended with a list of relevant check-ins
+        # (the route's check-ins are in time order, so the relevant ones are all those after the split)
 
-        check_ins.extend(
-            route
-            for route in circuit["route"]
-            if route["time"] > datetime.timestamp(datetime.now())
-        )
+        check_ins.extend(route.check_ins(start=route.split(datetime.timestamp(datetime.now()))))
 
     # sorting the list in ascending order of check-in time and then converting it to a python queue
     # a queue is used because the validation algorithm will pop values off the beginning of the list
     # when the check-in window for that check-in has elapsed
     # queues are more efficient than lists when it comes to deleting from the beginning (index 0)
-    # this queue will be saved in the CHECKIN_QUEUE global variable
+    # this queue will be saved as the shift's queue
 
     check_ins.sort(key=itemgetter("time"))
-    return deque(check_ins)
+    shift.index = CheckInIndex(check_ins)
+    shift.queue = deque(check_ins)
+    shift.done = False
 
 
-def validate_scan(check_in: dict):
+def extend_checkins(key: str, circuits: list[dict]):
+    """
+    adds the check-ins of the next window of the shift's circuit to the end of its queue
+    every check-in in the window is expected after those already queued, so the queue stays sorted
+    check-ins up to the end of the circuit received so far are skipped, as a window requested again
+    (see CIRCUIT_RESEND) may overlap one received in the meantime
+    """
+
+    shift = SHIFTS[key]
+    check_ins = []
+    for circuit in circuits:
+        route = SentryRoute.from_dict(circuit)
+        check_ins.extend(
+            route.check_ins(start=0 if shift.until is None else route.split(shift.until))
+        )
+
+    check_ins.sort(key=itemgetter("time"))
+    shift.queue.extend(check_ins)
+    for check_in in check_ins:
+        shift.index.add(check_in)
+
+
+def update_checkins(key: str, updates: list[dict], since: int):
+    """
+    replaces the check-ins after 'since' (epoch) of the sentries whose routes were re-planned mid-shift
+    the rest of the queue (other sentries, and check-ins still within their check-in window) is left as is
+    """
+
+    shift = SHIFTS[key]
+    changed = {update["id"] for update in updates}
+
+    # the queue is already sorted by time, so is each new route tail
+    # merging them keeps the queue sorted without sorting all of it again
+    kept = (
+        check_in
+        for check_in in shift.queue
+        if check_in["id"] not in changed or check_in["time"] <= since
+    )
+    tails = (SentryRoute.from_dict(update).check_ins() for update in updates)
+    shift.queue = deque(merge(kept, *tails, key=itemgetter("time")))
+    # re-plans are rare, the index is rebuilt rather than patched
+    shift.index = CheckInIndex(shift.queue)
+
+
+def validate_scan(check_in: dict, key: str | None = None):
     """
     checks and validates a scan at a checkpoint
+    returns the shift key the scan was validated against ('key', or if None, the card's shift)
+    and the validation result, None if the shift is owned by another shard
     """
 
     chk, id, time = list(check_in.values())
+    if key is None:
+        key = CARD_SHIFTS.get(id, "")
+    shift = SHIFTS.get(key)
+
+    # another shard validates the scan
+    if not owns(key):
+        return key, None
+
     # check if the card should be on duty
-    if id not in CARDS:
+    if shift is None or shift.index is None or id not in shift.cards:
         # check if card is in database
-        return {"valid": False, "reason": "card not on duty"} | check_in
-
-    valid_id = False
-    valid_time = False
-
-    for item in CHECKIN_QUEUE:
-        # if scan is valid (right sentry, right checkpoint, right time), return message
-        if (
-            id == item["id"]
-            and chk == item["checkpoint"]
-            and time in range(item["time"] - CHECK_IN_WINDOW, item["time"] + (CHECK_IN_WINDOW + 1))
-        ):
-            item["checked"] = True
-            return {"valid": True, "reason": ""} | check_in
-
-        # if an on-duty card is scanned at the right time but the wrong checkpoint
-        # sets flags that indicate this as true
-        elif id == item["id"] and time in range(
-            item["time"] - CHECK_IN_WINDOW, item["time"] + (CHECK_IN_WINDOW + 1)
-        ):
-            valid_id = True
-            valid_time = True
-
-        # breaks loop when the subsequent check-in times are in the future
-        # either scan was too early or at the wrong checkpoint
-        elif time < (item["time"] - CHECK_IN_WINDOW):
-            return (
-                {"valid": False, "reason": "wrong checkpoint"} | check_in
-                if valid_id and valid_time
-                else {"valid": False, "reason": "wrong time of scan"} | check_in
+        return key, {"valid": False, "reason": "card not on duty"} | check_in
+
+    # the soonest check-in of the card at the checkpoint, within the check-in window of the scan
+    # (right sentry, right checkpoint, right time)
+    expected = shift.index.find(id, chk, time, CHECK_IN_WINDOW)
+    if expected is not None:
+        expected["checked"] = True
+        log_shift(key, "check", [id, chk, expected["time"]])
+        return key, {"valid": True, "reason": ""} | check_in
+
+    # an on-duty card scanned at the right time but the wrong checkpoint
+    if shift.index.expected(id, time, CHECK_IN_WINDOW):
+        return key, {"valid": False, "reason": "wrong checkpoint"} | check_in
+
+    # either scan was too early/late or the card is not expected again
+    return key, {"valid": False, "reason": "wrong time of scan"} | check_in
+
+
+def validate_scans(check_ins: list[dict], key: str | None = None) -> dict[str, list[dict]]:
+    """
+    checks and validates a batch of scans at once, e.g. those a checkpoint buffered while disconnected
+    returns the validation results, in order of scan time, by the shift key they were validated against
+    ('key', or if None, each card's shift), leaving out those of shifts owned by other shards
+    """
+
+    # the scans are grouped by shift, card and checkpoint and sorted by time (sort), then each group
+    # is matched against the card's check-ins at the checkpoint, also sorted by time (merge)
+    groups = {}
+    for check_in in check_ins:
+        chk, id, time = list(check_in.values())
+        scan_key = CARD_SHIFTS.get(id, "") if key is None else key
+        groups.setdefault((scan_key, id, chk), []).append((time, check_in))
+
+    results = {}
+    for (scan_key, id, chk), scans in groups.items():
+        # another shard validates these scans
+        if not owns(scan_key):
+            continue
+
+        shift = SHIFTS.get(scan_key)
+        batch = results.setdefault(scan_key, [])
+
+        # check if the card should be on duty
+        if shift is None or shift.index is None or id not in shift.cards:
+            batch.extend(
+                (time, {"valid": False, "reason": "card not on duty"} | check_in)
+                for time, check_in in scans
             )
+            continue
+
+        scans.sort(key=itemgetter(0))
+        found = shift.index.find_all(id, chk, [time for time, _ in scans], CHECK_IN_WINDOW)
+        log_shift(
+            scan_key,
+            "check",
+            *([id, chk, expected["time"]] for expected in found if expected is not None),
+        )
+
+        for (time, check_in), expected in zip(scans, found):
+            # right sentry, right checkpoint, right time
+            if expected is not None:
+                expected["checked"] = True
+                result = {"valid": True, "reason": ""}
+            # an on-duty card scanned at the right time but the wrong checkpoint
+            elif shift.index.expected(id, time, CHECK_IN_WINDOW):
+                result = {"valid": False, "reason": "wrong checkpoint"}
+            # either scan was too early/late or the card is not expected again
+            else:
+                result = {"valid": False, "reason": "wrong time of scan"}
+
+            batch.append((time, result | check_in))
+
+    return {
+        scan_key: [result for _, result in sorted(batch, key=itemgetter(0))]
+        for scan_key, batch in results.items()
+    }
+
+
+def expire_checkins(key: str, shift: MonitoredShift, time_now: float) -> list[tuple]:
+    """
+    pops every check-in of the shift whose check-in window has elapsed by 'time_now' off its queue
+    returns the (topic, payload) messages to publish: the overdue (unchecked) check-ins,
+    and the circuit being done once it is exhausted
+    """
+
+    messages = []
+    if not shift.status or shift.done or shift.queue is None:
+        return messages
 
+    # 1. compare the current time against the soonest expected check-ins (reason for sorting)
+    # 2. remove every check-in whose window has elapsed from the queue, all at once
+    # 3. if any reads False, some sentry hasn't checked-in in time and that's a problem, snitch
+    # 4. if the shift was validated, the checked flag should read True and the shift proceeds
 
-def analyse_checkins(client: mqtt.Client):
+    expired = 0
+    for current in pop_expired(shift, int(time_now)):  # 1, 2
+        expired += 1
+        if not shift.alarm_on and not current["checked"]:  # 3 -> only checked if alarm is off
+            messages.append((shift_topic(CHKS_OVERDUE, key), json.dumps(current)))
+            OVERDUE_DELAY.observe(time_now - current["time"] - CHECK_IN_WINDOW)
+
+        # 4. else do nothing
+
+    if expired:
+        log_shift(key, "expire", int(time_now))
+
+    # if all check-ins have been validated / circuit is exhausted
+    if not shift.queue and shift.final_window and not shift.alarm_on:
+        shift.done = True
+        log_flags(key)
+        messages.append((shift_topic(DONE, key), None))
+
+    schedule_shift(key, shift)
+    return messages
+
+
+def pop_due(time_now: float) -> list[tuple[str, MonitoredShift]]:
+    """
+    pops the shifts whose soonest check-in windows have elapsed by 'time_now' off DEADLINES
+    returns them as (shift key, shift) pairs, each to be analysed (see expire_checkins) once
+    """
+
+    due = []
+    while DEADLINES and DEADLINES[0][0] <= time_now:
+        deadline, key = heappop(DEADLINES)
+        shift = SHIFTS.get(key)
+        # entries left behind by a shift being rescheduled sooner, or removed, are skipped
+        if shift is not None and shift.deadline == deadline:
+            shift.deadline = None
+            due.append((key, shift))
+
+    return due
+
+
+async def analyse_checkins(client: mqtt.Client):
     """
-    handles overdue scans by checking whether the soonest expected scan was validated
+    handles overdue scans of every shift being monitored by checking whether the soonest expected scans
+    were validated, in a single coroutine for all shifts
+    sleeps until the soonest deadline of any shift (or until a shift changes) rather than polling
     """
 
-    # for as long as a shift is ongoing, these checks need be made
-    while SHIFT_STATUS:
-        # if all check-ins have been validated / circuit is exhausted
-        print("checking")
-        if not ALARM_ON_OFF and not CHECKIN_QUEUE:
-            client.publish(topic=DONE, payload=None, qos=2)
-            break
+    while True:
+        time_now = datetime.timestamp(datetime.now())
 
-        # 1. check the current time
-        # 2. compare it against the soonest expected check-in (reason for sorting)
-        # 3. if the check-in time has passed, remove it from the queue. if not, proceed
-        # 4. if it reads False, some sentry hasn't checked-in in time and that's a problem, snitch
-        # 5. if the shift was validated, the checked flag should read True and the shift proceeds
+        # the shifts whose soonest check-in windows have elapsed
+        due = pop_due(time_now)
 
-        time_now = int(datetime.timestamp(datetime.now()))  # 1
+        if not due:
+            # the next window of check-ins (or the alarm being silenced) may be yet to arrive
+            WAKE_ANALYSER.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    WAKE_ANALYSER.wait(),
+                    timeout=DEADLINES[0][0] - time_now if DEADLINES else None,
+                )
+            continue
 
-        if time_now > CHECKIN_QUEUE[0]["time"] + CHECK_IN_WINDOW:  # 2
-            print("analysed")
-            current = CHECKIN_QUEUE.popleft()  # 3
-            if not ALARM_ON_OFF and not current["checked"]:  # 4 -> only checked if alarm is off
-                client.publish(topic=CHKS_OVERDUE, payload=json.dumps(current), qos=2)
+        messages = []
+        for key, shift in due:
+            messages.extend(expire_checkins(key, shift, time_now))
 
-            # 5. else do nothing
+        for topic, payload in messages:
+            client.publish(topic=topic, payload=payload, qos=2)
 
-        # runs this loop every second
-        time.sleep(1)
+        # lets the messages received meanwhile be handled before the next deadline
+        await asyncio.sleep(0)
+
+
+def update_queue_metrics(time_now: float) -> None:
+    """
+    sets the gauges of the shifts' queues, of the shifts owned by this handler (shard)
+    """
+
+    QUEUE_DEPTH.clear()
+    QUEUE_LAG.clear()
+    SHIFTS_MONITORED.set(len(SHIFTS))
+
+    for key, shift in SHIFTS.items():
+        if shift.queue is None:
+            continue
+        QUEUE_DEPTH.set(len(shift.queue), shift=key)
+        QUEUE_LAG.set(
+            max(time_now - shift.queue[0]["time"] - CHECK_IN_WINDOW, 0) if shift.queue else 0,
+            shift=key,
+        )
+
+
+async def publish_metrics(client: mqtt.Client):
+    """
+    publishes the handler's metrics every METRICS_INTERVAL seconds, for the web app to render
+    """
+
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        update_queue_metrics(datetime.timestamp(datetime.now()))
+        # not queued while disconnected, the next ones will do
+        client.publish(
+            topic=HANDLER_METRICS,
+            payload=json.dumps({"id": CLIENT_ID, "metrics": METRICS.collect()}),
+            qos=0,
+        )
 
 
 # DEFINING CALLBACK FUNCTIONS FOR MQTT EVENTS
@@ -193,37 +730,87 @@ def on_mqtt_connect(client: mqtt.Client, userdata, flags, rc):
     callback event handler, called when this client connects to the broker
     """
 
+    global SETTLING
+
     if rc == 0:
         payload = {"id": CLIENT_ID, "connected": True}
-        client.publish(topic=CONNECTED, payload=json.dumps(payload), qos=2)
+        # retained for shards, so shards connecting later learn of this one
+        client.publish(
+            topic=CONNECTED, payload=json.dumps(payload), qos=2, retain=SHARD_ID is not None
+        )
 
         # subscribe to relevant topics each time it connects
         # this includes at startup and reconnection
-        # list of (topic, QoS) tuples
-        client.subscribe(
-            [(MONITOR_SENTRY_CIRCUIT, 2), (SHIFT_ON_OFF, 2), (SENTRY_SCAN_INFO, 2), (ALARM, 2)]
-        )
+        if SHARD_ID is None:
+            subscribe_shifts(client)
+        else:
+            # the other shards' connected messages first: until they are in, every shift would seem to
+            # be this shard's, and it would ask for the circuits of (retained) ongoing shifts it does not own
+            client.subscribe(SHARDS_CONNECTED, qos=2)
+            # (that of a connection lost in the meantime is superseded)
+            if SETTLING is not None:
+                SETTLING.cancel()
+            SETTLING = asyncio.get_running_loop().call_later(
+                PRESENCE_SETTLE, subscribe_shifts, client
+            )
 
     # using connect_async() will retry connection until established
 
 
+def subscribe_shifts(client: mqtt.Client):
+    """
+    subscribes to the shifts' topics, once connected
+    """
+
+    # the connection was lost while the shard's presence was settling, it subscribes again on reconnecting
+    if not client.is_connected():
+        return
+
+    # list of (topic, QoS) tuples
+    # each topic is subscribed to as is (default shift) and per shift ('<topic>/+')
+    topics = [
+        MONITOR_SENTRY_CIRCUIT,
+        MONITOR_CIRCUIT_WINDOW,
+        MONITOR_CIRCUIT_UPDATE,
+        SHIFT_ON_OFF,
+        SENTRY_SCAN_INFO,
+        SENTRY_SCAN_BATCH,
+        ALARM,
+    ]
+    client.subscribe([(topic, 2) for topic in topics] + [(f"{topic}/+", 2) for topic in topics])
+
+
+@metrics.measure_messages(messages=MQTT_MESSAGES, seconds=MQTT_MESSAGE_SECONDS)
 def on_mqtt_message(client: mqtt.Client, userdata, message):
     """
     callback event handler, called when a message is published on any subscribed topic
     """
 
-    topic = message.topic
-
-    global CHECKIN_QUEUE
-    global SHIFT_STATUS
-    global ALARM_ON_OFF
+    # a shard connected/disconnected, of the form {id: client ID, connected: bool}
+    if message.topic.endswith("/connected"):
+        with contextlib.suppress(ValueError, KeyError, TypeError, AttributeError):
+            payload: dict = json.loads(message.payload)
+            if payload["id"].startswith(f"{CLIENT_ID_PREFIX}-") and payload["id"] != CLIENT_ID:
+                shard = payload["id"][len(CLIENT_ID_PREFIX) + 1 :]
+                if payload["connected"]:
+                    SHARDS.add(shard)
+                else:
+                    SHARDS.discard(shard)
+                rebalance(client)
+        return
+
+    # the shift the message is about, "" for the default shift
+    topic, key = split_shift_topic(message.topic)
+    if key is None:
+        return
 
     # circuit sent by the broker
     if topic == MONITOR_SENTRY_CIRCUIT:
-        # the sentry circuit will be sent as a JSON bytearray over MQTT
-        payload: dict = json.loads(message.payload)
+        # the sentry circuit will be sent as a binary (or JSON) bytearray over MQTT (see wire.py)
+        payload: dict = decode_message(message.payload)
 
         # at this point, payload is now a list of Python dictionaries - the generated route
+        # in compact form, each sentry's check-ins stored as columns (see SentryRoute in circuits.py)
         # the goal is to construct another list of python dictionaries of the form:
 
         # [{
@@ -234,16 +821,69 @@ def on_mqtt_message(client: mqtt.Client, userdata, message):
         # },
         # others...]
 
-        # which is what is stored in the 'route' key of each dict in the 'payload' list
+        # which is what each route's check_ins() returns
         # this is essentially a list/queue of check-ins
 
-        CHECKIN_QUEUE = generate_checkins(payload)
+        # only the first window of the circuit is sent here, of the form
+        # {
+        #     until: end of the window (epoch)
+        #     final: true if the window is the last one, i.e. the circuit ends within it
+        #     routes: each sentry's check-ins within the window, in compact form
+        # }
+        # the following windows are sent on MONITOR_CIRCUIT_WINDOW as the shift goes on
+
+        shift = SHIFTS.setdefault(key, MonitoredShift())
+        if owns(key):
+            generate_checkins(key, payload["routes"])
+            shift.final_window = payload["final"]
+            shift.until = payload["until"]
+            schedule_shift(key, shift)
+        else:
+            # only the cards are kept, to route scans to the shift's owner
+            set_cards(key, {route["id"] for route in payload["routes"]})
+        save_shift(key)
+
+    # the next window of the circuit being monitored, same form as the first window above
+    elif topic == MONITOR_CIRCUIT_WINDOW:
+        payload: dict = decode_message(message.payload)
+
+        # a circuit must be monitored for its check-ins to be extended
+        shift = SHIFTS.get(key)
+        if shift is not None and shift.queue is not None:
+            shift.final_window = shift.final_window or payload["final"]
+            extend_checkins(key, payload["routes"])
+            shift.until = max(shift.until or 0, payload["until"])
+            schedule_shift(key, shift)
+            save_shift(key)
+
+    # re-planned route tails sent by the broker, mid-shift
+    elif topic == MONITOR_CIRCUIT_UPDATE:
+        payload: dict = decode_message(message.payload)
+
+        # payload is of the form
+        # {
+        #     from: time (epoch) from which the routes were re-planned
+        #     routes: [{
+        #         on_duty: false if the sentry went off duty (the route is then empty)
+        #         id: sentry ID whose route changed,
+        #         others: the sentry's new check-ins after 'from', in compact form (see circuits.py)
+        #     }, others...]
+        # }
 
-        # passing the analyser to a separate thread to avoid blocking the main thread
-        # since the analyser has a conditional infinite loop, running it on this thread
-        # will halt all other processes until the loop is terminated, which is undesirable
-        analyser = threading.Thread(target=analyse_checkins, args=[client], daemon=True)
-        analyser.start()
+        # a circuit must be monitored for its check-ins to be updated
+        shift = SHIFTS.get(key)
+        if shift is not None:
+            # off-duty cards are no longer expected at any checkpoint
+            # (known to every shard, to route scans by card)
+            off_duty = {update["id"] for update in payload["routes"] if not update["on_duty"]}
+            shift.cards -= off_duty
+            remove_cards(key, off_duty)
+
+        if shift is not None and shift.queue is not None:
+            update_checkins(key, updates=payload["routes"], since=payload["from"])
+            schedule_shift(key, shift)
+        if shift is not None:
+            save_shift(key)
 
     # check-in sent by any checkpoint
     elif topic == SENTRY_SCAN_INFO:
@@ -257,13 +897,31 @@ def on_mqtt_message(client: mqtt.Client, userdata, message):
         #     scan-time: time at which the sentry has scanned
         # }
 
-        # these are checked against the checkpoint, id, and time keys respectively, of each dict in CHECKIN_QUEUE
+        # these are checked against the checkpoint, id, and time keys respectively, of each check-in
+        # of the shift (that of the topic, or the one the card is on duty in if sent on the default topic)
         # if a match is found, the value of the checked key is set to True
         # else send validation result to web app
 
         # pass in a list of relevent values: [chk, id, time]
-        validation_result = validate_scan(check_in=payload)
-        client.publish(topic=ALERTS, payload=json.dumps(validation_result), qos=2)
+        key, validation_result = validate_scan(check_in=payload, key=key or None)
+        if validation_result is not None:
+            client.publish(
+                topic=shift_topic(ALERTS, key), payload=json.dumps(validation_result), qos=2
+            )
+
+    # a batch of scans, sent by a checkpoint at once
+    elif topic == SENTRY_SCAN_BATCH:
+        payload: list = json.loads(message.payload)
+
+        # payload is a list of scans, each of the same form as those on SENTRY_SCAN_INFO
+        # the whole batch is validated in a single pass and the results sent back at once,
+        # one message per shift (of the same form as ALERTS, in a list)
+
+        results = validate_scans(check_ins=payload, key=key or None)
+        for result_key, batch in results.items():
+            client.publish(
+                topic=shift_topic(ALERTS_BATCH, result_key), payload=json.dumps(batch), qos=2
+            )
 
     # checker for shift status message
     elif topic == SHIFT_ON_OFF:
@@ -274,53 +932,156 @@ def on_mqtt_message(client: mqtt.Client, userdata, message):
 
         # shift inactive
         if payload == "OFF":
-            SHIFT_STATUS = False
-            time.sleep(1)
-            CHECKIN_QUEUE = None
+            # the shift is no longer monitored, its analyser deadline is skipped once due
+            shift = SHIFTS.pop(key, None)
+            if shift is not None:
+                remove_cards(key, shift.cards)
+            if STORE is not None:
+                STORE.delete(key)
 
         # shift active
         elif payload == "ON":
-            SHIFT_STATUS = True
+            shift = SHIFTS.setdefault(key, MonitoredShift())
+            shift.status = True
+            schedule_shift(key, shift)
+            log_flags(key)
+            # a retained message means the shift started before this handler (shard) connected
+            # e.g. it restarted mid-shift, so it has to ask for the circuit
+            if message.retain and owns(key):
+                request_circuit(client, key, shift)
 
     # checker for alarm signal
     elif topic == ALARM:
         payload: str = message.payload.decode("utf-8")
 
+        shift = SHIFTS.setdefault(key, MonitoredShift())
         if payload == "ON":
-            ALARM_ON_OFF = True
+            shift.alarm_on = True
             print("alarm triggered")
         elif payload == "OFF":
-            ALARM_ON_OFF = False
+            # the shift may be waiting on the alarm to be silenced to report the circuit done
+            shift.alarm_on = False
+            schedule_shift(key, shift)
             print("alarm silenced")
+        log_flags(key)
 
 
 def on_mqtt_disconnect(client: mqtt.Client, userdata, rc):
     print("MQTT disconnected")
 
 
-def on_mqtt_log(client, userdata, level, buf):
-    print("MQTT log:", buf)
+# RUNNING THE CLIENT ON THE EVENT LOOP
+# instead of loop_start()'s network thread, the client's socket is watched by the event loop,
+# which reads/writes it as it becomes readable/writable (loop_read/loop_write) and runs
+# the client's housekeeping (keepalive pings, retries) every second (loop_misc)
+
+
+def on_socket_open(client: mqtt.Client, userdata, sock):
+    global MAINTENANCE
+
+    loop = asyncio.get_running_loop()
+    loop.add_reader(sock, client.loop_read)
+    MAINTENANCE = loop.create_task(maintain_client(client))
+
+
+def on_socket_close(client: mqtt.Client, userdata, sock):
+    loop = asyncio.get_running_loop()
+    loop.remove_reader(sock)
+    loop.remove_writer(sock)
+    MAINTENANCE.cancel()
+    DISCONNECTED.set()
+
 
+def on_socket_register_write(client: mqtt.Client, userdata, sock):
+    asyncio.get_running_loop().add_writer(sock, client.loop_write)
+
+
+def on_socket_unregister_write(client: mqtt.Client, userdata, sock):
+    asyncio.get_running_loop().remove_writer(sock)
+
+
+async def maintain_client(client: mqtt.Client):
+    while client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+        await asyncio.sleep(1)
+
+
+async def connect_client(client: mqtt.Client):
+    """
+    connects the client to the broker, and reconnects it whenever the connection is lost
+    """
+
+    while True:
+        DISCONNECTED.clear()
+        try:
+            # the connection itself blocks the loop, briefly, as there is nothing else to handle until then
+            # (overdue check-ins are queued by the client and sent once it is connected)
+            client.connect(host=MQTT_HOST, port=MQTT_PORT, keepalive=3600)
+        except OSError as error:
+            print("MQTT connection failed:", error)
+        else:
+            await DISCONNECTED.wait()
+
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def run_circuit_handler(handler: mqtt.Client):
+    """
+    runs the handler: its client's connection and the analyser, on the running event loop
+    """
+
+    # attach the event loop to the client's socket
+    handler.on_socket_open = on_socket_open
+    handler.on_socket_close = on_socket_close
+    handler.on_socket_register_write = on_socket_register_write
+    handler.on_socket_unregister_write = on_socket_unregister_write
+
+    # a single analyser serves every shift, however many are monitored
+    analyser = asyncio.create_task(analyse_checkins(handler))
+
+    await asyncio.sleep(2)  # wait for 2 seconds after web app launch to connect
+    await asyncio.gather(connect_client(handler), analyser, publish_metrics(handler))
+
+
+def launch_circuit_handler(shard: str = None):
+    global SHARD_ID
+    global CLIENT_ID
+    global CONNECTED
+    global STORE
+
+    # a sharded handler's client ID (and connected topic) is its own
+    SHARD_ID = shard or SHARD_ID
+    if SHARD_ID is not None:
+        CLIENT_ID = f"{CLIENT_ID_PREFIX}-{SHARD_ID}"
+        CONNECTED = f"sentry-platform/{CLIENT_ID}/connected"
 
-def launch_circuit_handler():
     # create client instance
-    handler = mqtt.Client(client_id=CLIENT_ID, clean_session=True, reconnect_on_failure=True)
+    handler = mqtt.Client(client_id=CLIENT_ID, clean_session=True)
     # configure client with broker credentials
     handler.username_pw_set(username=MQTT_UNAME, password=MQTT_PASS)
     # set LWT message, sent on unprecedented disconnect
     lwt = {"id": CLIENT_ID, "connected": False}
-    handler.will_set(topic=CONNECTED, payload=json.dumps(lwt))
+    handler.will_set(topic=CONNECTED, payload=json.dumps(lwt), retain=SHARD_ID is not None)
     # attach defined event callback functions to created client
     handler.on_connect = on_mqtt_connect
     handler.on_message = on_mqtt_message
     handler.on_disconnect = on_mqtt_disconnect
-    handler.on_log = on_mqtt_log
-    # connect to broker asynchronously
-    time.sleep(2)  # wait for 5 seconds after web app launch to connect
-    handler.connect_async(host=MQTT_HOST, keepalive=3600)
-    # start listening loop on a background thread
-    handler.loop_start()
+    # no on_log callback: paho would call it for every packet sent and received
+
+    # reload the shifts being monitored before a restart, and resume analysing them straight away
+    # (each shard keeps its own state)
+    if state_path := mqtt_configs.get("HANDLER_STATE", f"instance/{CLIENT_ID}.db"):
+        STORE = HandlerStore(state_path)
+        restore_shifts()
+
+    # runs until the process exits, on the calling thread
+    asyncio.run(run_circuit_handler(handler))
 
 
 if __name__ == "__main__":
-    launch_circuit_handler()
+    parser = argparse.ArgumentParser(
+        description="Validates sentry scans of the shifts being monitored."
+    )
+    parser.add_argument("--shard", help="shard ID, to run as one of several handler shards")
+    args = parser.parse_args()
+
+    launch_circuit_handler(shard=args.shard)
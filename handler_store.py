@@ -0,0 +1,129 @@
+"""
+    On-disk state of the circuit handler (see circuit_handler.py), so that it restarts where it left off
+    instead of waiting for the web app to re-send the circuits being monitored
+
+    each shift is kept as a snapshot (its queued check-ins, in compact form, and its flags) followed by
+    an append-only log of what happened to it since (check-ins checked, expired, flags changed)
+    a shift's snapshot is rewritten whenever its queue is rebuilt (new circuit, window, re-plan),
+    which also clears its log. stored in SQLite, in WAL mode so each log entry is a cheap append
+"""
+
+import json
+import sqlite3
+from heapq import merge
+from operator import itemgetter
+
+from appcore.circuits import SentryRoute
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    shift TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    shift TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS log_shift ON log (shift);
+"""
+
+
+def dump_queue(queue) -> list[dict]:
+    """
+    converts a queue of check-in info dicts (sorted by time) into each card's route in compact form
+    """
+
+    routes = {}
+    for check_in in queue:
+        route = routes.get(check_in["id"])
+        if route is None:
+            route = routes[check_in["id"]] = SentryRoute(None, None, check_in["id"])
+        route.append(check_in["checkpoint"], check_in["time"])
+        if check_in["checked"]:
+            route.check(len(route) - 1)
+
+    return [route.to_dict() for route in routes.values()]
+
+
+def load_queue(routes: list[dict]) -> list[dict]:
+    """
+    converts each card's route in compact form back into check-in info dicts, sorted by time
+    unlike generate_checkins in circuit_handler.py, check-ins in the past are kept
+    """
+
+    return list(
+        merge(
+            *(SentryRoute.from_dict(route).check_ins() for route in routes), key=itemgetter("time")
+        )
+    )
+
+
+class HandlerStore:
+    """
+    snapshots and logs of the shifts monitored by the circuit handler, in an SQLite database at 'path'
+    """
+
+    def __init__(self, path: str):
+        # the handler's callbacks and its analyser all run on its event loop, i.e. on a single thread
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # durable across a crash of the handler, without waiting on the disk at every log entry
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def save(self, shift: str, state: dict) -> None:
+        """
+        replaces the shift's snapshot, and clears its log
+        """
+
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO snapshots (shift, state) VALUES (?, ?)",
+                (shift, json.dumps(state, separators=(",", ":"))),
+            )
+            self.connection.execute("DELETE FROM log WHERE shift = ?", (shift,))
+
+    def log(self, shift: str, event: str, *entries) -> None:
+        """
+        appends one entry (data) per entry in 'entries' of an event to the shift's log
+        """
+
+        self.connection.executemany(
+            "INSERT INTO log (shift, event, data) VALUES (?, ?, ?)",
+            [(shift, event, json.dumps(data, separators=(",", ":"))) for data in entries],
+        )
+
+    def delete(self, shift: str) -> None:
+        """
+        forgets the shift, e.g. once it is over
+        """
+
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM snapshots WHERE shift = ?", (shift,))
+            self.connection.execute("DELETE FROM log WHERE shift = ?", (shift,))
+
+    def load(self) -> dict[str, tuple[dict, list[tuple]]]:
+        """
+        returns every shift's snapshot and the (event, data) entries logged since, in order
+        {shift: (state, [(event, data), ...])}
+        """
+
+        shifts = {
+            shift: (json.loads(state), [])
+            for shift, state in self.connection.execute("SELECT shift, state FROM snapshots")
+        }
+
+        for shift, event, data in self.connection.execute(
+            "SELECT shift, event, data FROM log ORDER BY seq"
+        ):
+            if shift in shifts:
+                shifts[shift][1].append((event, json.loads(data)))
+
+        return shifts
+
+    def close(self) -> None:
+        self.connection.close()
@@ -16,6 +16,28 @@ SECRET_KEY = "3ac20a2d9e49ba3df314f867e59ca95b"
 # Database connection details for Flask-SQLAlchemy
 SQLALCHEMY_DATABASE_URI = "sqlite:///platform.db"
 
+# Circuit generation: number of candidate circuits generated at once (NumPy batch mode), the best one is kept
+# set to 1 to generate one circuit at a time with the constructive generator instead
+CIRCUIT_CANDIDATES = 64
+# maximum time (seconds) spent generating a circuit, the best circuit found so far is used once it runs out
+CIRCUIT_TIME_BUDGET = 10
+# number of worker processes circuits are generated on (None = one per CPU core)
+CIRCUIT_WORKERS = None
+# finished circuit generation jobs (and their progress pages) are kept this many seconds, then forgotten
+CIRCUIT_JOB_TTL = 600
+# the circuit being monitored is sent to the circuit handler a window (seconds) of check-ins at a time
+CIRCUIT_WINDOW = 3600
+# wire format of the circuits sent to the circuit handler: "binary" (compact) or "json" (readable, for debugging)
+CIRCUIT_WIRE_FORMAT = "binary"
+# alerts are sent to the supervisors' browsers a window (seconds) at a time, 0 to send each one at once
+ALERT_WINDOW = 0.25
+# at most this many alerts are queued, once full new alerts are merged ("merge") into queued alerts of
+# the same kind, or dropped ("drop") in favour of more severe ones
+ALERT_QUEUE_SIZE = 500
+ALERT_OVERFLOW = "merge"
+# number of shifts listed per page of the shift logs
+SHIFT_LOG_PAGE_SIZE = 25
+
 # More MQTT details for Flask-MQTT
 MQTT_CLIENT_ID = "sentry-platform"
 MQTT_KEEPALIVE = 300
@@ -0,0 +1,674 @@
+#!/usr/bin/python3
+"""
+    Load-tests scan validation end to end: simulates the checkpoints of a synthetic premises and the sentries
+    patrolling a circuit generated on it, publishing their scans (and the checkpoints' connected heartbeats and
+    scans outside the shift) at set rates, and measures how fast they are answered, i.e. the latency from scan
+    to alert (circuit handler) and to checkpoint response (web app), and the throughput
+
+    runs against a broker, with the circuit handler (and the web app) running as usual,
+    or in-process against a fake broker, the circuit handler and a stand-in for the web app's responses
+
+    e.g.
+    $   python loadtest.py --checkpoints 25 --sentries 10 --rate 200 --duration 30
+    $   python loadtest.py --broker localhost:1883 --rate 50 --errors 0.05 --output load.json
+"""
+
+import argparse
+import contextlib
+import json
+import random
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from heapq import heappop, heappush
+from statistics import quantiles
+
+import paho.mqtt.client as mqtt
+
+import appcore.circuits as circuits
+import appcore.utils as utils
+import circuit_handler
+from appcore.mqtts import (
+    ALERTS,
+    MONITOR_SENTRY_CIRCUIT,
+    OUTSIDE_SHIFT_SCAN,
+    SENTRY_SCAN_INFO,
+    SHIFT_ON_OFF,
+    shift_topic,
+)
+from appcore.circuits import CheckInIndex
+from appcore.wire import encode_message
+from benchmark import PREMISES, environment
+
+# topic the checkpoints publish their connected heartbeats on, {id: "Checkpoint-<ID>", connected: bool}
+CHECKPOINT_CONNECTED = "sentry-platform/checkpoints/connected"
+
+# topic the web app responds to each scan at a checkpoint on, see the ALERTS handler in routes.py
+CHECKPOINT_RESPONSE = "sentry-platform/checkpoints/{}/response"
+
+# response codes sent to the checkpoints by the web app (routes.py), by validation result
+# (the stand-in does not look cards up in the database, so never tells a stolen card, 3, from an unknown one)
+RESPONSE_CODES = {"": 1, "card not on duty": 2, "wrong checkpoint": 4, "wrong time of scan": 5}
+
+# errors injected into scans, by the reason they are meant to be found invalid for
+FAULTS = ("card not on duty", "wrong checkpoint", "wrong time of scan")
+
+# prefix of the load test's client IDs and cards, so they are not mistaken for real ones
+PREFIX = "loadtest"
+
+
+# FAKE BROKER
+
+
+def _topic_matches(topic_filter: str, topic: str) -> bool:
+    """
+    whether a topic matches a subscription's topic filter, with its '+' and '#' wildcards
+    """
+
+    filter_levels = topic_filter.split("/")
+    levels = topic.split("/")
+
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(levels) or level not in ("+", levels[index]):
+            return False
+
+    return len(filter_levels) == len(levels)
+
+
+def _remaining_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def _string(data: bytes, offset: int) -> tuple[bytes, int]:
+    """
+    returns the length-prefixed string at 'offset' and the offset after it
+    """
+
+    (length,) = struct.unpack_from("!H", data, offset)
+    return data[offset + 2 : offset + 2 + length], offset + 2 + length
+
+
+class FakeBroker(socketserver.ThreadingTCPServer):
+    """
+    minimal in-process MQTT (3.1.1) broker standing in for mosquitto, enough for a load test:
+    connect (with last will), subscribe (with wildcards), publish (QoS 0 to 2, retained) and ping
+    messages are delivered to subscribers at QoS 0, and sessions are never persisted
+    each client is served on its own thread
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeBrokerClient)
+        # {client: topic filters} of the connected clients
+        self.subscriptions = {}
+        self.retained = {}
+        self.lock = threading.Lock()
+
+    def start(self) -> int:
+        """
+        starts the broker on a background thread, on a free local port (returned)
+        """
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False):
+        with self.lock:
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            subscribers = [
+                client
+                for client, topic_filters in self.subscriptions.items()
+                if any(_topic_matches(topic_filter, topic) for topic_filter in topic_filters)
+            ]
+
+        for client in subscribers:
+            client.deliver(topic, payload)
+
+    def subscribe(self, client, topic_filters: list[str]):
+        with self.lock:
+            self.subscriptions.setdefault(client, []).extend(topic_filters)
+            retained = [
+                (topic, payload)
+                for topic, payload in self.retained.items()
+                if any(_topic_matches(topic_filter, topic) for topic_filter in topic_filters)
+            ]
+
+        for topic, payload in retained:
+            client.deliver(topic, payload, retain=True)
+
+
+class FakeBrokerClient(socketserver.StreamRequestHandler):
+    """
+    a client connected to the fake broker
+    """
+
+    def setup(self):
+        super().setup()
+        # packets are written to the client by its own thread (acknowledgements) and by the publishers' threads
+        self.write_lock = threading.Lock()
+
+    def write(self, packet: bytes):
+        with self.write_lock, contextlib.suppress(OSError):
+            self.request.sendall(packet)
+
+    def deliver(self, topic: str, payload: bytes, retain: bool = False):
+        packet = struct.pack("!H", len(topic.encode())) + topic.encode() + payload
+        self.write(bytes([0x31 if retain else 0x30]) + _remaining_length(len(packet)) + packet)
+
+    def read(self, length: int) -> bytes:
+        data = self.rfile.read(length)
+        if len(data) < length:
+            raise ConnectionError
+        return data
+
+    def handle(self):
+        will = None
+        disconnected = False
+
+        try:
+            while True:
+                header = self.read(1)[0]
+                length, multiplier = 0, 1
+                while True:
+                    digit = self.read(1)[0]
+                    length += (digit & 0x7F) * multiplier
+                    multiplier *= 128
+                    if digit < 0x80:
+                        break
+                data = self.read(length)
+
+                match header >> 4:
+                    # CONNECT: protocol name, level, flags, keepalive, client ID, then the will if any
+                    case 1:
+                        _, offset = _string(data, 0)
+                        flags = data[offset + 1]
+                        _, offset = _string(data, offset + 4)
+                        if flags & 0x04:
+                            will_topic, offset = _string(data, offset)
+                            will_payload, offset = _string(data, offset)
+                            will = (will_topic.decode(), will_payload, bool(flags & 0x20))
+                        self.write(b"\x20\x02\x00\x00")
+                    # PUBLISH, acknowledged according to its QoS
+                    case 3:
+                        qos = (header >> 1) & 0x03
+                        topic, offset = _string(data, 0)
+                        if qos:
+                            packet_id, offset = data[offset : offset + 2], offset + 2
+                            self.write((b"\x40\x02" if qos == 1 else b"\x50\x02") + packet_id)
+                        self.server.publish(
+                            topic.decode(), data[offset:], retain=bool(header & 0x01)
+                        )
+                    # PUBREL
+                    case 6:
+                        self.write(b"\x70\x02" + data[:2])
+                    # SUBSCRIBE, granted at QoS 0
+                    case 8:
+                        offset = 2
+                        topic_filters = []
+                        while offset < len(data):
+                            topic_filter, offset = _string(data, offset)
+                            topic_filters.append(topic_filter.decode())
+                            offset += 1
+                        self.write(
+                            b"\x90"
+                            + _remaining_length(2 + len(topic_filters))
+                            + data[:2]
+                            + bytes(len(topic_filters))
+                        )
+                        self.server.subscribe(self, topic_filters)
+                    # PINGREQ
+                    case 12:
+                        self.write(b"\xd0\x00")
+                    # DISCONNECT, the will is not sent
+                    case 14:
+                        disconnected = True
+                        break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.server.lock:
+                self.server.subscriptions.pop(self, None)
+            if will is not None and not disconnected:
+                self.server.publish(*will)
+
+
+# SIMULATED PREMISES
+
+
+def generate_patrol(shape: str, size: int, sentry_count: int, hours: int, seed: int):
+    """
+    generates a circuit on a synthetic premises (see benchmark.py), starting in a couple of minutes
+    returns the circuit (list of SentryRoute) and every check-in (time, card ID, checkpoint) in time order,
+    i.e. the scans the sentries patrolling it would make
+    """
+
+    path_objs = PREMISES[shape](size, random.Random(seed))
+    checkpoints = utils.generate_adjacency_graph(path_objs=path_objs)
+    sentries = [(f"Sentry {no}", f"Card {no}", f"{PREFIX}{no:05d}") for no in range(sentry_count)]
+    # the first check-ins are not yet overdue by the time the circuit reaches the circuit handler
+    start = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=2)
+
+    _, _, _, circuit = utils.generate_circuit(
+        sentries=sentries,
+        checkpoints=checkpoints,
+        start_date=start.date(),
+        start_time=start.time(),
+        shift_dur_hour=hours,
+        shift_dur_min=0,
+        time_budget=5,
+        seed=seed,
+    )
+
+    check_ins = sorted(
+        (time, route.id, checkpoint)
+        for route in circuit
+        for checkpoint, time in zip(route.checkpoints, route.times)
+    )
+    return circuit, check_ins
+
+
+def make_scan(check_in: tuple, rng: random.Random, jitter: int, errors: float):
+    """
+    returns the scan of a check-in (as published by its checkpoint), scanned 'jitter' seconds early/late at most,
+    and whether an error was injected into it, 'errors' of the time
+    """
+
+    expected_time, card, checkpoint = check_in
+    offset = rng.randint(-jitter, jitter) if jitter else 0
+    injected = bool(errors) and rng.random() < errors
+
+    if injected:
+        match rng.choice(FAULTS):
+            case "card not on duty":
+                card = f"{PREFIX}-unknown-{rng.randrange(10**6):06d}"
+            case "wrong checkpoint":
+                # no such checkpoint, while the card is expected elsewhere
+                checkpoint = -1
+            case "wrong time of scan":
+                offset += 24 * 60 * 60
+
+    # same form (and key order) as the checkpoints' scans
+    return {
+        "checkpoint": checkpoint,
+        "sentry-id": card,
+        "scan-time": expected_time + offset,
+    }, injected
+
+
+def expected_reason(index: CheckInIndex, cards: set, scan: dict) -> str:
+    """
+    the validation result the circuit handler should give the scan ("" if valid), found the same way
+    (see validate_scan in circuit_handler.py) against every check-in of the circuit
+    e.g. a scan jittered out of its own check-in's window may still be in that of another check-in
+    """
+
+    checkpoint, card, time = scan.values()
+    if card not in cards:
+        return "card not on duty"
+    if index.find(card, checkpoint, time, utils.CHECK_IN_WINDOW) is not None:
+        return ""
+    if index.expected(card, time, utils.CHECK_IN_WINDOW):
+        return "wrong checkpoint"
+    return "wrong time of scan"
+
+
+# MEASUREMENTS
+
+
+class Tracker:
+    """
+    matches the alerts and checkpoint responses received to the scans sent, and records their latencies
+    """
+
+    def __init__(self):
+        # alerts and responses arrive on the clients' network threads
+        self.lock = threading.Lock()
+        # scans awaiting their alert {(checkpoint, card, scan time): deque of (sent at, expected reason)}
+        self.awaiting_alert = {}
+        # scans alerted, awaiting their response at each checkpoint (in order) {checkpoint: deque of sent at}
+        self.awaiting_response = {}
+        self.alert_latencies = []
+        self.response_latencies = []
+        self.unexpected = 0
+        self.first_sent = None
+        self.last_received = None
+
+    def sent(self, scan: dict, reason: str):
+        with self.lock:
+            now = time.perf_counter()
+            self.first_sent = self.first_sent or now
+            self.awaiting_alert.setdefault(tuple(scan.values()), deque()).append((now, reason))
+
+    def alerted(self, alert: dict):
+        with self.lock:
+            now = time.perf_counter()
+            key = (alert["checkpoint"], alert["sentry-id"], alert["scan-time"])
+            if not self.awaiting_alert.get(key):
+                return
+
+            sent_at, reason = self.awaiting_alert[key].popleft()
+            self.alert_latencies.append(now - sent_at)
+            self.unexpected += alert["reason"] != reason
+            self.awaiting_response.setdefault(alert["checkpoint"], deque()).append(sent_at)
+            self.last_received = now
+
+    def responded(self, checkpoint: int):
+        with self.lock:
+            now = time.perf_counter()
+            if self.awaiting_response.get(checkpoint):
+                self.response_latencies.append(now - self.awaiting_response[checkpoint].popleft())
+                self.last_received = now
+
+    def pending(self) -> int:
+        with self.lock:
+            return sum(map(len, self.awaiting_alert.values())) + sum(
+                map(len, self.awaiting_response.values())
+            )
+
+
+def percentiles(latencies: list[float]) -> dict:
+    """
+    latency percentiles, in milliseconds
+    """
+
+    if not latencies:
+        return {}
+    if len(latencies) == 1:
+        latencies = latencies * 2
+
+    cuts = quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": 1000 * cuts[49],
+        "p90_ms": 1000 * cuts[89],
+        "p99_ms": 1000 * cuts[98],
+        "max_ms": 1000 * max(latencies),
+    }
+
+
+# CLIENTS
+
+
+def connect(client_id: str, host: str, port: int, will: tuple = None) -> mqtt.Client:
+    """
+    connects a client to the broker, its network loop running on a background thread
+    """
+
+    client = mqtt.Client(client_id=client_id, clean_session=True)
+    client.username_pw_set(username=circuit_handler.MQTT_UNAME, password=circuit_handler.MQTT_PASS)
+    if will is not None:
+        client.will_set(*will)
+    client.connect(host=host, port=port, keepalive=60)
+    client.loop_start()
+    return client
+
+
+def start_responder(host: str, port: int, shift: str) -> mqtt.Client:
+    """
+    stands in for the web app: responds to each alert at its checkpoint, with the web app's response codes
+    """
+
+    def on_message(client, userdata, message):
+        alert = json.loads(message.payload)
+        client.publish(
+            topic=CHECKPOINT_RESPONSE.format(alert["checkpoint"]),
+            payload=RESPONSE_CODES.get(alert["reason"], 2),
+            qos=2,
+        )
+
+    responder = connect(f"{PREFIX}-responder", host, port)
+    responder.on_message = on_message
+    responder.subscribe([(ALERTS, 2), (shift_topic(ALERTS, shift), 2)])
+    return responder
+
+
+def start_monitor(host: str, port: int, shift: str, tracker: Tracker):
+    """
+    listens for the alerts (as the web app does) and the checkpoints' responses, for the tracker
+    returns the client, and an event set once the circuit handler is connected
+    """
+
+    handler_connected = threading.Event()
+
+    def on_message(client, userdata, message):
+        if message.topic.endswith("/response"):
+            tracker.responded(int(message.topic.split("/")[-2]))
+        elif message.topic.endswith("/connected"):
+            handler_connected.set()
+        else:
+            tracker.alerted(json.loads(message.payload))
+
+    monitor = connect(f"{PREFIX}-monitor", host, port)
+    monitor.on_message = on_message
+    monitor.subscribe(
+        [
+            (ALERTS, 2),
+            (shift_topic(ALERTS, shift), 2),
+            (CHECKPOINT_RESPONSE.format("+"), 2),
+            (circuit_handler.CONNECTED, 2),
+        ]
+    )
+    return monitor, handler_connected
+
+
+def run_load(args, checkpoints: dict, check_ins: list, tracker: Tracker) -> dict:
+    """
+    publishes the scans, heartbeats and outside-of-shift scans at their rates for the test's duration
+    returns how many of each were published, and over how long
+    """
+
+    rng = random.Random(args.seed)
+    # seconds between two of each kind of message
+    intervals = {"scan": 1 / args.rate}
+    if args.heartbeat:
+        intervals["heartbeat"] = args.heartbeat / len(checkpoints)
+    if args.outside_rate:
+        intervals["outside"] = 1 / args.outside_rate
+
+    counts = dict.fromkeys(intervals, 0) | {"errors": 0}
+    checkpoint_ids = list(checkpoints)
+
+    # every check-in of the circuit, to tell the result each scan should get
+    index = CheckInIndex(
+        {"id": card, "checkpoint": checkpoint, "time": expected_time}
+        for expected_time, card, checkpoint in check_ins
+    )
+    cards = {card for _, card, _ in check_ins}
+
+    started = time.perf_counter()
+    events = [(started, kind) for kind in intervals]
+
+    while True:
+        due, kind = heappop(events)
+        if due - started >= args.duration:
+            break
+        if (delay := due - time.perf_counter()) > 0:
+            time.sleep(delay)
+
+        match kind:
+            case "scan":
+                # the sentries follow the circuit, over and over if the test outlasts it
+                check_in = check_ins[counts["scan"] % len(check_ins)]
+                scan, injected = make_scan(check_in, rng, args.jitter, args.errors)
+                counts["errors"] += injected
+                tracker.sent(scan, expected_reason(index, cards, scan))
+                checkpoints[check_in[2]].publish(
+                    topic=SENTRY_SCAN_INFO, payload=json.dumps(scan), qos=args.qos
+                )
+            case "heartbeat":
+                checkpoint = checkpoint_ids[counts["heartbeat"] % len(checkpoint_ids)]
+                checkpoints[checkpoint].publish(
+                    topic=CHECKPOINT_CONNECTED,
+                    payload=json.dumps({"id": f"Checkpoint-{checkpoint}", "connected": True}),
+                    qos=args.qos,
+                )
+            case "outside":
+                checkpoint = rng.choice(checkpoint_ids)
+                scan = {
+                    "checkpoint": checkpoint,
+                    "sentry-id": f"{PREFIX}-unknown-{rng.randrange(10**6):06d}",
+                    "scan-time": int(datetime.timestamp(datetime.now())),
+                }
+                checkpoints[checkpoint].publish(
+                    topic=OUTSIDE_SHIFT_SCAN, payload=json.dumps(scan), qos=args.qos
+                )
+
+        counts[kind] += 1
+        heappush(events, (due + intervals[kind], kind))
+
+    return counts | {"elapsed_s": time.perf_counter() - started}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-tests sentry scan validation.")
+    parser.add_argument(
+        "--broker", help="host[:port] of the broker to test against (default: in-process fake)"
+    )
+    parser.add_argument(
+        "--respond",
+        action="store_true",
+        help="stand in for the web app's checkpoint responses (always, with the fake broker)",
+    )
+    parser.add_argument("--shift", default=PREFIX, help="shift key to monitor the circuit under")
+    parser.add_argument("--shape", choices=PREMISES, default="grid")
+    parser.add_argument("--checkpoints", type=int, default=25, help="number of checkpoints (N)")
+    parser.add_argument("--sentries", type=int, default=10, help="number of sentries (M)")
+    parser.add_argument("--hours", type=int, default=8, help="length of the generated shift")
+    parser.add_argument("--rate", type=float, default=100, help="scans per second")
+    parser.add_argument(
+        "--heartbeat",
+        type=float,
+        default=10,
+        help="seconds between a checkpoint's heartbeats (0: none)",
+    )
+    parser.add_argument(
+        "--outside-rate", type=float, default=0, help="outside-of-shift scans per second"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="seconds to publish scans for")
+    parser.add_argument(
+        "--jitter", type=int, default=0, help="seconds a scan is early/late at most"
+    )
+    parser.add_argument("--errors", type=float, default=0, help="share of scans made invalid")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=2)
+    parser.add_argument("--drain", type=float, default=10, help="seconds to wait for late answers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the results to (JSON)")
+    args = parser.parse_args()
+
+    circuit, check_ins = generate_patrol(
+        args.shape, args.checkpoints, args.sentries, args.hours, args.seed
+    )
+    print(f"Circuit: {len(check_ins)} check-ins of {args.sentries} sentries")
+
+    if args.broker:
+        host, _, port = args.broker.partition(":")
+        port = int(port or 1883)
+    else:
+        # the circuit handler runs in-process, against the fake broker
+        host, port = "127.0.0.1", FakeBroker().start()
+        circuit_handler.MQTT_HOST = host
+        circuit_handler.MQTT_PORT = port
+        circuit_handler.mqtt_configs["HANDLER_STATE"] = ""
+        threading.Thread(target=circuit_handler.launch_circuit_handler, daemon=True).start()
+
+    tracker = Tracker()
+    monitor, handler_connected = start_monitor(host, port, args.shift, tracker)
+    responder = start_responder(host, port, args.shift) if args.respond or not args.broker else None
+
+    checkpoints = {
+        checkpoint: connect(
+            f"{PREFIX}-checkpoint-{checkpoint}",
+            host,
+            port,
+            will=(
+                CHECKPOINT_CONNECTED,
+                json.dumps({"id": f"Checkpoint-{checkpoint}", "connected": False}),
+            ),
+        )
+        for checkpoint in sorted({checkpoint for _, _, checkpoint in check_ins})
+    }
+
+    if not args.broker and not handler_connected.wait(timeout=10):
+        raise SystemExit("The circuit handler did not connect.")
+
+    # the circuit is monitored under its own shift key, so as not to replace the web app's
+    final, routes = circuits.circuit_window(circuit, since=0, until=check_ins[-1][0])
+    monitor.publish(topic=shift_topic(SHIFT_ON_OFF, args.shift), payload="ON", qos=2)
+    monitor.publish(
+        topic=shift_topic(MONITOR_SENTRY_CIRCUIT, args.shift),
+        payload=encode_message({"until": check_ins[-1][0], "final": final, "routes": routes}),
+        qos=2,
+    ).wait_for_publish()
+    time.sleep(1)
+
+    print(f"Publishing {args.rate:g} scans/s for {args.duration:g}s...")
+    counts = run_load(args, checkpoints, check_ins, tracker)
+
+    deadline = time.perf_counter() + args.drain
+    while tracker.pending() and time.perf_counter() < deadline:
+        time.sleep(0.05)
+
+    monitor.publish(topic=shift_topic(SHIFT_ON_OFF, args.shift), payload="OFF", qos=2)
+    for client in [*checkpoints.values(), monitor, responder]:
+        if client is not None:
+            client.disconnect()
+            client.loop_stop()
+
+    answered = (tracker.last_received or 0) - (tracker.first_sent or 0)
+    results = {
+        "scans": counts["scan"],
+        "errors_injected": counts["errors"],
+        "heartbeats": counts.get("heartbeat", 0),
+        "outside_shift_scans": counts.get("outside", 0),
+        "alerts": len(tracker.alert_latencies),
+        "responses": len(tracker.response_latencies),
+        "unanswered": counts["scan"] - len(tracker.alert_latencies),
+        # alerts whose validation result is not the one expected of the scan
+        "unexpected": tracker.unexpected,
+        "sent_per_s": counts["scan"] / counts["elapsed_s"],
+        "alerts_per_s": len(tracker.alert_latencies) / answered if answered > 0 else 0,
+        "alert_latency": percentiles(tracker.alert_latencies),
+        "response_latency": percentiles(tracker.response_latencies),
+    }
+
+    print(
+        f"\n{results['scans']} scans ({results['sent_per_s']:.1f}/s), {results['alerts']} alerts "
+        f"({results['alerts_per_s']:.1f}/s), {results['responses']} responses, "
+        f"{results['unanswered']} unanswered, {results['unexpected']} unexpected"
+    )
+    print(f"{'latency':<12}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage in ("alert", "response"):
+        if latencies := results[f"{stage}_latency"]:
+            print(
+                f"{stage:<12}"
+                + "".join(
+                    f"{latencies[cut]:>8.1f}ms" for cut in ("p50_ms", "p90_ms", "p99_ms", "max_ms")
+                )
+            )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {"environment": environment(), "config": vars(args), "results": results},
+                output,
+                indent=2,
+            )
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
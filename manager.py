@@ -1,8 +1,11 @@
 #!/usr/bin/python3
 from sys import argv
+from datetime import datetime
 from app import app, db
-from app.models import Supervisor, Checkpoint
+from app.models import Card, PatrolPath, Sentry, Shift, Supervisor, Checkpoint
 from app import bcrypt
+import app.jobs as jobs
+import appcore.utils as utils
 
 
 class Manager:
@@ -61,6 +64,58 @@ class Manager:
                             checks[i].append_path_out((checks[i + GRID_WIDTH].name, 70))
                 db.session.commit()
 
+    def schedule_shifts(from_date, to_date, start_times, hours, minutes="0", weekdays="0123456"):
+        """
+        Generates the circuits of every shift in a date range following a shift pattern
+        (in parallel) and saves them in a single transaction. All registered sentries,
+        paired with the cards in order, and all patrol paths are used.
+        e.g. schedule_shifts 2024-01-01 2024-01-31 06:00,18:00 12 0 01234
+        (days of the week: Monday = 0)
+        """
+        with app.app_context():
+            sentries = Sentry.query.all()
+            cards = Card.query.all()
+            assignments = [
+                (sentry.full_name, card.alias, card.rfid_id)
+                for sentry, card in zip(sentries, cards)
+            ]
+            path_dict = utils.generate_adjacency_graph(path_objs=PatrolPath.query.all())
+
+            if not assignments or not path_dict:
+                print("Register sentries, cards and patrol paths first")
+                return
+
+            # the paths may form several sub-circuits, each needs at least one sentry
+            circuit_count, _ = utils.validate_paths(path_dict=path_dict)
+            if circuit_count > len(assignments):
+                print(f"The paths form {circuit_count} sub-circuits, assign a sentry to each")
+                return
+
+            shift_infos = utils.plan_shift_schedule(
+                sentries=assignments,
+                checkpoints=path_dict,
+                start_date=datetime.strptime(from_date, "%Y-%m-%d").date(),
+                end_date=datetime.strptime(to_date, "%Y-%m-%d").date(),
+                start_times=[
+                    datetime.strptime(start, "%H:%M").time() for start in start_times.split(",")
+                ],
+                weekdays=[int(day) for day in weekdays],
+                shift_dur_hour=int(hours),
+                shift_dur_min=int(minutes),
+                taken={start for start, in db.session.query(Shift.shift_start)},
+            )
+
+        if not shift_infos:
+            print("No new shifts to schedule")
+            return
+
+        print(f"Generating circuits for {len(shift_infos)} shifts")
+        results = jobs.generate_shifts(shift_infos)
+        shift_ids, message = jobs.save_shifts(assignments, results)
+        print(f"Saved {len(shift_ids)} shifts")
+        if message:
+            print(message)
+
     def recreate_db():
         """
         Recreates a local database. You probably should not use this on
@@ -82,9 +137,8 @@ def manager():
             sep="\n",
         )
     else:
-        if argc > 2:
-            print("Only one command at a time (Running the first)")
-        eval(f"Manager.{argv[1]}()")
+        # any further arguments are passed on to the command
+        getattr(Manager, argv[1])(*argv[2:])
 
 
 if __name__ == "__main__":
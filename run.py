@@ -1,7 +1,14 @@
+# from Flask-MQTT docs example
+# patched before anything else is imported, so the web app and the circuit handler both run on green threads
+import eventlet
+
+eventlet.monkey_patch()
+
 import threading
 
+from app import app, mqtt, socketio
+from app.routes import ALERT_DISPATCHER
 import circuit_handler
-from app import app, socketio
 
 if __name__ == "__main__":
     # the circuit handler client needs to be launched as soon as the web app is launched
@@ -20,6 +27,10 @@ if __name__ == "__main__":
     mqtt_client = threading.Thread(target=circuit_handler.launch_circuit_handler, daemon=True)
     mqtt_client.start()
 
+    # connecting the web app to the broker, and sending the alerts it queues to the browsers
+    mqtt.init_app(app)
+    socketio.start_background_task(ALERT_DISPATCHER.run)
+
     # launching the web app
     # use of socketio (Flask-SocketIO) was recommended in Flask-MQTT's documentation (example)
     # should be run with debug = False
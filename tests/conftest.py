@@ -0,0 +1,14 @@
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the tests import the repository's modules (appcore, handler_store, ...) from its root
+sys.path.insert(0, ROOT)
+
+# the web app's tests write to a copy of its database, not to the one in the repository
+DATABASE = os.path.join(tempfile.mkdtemp(), "platform.db")
+shutil.copy(os.path.join(ROOT, "instance", "platform.db"), DATABASE)
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DATABASE}"
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from appcore.alerts import AlertDispatcher, alert
+
+
+class Browsers:
+    """
+    stands in for socketio.emit, keeping the events sent to each room
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event, data, to=None):
+        self.events.append((event, to, data))
+
+
+def test_alerts_are_sent_per_room_in_order():
+    browsers = Browsers()
+    dispatcher = AlertDispatcher(browsers, window=1)
+    for number in range(3):
+        dispatcher.push("site", alert("danger", "INVALID CHECK-IN", card=f"a{number}"))
+    dispatcher.push("shift-1", alert("success", "SUCCESSFUL CHECK-IN"))
+
+    # nothing is sent until the window is over
+    assert browsers.events == []
+    dispatcher.flush()
+
+    assert [(event, room, len(alerts)) for event, room, alerts in browsers.events] == [
+        ("alerts", "site", 3),
+        ("alerts", "shift-1", 1),
+    ]
+    assert [alert["card"] for alert in browsers.events[0][2]] == ["a0", "a1", "a2"]
+
+    # the queue is emptied by the flush
+    dispatcher.flush()
+    assert len(browsers.events) == 2
+
+
+def test_alerts_are_sent_at_once_without_a_window():
+    browsers = Browsers()
+    dispatcher = AlertDispatcher(browsers, window=0)
+    dispatcher.push("site", alert("info", "SHIFT STARTED"))
+
+    assert browsers.events == [("alerts", "site", [alert("info", "SHIFT STARTED")])]
+
+
+def test_full_queue_merges_alerts_of_the_same_kind():
+    browsers = Browsers()
+    overflows = []
+    dispatcher = AlertDispatcher(browsers, window=1, capacity=2, on_overflow=overflows.append)
+    dispatcher.push("site", alert("warning", "OVERDUE CHECK-IN", card="a0"))
+    dispatcher.push("site", alert("danger", "INVALID CHECK-IN", card="a1"))
+    for number in range(2, 5):
+        dispatcher.push("site", alert("warning", "OVERDUE CHECK-IN", card=f"a{number}"))
+    # nothing of its kind to merge into
+    dispatcher.push("site", alert("success", "SUCCESSFUL CHECK-IN"))
+    dispatcher.flush()
+
+    ((_, _, alerts),) = browsers.events
+    assert [(alert["tag"], alert["count"], alert["card"]) for alert in alerts] == [
+        ("OVERDUE CHECK-IN", 4, "a4"),
+        ("INVALID CHECK-IN", 1, "a1"),
+    ]
+    assert overflows == ["merged"] * 3 + ["dropped"]
+
+
+def test_full_queue_drops_the_least_severe_alerts():
+    browsers = Browsers()
+    dispatcher = AlertDispatcher(browsers, window=1, capacity=2, policy="drop")
+    dispatcher.push("site", alert("success", "SUCCESSFUL CHECK-IN"))
+    dispatcher.push("site", alert("warning", "OVERDUE CHECK-IN"))
+    # more severe than the queued success, which makes room for it
+    dispatcher.push("shift-1", alert("danger", "INVALID CHECK-IN"))
+    # no more severe than any queued alert, dropped itself
+    dispatcher.push("site", alert("warning", "OVERDUE CHECK-IN"))
+    dispatcher.flush()
+
+    assert [(room, [alert["tag"] for alert in alerts]) for _, room, alerts in browsers.events] == [
+        ("site", ["OVERDUE CHECK-IN"]),
+        ("shift-1", ["INVALID CHECK-IN"]),
+    ]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        AlertDispatcher(Browsers(), policy="block")
+
+
+def test_run_sends_a_window_at_a_time():
+    browsers = Browsers()
+    sent = threading.Event()
+    dispatcher = AlertDispatcher(
+        lambda *args, **kwargs: (browsers(*args, **kwargs), sent.set()), window=0.05
+    )
+    threading.Thread(target=dispatcher.run, daemon=True).start()
+
+    for number in range(10):
+        dispatcher.push("site", alert("warning", "OVERDUE CHECK-IN", card=f"a{number}"))
+
+    assert sent.wait(5)
+    ((_, _, alerts),) = browsers.events
+    assert len(alerts) == 10
@@ -0,0 +1,49 @@
+import pytest
+
+import app.routes as routes
+from app import app
+from app.models import Card
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+    monkeypatch.setitem(app.config, "LOGIN_DISABLED", True)
+    with app.test_client() as client:
+        yield client
+
+
+def card_id(rfid_id: str) -> int:
+    with app.app_context():
+        return Card.query.filter_by(rfid_id=rfid_id).one().id
+
+
+def test_registered_cards_follow_the_database(client):
+    registered = set(routes.REGISTERED_CARDS)
+
+    # registered in lowercase, whatever the case it is typed in
+    response = client.post("/cards/register", data={"rfid_id": "AB12CD34EF5", "alias": "test card"})
+    assert response.status_code == 302
+    assert routes.REGISTERED_CARDS == registered | {"ab12cd34ef5"}
+    # a scan of it outside a shift is of a stolen card, not an unknown one
+    assert (
+        routes.invalid_scan_tag("card not on duty", "ab12cd34ef5", routes.REGISTERED_CARDS)
+        == "STOLEN CARD"
+    )
+
+    # its ID corrected, also in lowercase
+    number = card_id("ab12cd34ef5")
+    response = client.post(
+        f"/cards/view/{number}/update", data={"rfid_id": "FF12CD34EF6", "alias": "test card"}
+    )
+    assert response.status_code == 302
+    assert routes.REGISTERED_CARDS == registered | {"ff12cd34ef6"}
+    assert card_id("ff12cd34ef6") == number
+
+    response = client.post(f"/cards/view/{number}/delete")
+    assert response.status_code == 302
+    assert routes.REGISTERED_CARDS == registered
+    assert (
+        routes.invalid_scan_tag("card not on duty", "ff12cd34ef6", routes.REGISTERED_CARDS)
+        == "UNKNOWN CARD"
+    )
@@ -0,0 +1,399 @@
+import asyncio
+import json
+import random
+from collections import deque
+from datetime import datetime
+from operator import itemgetter
+from types import SimpleNamespace
+
+import pytest
+
+import circuit_handler
+from appcore.circuits import CheckInIndex, SentryRoute
+from appcore.mqtts import (
+    CHKS_OVERDUE,
+    CIRCUIT_RESEND,
+    MONITOR_CIRCUIT_UPDATE,
+    MONITOR_CIRCUIT_WINDOW,
+    MONITOR_SENTRY_CIRCUIT,
+    SHIFT_ON_OFF,
+    shift_topic,
+)
+from appcore.wire import encode_message
+from handler_store import HandlerStore
+
+
+class Client:
+    """
+    stands in for the handler's MQTT client, keeping what it publishes
+    """
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+
+
+def message(topic, payload, retain=False):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return SimpleNamespace(topic=topic, payload=payload, retain=retain)
+
+
+def window(routes, until, final=False):
+    return encode_message({"until": until, "final": final, "routes": routes})
+
+
+@pytest.fixture
+def handler(monkeypatch, tmp_path):
+    """
+    a fresh handler (not sharded) keeping its state in a temporary store
+    """
+
+    monkeypatch.setattr(circuit_handler, "SHARD_ID", None)
+    monkeypatch.setattr(circuit_handler, "SHIFTS", {})
+    monkeypatch.setattr(circuit_handler, "CARD_SHIFTS", {})
+    monkeypatch.setattr(circuit_handler, "DEADLINES", [])
+    monkeypatch.setattr(circuit_handler, "STORE", HandlerStore(str(tmp_path / "handler.db")))
+    return circuit_handler
+
+
+def restart(handler, monkeypatch):
+    """
+    drops the handler's state in memory, then restores it from its store as if it restarted
+    """
+
+    monkeypatch.setattr(handler, "SHIFTS", {})
+    monkeypatch.setattr(handler, "CARD_SHIFTS", {})
+    monkeypatch.setattr(handler, "DEADLINES", [])
+    handler.restore_shifts()
+
+
+def test_restored_shift_requests_the_windows_it_missed(handler, monkeypatch):
+    now = int(datetime.timestamp(datetime.now()))
+    route = SentryRoute(None, None, "a1")
+    for offset, checkpoint in enumerate(range(1, 7)):
+        route.append(checkpoint, now + 600 * (offset + 1))
+
+    client = Client()
+    handler.on_mqtt_message(client, None, message(SHIFT_ON_OFF, "ON"))
+    first = [route.to_dict(stop=route.split(now + 1200))]
+    handler.on_mqtt_message(
+        client, None, message(MONITOR_SENTRY_CIRCUIT, window(first, now + 1200))
+    )
+    assert len(handler.SHIFTS[""].queue) == 2
+
+    # restarted mid-shift, the circuit is restored up to the end of the first window
+    restart(handler, monkeypatch)
+    assert handler.SHIFTS[""].until == now + 1200
+
+    # the retained shift status then asks for the windows sent after it, not the whole circuit
+    client = Client()
+    handler.on_mqtt_message(client, None, message(SHIFT_ON_OFF, "ON", retain=True))
+    assert client.published == [(CIRCUIT_RESEND, json.dumps({"since": now + 1200}))]
+
+    # a window received in the meantime, then the ones requested (overlapping it)
+    second = [route.to_dict(start=route.split(now + 1200), stop=route.split(now + 2400))]
+    handler.on_mqtt_message(
+        client, None, message(MONITOR_CIRCUIT_WINDOW, window(second, now + 2400))
+    )
+    missed = [route.to_dict(start=route.split(now + 1200), stop=route.split(now + 3000))]
+    handler.on_mqtt_message(
+        client, None, message(MONITOR_CIRCUIT_WINDOW, window(missed, now + 3000))
+    )
+
+    queue = handler.SHIFTS[""].queue
+    assert [check_in["time"] for check_in in queue] == list(route.times[:5])
+    assert handler.SHIFTS[""].until == now + 3000
+
+
+def test_shift_without_circuit_requests_all_of_it(handler):
+    client = Client()
+    handler.on_mqtt_message(client, None, message(SHIFT_ON_OFF, "ON", retain=True))
+    assert client.published == [(CIRCUIT_RESEND, None)]
+
+
+def test_shard_learns_of_the_other_shards_before_the_shifts(handler, monkeypatch):
+    monkeypatch.setattr(handler, "SHARD_ID", "a")
+    monkeypatch.setattr(handler, "SHARDS", set())
+    monkeypatch.setattr(handler, "PRESENCE_SETTLE", 0.05)
+
+    # shift keys owned by the other shard, once it is known
+    keys = [key for key in map(str, range(20)) if handler.shard_owner(key, {"a", "b"}) == "b"]
+
+    client = Client()
+    client.subscribed = []
+    client.subscribe = lambda topic, qos=0: client.subscribed.append(topic)
+    client.is_connected = lambda: True
+
+    async def connect():
+        handler.on_mqtt_connect(client, None, None, 0)
+        # only the shards' connected messages until the presence settles
+        assert client.subscribed == [handler.SHARDS_CONNECTED]
+
+        # the other shard's retained connected message, then the retained shift statuses
+        connected = json.dumps({"id": f"{handler.CLIENT_ID_PREFIX}-b", "connected": True})
+        handler.on_mqtt_message(client, None, message("sentry-platform/x/connected", connected))
+        await asyncio.sleep(0.1)
+        assert len(client.subscribed) == 2
+
+        for key in keys:
+            handler.on_mqtt_message(client, None, message(f"{SHIFT_ON_OFF}/{key}", "ON", True))
+
+    asyncio.run(connect())
+    # none of them is requested (their owner has them)
+    assert keys
+    assert not [topic for topic, _ in client.published if topic.startswith(CIRCUIT_RESEND)]
+
+
+def test_shifts_spread_over_the_shards():
+    shards = {"a", "b", "c", "d"}
+    owners = [circuit_handler.shard_owner(str(key), shards) for key in range(400)]
+
+    # about a quarter each
+    assert {shard: 60 <= owners.count(shard) <= 140 for shard in shards} == dict.fromkeys(
+        shards, True
+    )
+
+
+def test_rebalance_moves_only_the_gained_and_lost_shifts(handler, monkeypatch):
+    monkeypatch.setattr(handler, "SHARD_ID", "a")
+    monkeypatch.setattr(handler, "SHARDS", {"b"})
+    keys = [str(key) for key in range(60)]
+
+    # ongoing shifts, with the check-ins of the ones this shard owns
+    for key in keys:
+        shift = handler.SHIFTS[key] = handler.MonitoredShift()
+        shift.status = True
+        if handler.owns(key):
+            shift.queue = []
+    owned = {key for key in keys if handler.owns(key)}
+
+    # another shard joins, and takes some of this shard's shifts
+    client = Client()
+    handler.SHARDS.add("c")
+    handler.rebalance(client)
+
+    lost = {key for key in owned if handler.shard_owner(key, {"a", "b", "c"}) == "c"}
+    assert lost and client.published == []
+    assert {key for key in keys if handler.SHIFTS[key].queue is not None} == owned - lost
+
+    # another shard leaves, this shard takes some of its shifts, and asks for their circuits
+    handler.SHARDS.discard("b")
+    handler.rebalance(client)
+
+    gained = {
+        key for key in keys if key not in owned and handler.shard_owner(key, {"a", "c"}) == "a"
+    }
+    assert gained
+    assert sorted(topic for topic, _ in client.published) == sorted(
+        f"{CIRCUIT_RESEND}/{key}" for key in gained
+    )
+    # the shifts kept are neither dropped nor requested again
+    assert all(handler.SHIFTS[key].queue is not None for key in owned - lost)
+
+
+def monitor(handler, monkeypatch, routes: list[SentryRoute], key: str = "") -> None:
+    """
+    starts monitoring a shift whose circuit is 'routes', with none of its check-ins expired yet
+    """
+
+    monkeypatch.setattr(handler, "SHIFTS", {})
+    monkeypatch.setattr(handler, "CARD_SHIFTS", {})
+    monkeypatch.setattr(handler, "DEADLINES", [])
+    shift = handler.SHIFTS[key] = handler.MonitoredShift()
+    shift.status = True
+    shift.final_window = True
+    handler.set_cards(key, {route.id for route in routes})
+    queue = sorted(
+        (check_in for route in routes for check_in in route.check_ins()),
+        key=lambda check_in: check_in["time"],
+    )
+    shift.index = CheckInIndex(queue)
+    shift.queue = deque(queue)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_and_single_validation_agree(handler, monkeypatch, seed):
+    monkeypatch.setattr(handler, "STORE", None)
+    rng = random.Random(seed)
+    start = 1_700_000_000
+    routes = []
+    for number in range(3):
+        route = SentryRoute(None, None, f"a{number}")
+        for offset in range(30):
+            route.append(rng.randrange(1, 6), start + 120 * offset + rng.randrange(60))
+        routes.append(route)
+
+    # scans around the expected check-ins (some late, or at the wrong checkpoint) and at random times,
+    # in no particular order, as buffered by a disconnected checkpoint
+    scans = []
+    for route in routes:
+        for checkpoint, time in zip(route.checkpoints, route.times):
+            if rng.random() < 0.7:
+                scans.append(
+                    {
+                        "chk": checkpoint if rng.random() < 0.8 else rng.randrange(1, 6),
+                        "id": route.id,
+                        "time": time + rng.randrange(-45, 46),
+                    }
+                )
+    scans += [
+        {
+            "chk": rng.randrange(1, 6),
+            "id": f"a{rng.randrange(3)}",
+            "time": rng.randrange(start, start + 3600),
+        }
+        for _ in range(20)
+    ]
+    # a card not on duty
+    scans.append({"chk": 1, "id": "b1", "time": start + 600})
+    # each sentry's first check-in, scanned on time, but only received once its window has elapsed
+    scans += [
+        {"chk": route.checkpoints[0], "id": route.id, "time": route.times[0]} for route in routes
+    ]
+    rng.shuffle(scans)
+    # the scans arrive once the first check-ins' windows have elapsed
+    arrival = start + 1200
+    later = start + 2400
+
+    def validate(batch: bool):
+        monitor(handler, monkeypatch, [SentryRoute.from_dict(route.to_dict()) for route in routes])
+        shift = handler.SHIFTS[""]
+        alerts = handler.expire_checkins("", shift, arrival)
+        if batch:
+            results = handler.validate_scans(scans)[""]
+        else:
+            results = [handler.validate_scan(scan)[1] for scan in scans]
+        alerts += handler.expire_checkins("", shift, later)
+        checked = [
+            (check_in["id"], check_in["time"], check_in["checked"]) for check_in in shift.queue
+        ]
+        return sorted(results, key=itemgetter("time", "id", "chk", "reason")), checked, alerts
+
+    single = validate(batch=False)
+    batch = validate(batch=True)
+
+    assert batch == single
+    results, checked, alerts = batch
+    # every kind of result
+    assert {result["reason"] for result in results} == {
+        "",
+        "card not on duty",
+        "wrong checkpoint",
+        "wrong time of scan",
+    }
+    assert any(flag for *_, flag in checked)
+    # the scans of check-ins already expired (and alerted) are not valid any more
+    for route in routes:
+        (stale,) = [
+            result
+            for result in results
+            if (result["id"], result["chk"], result["time"])
+            == (route.id, route.checkpoints[0], route.times[0])
+        ]
+        assert stale["reason"] == "wrong time of scan"
+        assert (shift_topic(CHKS_OVERDUE, ""), json.dumps(route.check_ins()[0])) in alerts
+
+
+def run_analyser(handler, start: int, end: int, events: dict = None) -> list[tuple]:
+    """
+    the analyser's work from 'start' to 'end' (epoch) on a clock ticking once a second, returns what it
+    publishes as (time, topic, payload). 'events' {time: callable} happen at their time, before it runs
+    """
+
+    published = []
+    for time_now in range(start, end):
+        if events and time_now in events:
+            events[time_now]()
+        for key, shift in handler.pop_due(time_now):
+            published += [
+                (time_now, topic, payload)
+                for topic, payload in handler.expire_checkins(key, shift, time_now)
+            ]
+    return published
+
+
+def overdue(published: list[tuple]) -> list[tuple]:
+    return [
+        (time_now, json.loads(payload)["id"], json.loads(payload)["time"])
+        for time_now, topic, payload in published
+        if topic == CHKS_OVERDUE
+    ]
+
+
+def test_overdue_check_ins_are_alerted_once_at_their_deadline(handler, monkeypatch):
+    start = 1_700_000_000
+    routes = [SentryRoute(None, None, "a0"), SentryRoute(None, None, "a1")]
+    for offset in (100, 200, 300, 400):
+        routes[0].append(offset // 100, start + offset)
+        routes[1].append(offset // 100 + 4, start + offset + 50)
+    monitor(handler, monkeypatch, routes)
+    handler.schedule_shift("", handler.SHIFTS[""])
+
+    # a0 checks in at its second checkpoint, a bit late
+    def scan():
+        key, result = handler.validate_scan({"chk": 2, "id": "a0", "time": start + 215})
+        assert result["valid"]
+
+    published = run_analyser(handler, start, start + 600, {start + 215: scan})
+
+    window = handler.CHECK_IN_WINDOW
+    expected = sorted(
+        (time + window + 1, route.id, time)
+        for route in routes
+        for time in route.times
+        if time != start + 200
+    )
+    assert overdue(published) == expected
+    # the circuit is done once its last check-in's window elapses, and only then
+    assert published[-1] == (start + 450 + window + 1, handler.DONE, None)
+    assert not handler.DEADLINES
+
+
+def test_replanned_check_ins_are_not_alerted(handler, monkeypatch):
+    start = 1_700_000_000
+    routes = [SentryRoute(None, None, "a0"), SentryRoute(None, None, "a1")]
+    for offset in (100, 200, 300, 400):
+        routes[0].append(offset // 100, start + offset)
+        routes[1].append(offset // 100 + 4, start + offset - 50)
+    monitor(handler, monkeypatch, routes)
+    handler.schedule_shift("", handler.SHIFTS[""])
+
+    # a0's route is re-planned (its next check-in due sooner than the one it replaces),
+    # and a1 goes off duty
+    tail = SentryRoute(None, None, "a0")
+    tail.append(9, start + 290)
+    tail.append(8, start + 500)
+    update = {
+        "from": start + 282,
+        "routes": [
+            tail.to_dict() | {"on_duty": True},
+            SentryRoute(None, None, "a1").to_dict() | {"on_duty": False},
+        ],
+    }
+
+    def replan():
+        handler.on_mqtt_message(
+            Client(), None, message(MONITOR_CIRCUIT_UPDATE, encode_message(update))
+        )
+
+    published = run_analyser(handler, start, start + 600, {start + 282: replan})
+
+    window = handler.CHECK_IN_WINDOW
+    # the re-planned check-ins after 'from' are dropped, the new ones are alerted in their place,
+    # and the entry left behind for the check-in at +300 is skipped
+    assert overdue(published) == [
+        (start + offset + window + 1, card, start + offset)
+        for offset, card in [
+            (50, "a1"),
+            (100, "a0"),
+            (150, "a1"),
+            (200, "a0"),
+            (250, "a1"),
+            (290, "a0"),
+            (500, "a0"),
+        ]
+    ]
+    assert published[-1] == (start + 500 + window + 1, handler.DONE, None)
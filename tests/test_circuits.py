@@ -0,0 +1,225 @@
+import random
+
+import pytest
+
+from appcore.circuits import CheckInIndex, CircuitIndex, SentryRoute, dump_circuit, load_circuit
+
+
+def random_route(rng: random.Random, id: str, length: int) -> SentryRoute:
+    """
+    a route of 'length' check-ins over a few checkpoints, some of them checked
+    """
+
+    route = SentryRoute(f"sentry {id}", f"card {id}", id)
+    time = 1_700_000_000 + rng.randrange(600)
+    for _ in range(length):
+        route.append(rng.randrange(1, 6), time)
+        time += rng.choice((0, 60, 90, 300))
+    for index in range(length):
+        if rng.random() < 0.3:
+            route.check(index)
+    return route
+
+
+def as_tuples(route: SentryRoute) -> list[tuple]:
+    return [tuple(check_in) for check_in in route.route]
+
+
+@pytest.mark.parametrize("length", [0, 1, 7, 8, 9, 50])
+def test_route_round_trip(length):
+    route = random_route(random.Random(length), "a1", length)
+    restored = SentryRoute.from_dict(route.to_dict())
+
+    assert (restored.name, restored.card, restored.id) == (route.name, route.card, route.id)
+    assert as_tuples(restored) == as_tuples(route)
+
+
+@pytest.mark.parametrize("start, stop", [(0, 20), (3, 20), (8, 16), (5, 13), (19, 20), (7, 7)])
+def test_route_slice_round_trip(start, stop):
+    route = random_route(random.Random(start * 100 + stop), "a1", 20)
+    restored = SentryRoute.from_dict(route.to_dict(start=start, stop=stop))
+
+    assert as_tuples(restored) == as_tuples(route)[start:stop]
+
+
+def test_legacy_route_dict():
+    legacy = {
+        "name": "sentry",
+        "card": "card",
+        "id": "a1",
+        "route": [
+            {"id": "a1", "checkpoint": 1, "time": 100, "checked": False},
+            {"id": "a1", "checkpoint": 2, "time": 160, "checked": True},
+        ],
+    }
+    route = SentryRoute.from_dict(legacy)
+
+    assert route.check_ins() == legacy["route"]
+
+
+def test_truncate_clears_the_dropped_checked_bits():
+    route = random_route(random.Random(1), "a1", 20)
+    for index in range(20):
+        route.check(index)
+    route.truncate(11)
+    route.append(1, route.times[-1] + 60)
+
+    assert len(route) == 12
+    assert not route.is_checked(11)
+    assert all(route.is_checked(index) for index in range(11))
+
+
+def test_circuit_round_trip():
+    rng = random.Random(7)
+    circuit = [random_route(rng, f"a{number}", rng.randrange(30)) for number in range(5)]
+    restored = load_circuit(dump_circuit(circuit))
+
+    assert [as_tuples(route) for route in restored] == [as_tuples(route) for route in circuit]
+
+
+def test_load_legacy_circuit():
+    # circuits saved before the compact form are stringified python lists of dicts
+    legacy = [
+        {
+            "name": "sentry",
+            "card": "card",
+            "id": "a1",
+            "route": [{"id": "a1", "checkpoint": 1, "time": 100, "checked": True}],
+        }
+    ]
+    (route,) = load_circuit(str(legacy))
+
+    assert route.check_ins() == legacy[0]["route"]
+    assert load_circuit(dump_circuit(legacy))[0].check_ins() == legacy[0]["route"]
+
+
+def random_queue(rng: random.Random) -> list[dict]:
+    """
+    the circuit handler's queue of a few routes' check-ins, sorted by time
+    """
+
+    routes = [random_route(rng, f"a{number}", 40) for number in range(4)]
+    queue = [check_in for route in routes for check_in in route.check_ins()]
+    return sorted(queue, key=lambda check_in: check_in["time"])
+
+
+def soonest(queue: list[dict], card: str, checkpoint=None, time=0, window=0):
+    """
+    the reference the index is checked against: a walk over the whole queue
+    """
+
+    matches = [
+        check_in
+        for check_in in queue
+        if check_in["id"] == card
+        and checkpoint in (None, check_in["checkpoint"])
+        and abs(check_in["time"] - time) <= window
+    ]
+    return min(matches, key=lambda check_in: check_in["time"], default=None)
+
+
+def scans(rng: random.Random, queue: list[dict], count: int):
+    start, end = queue[0]["time"] - 600, queue[-1]["time"] + 600
+    for _ in range(count):
+        yield f"a{rng.randrange(5)}", rng.randrange(1, 7), rng.randrange(start, end)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("window", [0, 60, 300])
+def test_check_in_index_matches_a_walk_over_the_queue(seed, window):
+    rng = random.Random(seed)
+    queue = random_queue(rng)
+    index = CheckInIndex(queue)
+
+    for card, checkpoint, time in scans(rng, queue, 300):
+        assert index.find(card, checkpoint, time, window) is soonest(
+            queue, card, checkpoint, time, window
+        )
+        assert index.expected(card, time, window) == (
+            soonest(queue, card, time=time, window=window) is not None
+        )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_check_in_index_find_all(seed):
+    rng = random.Random(seed)
+    queue = random_queue(rng)
+    index = CheckInIndex(queue)
+
+    for card, checkpoint, _ in scans(rng, queue, 20):
+        times = sorted(time for *_, time in scans(rng, queue, 30))
+        assert index.find_all(card, checkpoint, times, 90) == [
+            index.find(card, checkpoint, time, 90) for time in times
+        ]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_check_in_index_add_and_remove(seed):
+    rng = random.Random(seed)
+    queue = random_queue(rng)
+    # built up one check-in at a time, in no particular order
+    index = CheckInIndex()
+    for check_in in rng.sample(queue, len(queue)):
+        index.add(check_in)
+
+    # check-ins popped off the front of the queue, as their windows elapse
+    for _ in range(len(queue) // 2):
+        index.remove(queue.pop(0))
+
+    for card, checkpoint, time in scans(rng, queue, 300):
+        found = index.find(card, checkpoint, time, 60)
+        expected = soonest(queue, card, checkpoint, time, 60)
+        # check-ins expected at the same time may be indexed in another order than the queue's
+        assert (found and (found["time"], found["id"], found["checkpoint"])) == (
+            expected and (expected["time"], expected["id"], expected["checkpoint"])
+        )
+        assert found is None or any(found is check_in for check_in in queue)
+
+
+def find_in_circuit(circuit: list[SentryRoute], card: str, checkpoint: int, time: int, window: int):
+    """
+    the reference the circuit's index is checked against: a walk over every route
+    """
+
+    for route in circuit:
+        if route.id != card:
+            continue
+        for index, (expected, expected_time) in enumerate(zip(route.checkpoints, route.times)):
+            if expected == checkpoint and abs(expected_time - time) <= window:
+                return route, index
+    return None
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("window", [0, 60, 300])
+def test_circuit_index_matches_a_walk_over_the_routes(seed, window):
+    rng = random.Random(seed)
+    circuit = [random_route(rng, f"a{number}", 40) for number in range(4)]
+    queue = [check_in for route in circuit for check_in in route.check_ins()]
+    index = CircuitIndex(circuit)
+
+    for card, checkpoint, time in scans(
+        rng, sorted(queue, key=lambda check_in: check_in["time"]), 300
+    ):
+        assert index.find(card, checkpoint, time, window) == find_in_circuit(
+            circuit, card, checkpoint, time, window
+        )
+
+
+def test_circuit_index_reindex():
+    rng = random.Random(3)
+    circuit = [random_route(rng, f"a{number}", 40) for number in range(2)]
+    index = CircuitIndex(circuit)
+
+    # a route's tail re-planned, as by replan_circuit
+    route = circuit[0]
+    route.truncate(20)
+    for _ in range(20):
+        route.append(rng.randrange(1, 6), route.times[-1] + 60)
+    index.reindex(route)
+
+    queue = sorted(route.check_ins(), key=lambda check_in: check_in["time"])
+    for _, checkpoint, time in scans(rng, queue, 300):
+        assert index.find("a0", checkpoint, time, 60) == find_in_circuit(
+            circuit, "a0", checkpoint, time, 60
+        )
@@ -0,0 +1,131 @@
+import threading
+from datetime import date, datetime, time
+from types import SimpleNamespace
+
+import pytest
+
+from appcore import utils
+
+# a small, dense premises: 4 checkpoints with 3, 1, 2 and 2 paths out, every path 10 seconds long
+DENSE = [(1, 2, 10), (1, 3, 10), (1, 4, 10), (3, 4, 10)]
+# two disconnected sub-circuits
+SPLIT = [(1, 2, 60), (2, 3, 90), (3, 1, 120), (4, 5, 60), (5, 6, 60)]
+
+SENTRIES = [(f"sentry {n}", f"alias {n}", f"{n:02x} 00 00 00") for n in range(30)]
+
+
+def adjacency(paths):
+    return utils.generate_adjacency_graph(
+        [SimpleNamespace(chkpt_src=src, chkpt_dest=dest, duration=dur) for src, dest, dur in paths]
+    )
+
+
+def run_with_deadline(function, seconds, *args, **kwargs):
+    """
+    runs 'function' on a daemon thread, failing the test if it doesn't return within 'seconds'
+    """
+
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(value=function(*args, **kwargs)), daemon=True
+    )
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), f"{function.__name__} did not return within {seconds}s"
+    return result["value"]
+
+
+def assert_valid_routes(checkpoints, shift_start, shift_end, routes):
+    durations = {(src, dest): dur for src, paths in checkpoints.items() for dest, dur in paths}
+    for route in routes:
+        assert route.times[0] == shift_start
+        assert route.times[-1] <= shift_end
+        for (src, dest), (start, end) in zip(
+            zip(route.checkpoints, route.checkpoints[1:]), zip(route.times, route.times[1:])
+        ):
+            assert end - start == durations[(src, dest)]
+
+
+def test_adjacency_graph_mirrors_paths():
+    checkpoints = adjacency(DENSE)
+
+    assert sorted(checkpoints[1]) == [(2, 10), (3, 10), (4, 10)]
+    assert checkpoints[2] == [(1, 10)]
+    assert sorted(checkpoints[3]) == [(1, 10), (4, 10)]
+
+
+def test_validate_paths_connected():
+    count, sub_circuits = utils.validate_paths(adjacency(DENSE))
+
+    assert count == 1
+    assert sorted(sub_circuits[0]) == [1, 2, 3, 4]
+
+
+def test_validate_paths_disconnected():
+    count, sub_circuits = utils.validate_paths(adjacency(SPLIT))
+
+    assert count == 2
+    assert sorted(sorted(sub_circuit) for sub_circuit in sub_circuits) == [[1, 2, 3], [4, 5, 6]]
+
+
+@pytest.mark.parametrize("sentries", [1, 30])
+def test_generate_circuit(sentries):
+    checkpoints = adjacency(DENSE)
+
+    shift_start, shift_end, path_freqs, routes = run_with_deadline(
+        utils.generate_circuit,
+        60,
+        SENTRIES[:sentries],
+        checkpoints,
+        date(2026, 1, 1),
+        time(6),
+        1,
+        0,
+        time_budget=5,
+        seed=1,
+    )
+
+    assert shift_end - shift_start == 3600
+    assert len(routes) == sentries
+    assert_valid_routes(checkpoints, shift_start, shift_end, routes)
+    assert sum(freq for _, freq in path_freqs) == sum(len(route) - 1 for route in routes)
+
+
+def test_generate_circuit_batch_long_shift_terminates():
+    # the paths are taken thousands of times each, their weights (halved per patrol) used to underflow
+    # to 0 and the walkers stopped on padding without moving, never finishing the shift
+    checkpoints = adjacency(DENSE)
+
+    shift_start, shift_end, path_freqs, routes = run_with_deadline(
+        utils.generate_circuit_batch,
+        60,
+        SENTRIES,
+        checkpoints,
+        date(2026, 1, 1),
+        time(6),
+        12,
+        0,
+        candidates=8,
+        seed=1,
+        time_budget=2,
+    )
+
+    assert len(routes) == len(SENTRIES)
+    assert_valid_routes(checkpoints, shift_start, shift_end, routes)
+    # every sentry patrols until the shift ends
+    assert all(route.times[-1] + 10 >= shift_end for route in routes)
+    # the paths are patrolled evenly
+    freqs = [freq for _, freq in path_freqs]
+    assert len(freqs) == 8
+    assert max(freqs) - min(freqs) <= 2 * len(SENTRIES)
+
+
+def test_generate_circuit_batch_reproducible():
+    checkpoints = adjacency(DENSE)
+    args = (SENTRIES[:3], checkpoints, date(2026, 1, 1), time(6), 1, 0)
+
+    first = utils.generate_circuit_batch(*args, candidates=4, seed=7)
+    second = utils.generate_circuit_batch(*args, candidates=4, seed=7)
+
+    assert first[2] == second[2]
+    assert [route.to_dict() for route in first[3]] == [route.to_dict() for route in second[3]]
@@ -0,0 +1,237 @@
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, time
+from multiprocessing.sharedctypes import RawArray
+
+import pytest
+
+import app.jobs as jobs
+
+SENTRIES = [(f"sentry {number}", f"card {number}", f"a{number}") for number in range(3)]
+
+SQUARE = {
+    1: [(2, 60), (4, 60)],
+    2: [(1, 60), (3, 60)],
+    3: [(2, 60), (4, 60)],
+    4: [(3, 60), (1, 60)],
+}
+
+# two buildings, generated as two sub-circuits
+BUILDINGS = SQUARE | {
+    5: [(6, 60), (8, 60)],
+    6: [(5, 60), (7, 60)],
+    7: [(6, 60), (8, 60)],
+    8: [(7, 60), (5, 60)],
+}
+
+
+def shift_info(checkpoints: dict, hour: int = 8) -> dict:
+    return {
+        "sentries": SENTRIES,
+        "checkpoints": checkpoints,
+        "start_date": date(2024, 1, 1),
+        "start_time": time(hour),
+        "shift_dur_hour": 1,
+        "shift_dur_min": 0,
+    }
+
+
+class Executor:
+    """
+    stands in for the worker process pool, the submitted tasks run in this process when 'run' is called
+    """
+
+    # never broken, see _get_executor
+    _broken = False
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.tasks.append((future, fn, args))
+        return future
+
+    def run(self, *numbers):
+        """
+        runs the pending tasks with the given numbers (in submission order), all of them by default
+        """
+
+        numbers = numbers or range(len(self.tasks))
+        tasks = [self.tasks[number] for number in numbers]
+        self.tasks = [task for task in self.tasks if task not in tasks]
+        for future, fn, args in tasks:
+            try:
+                future.set_result(fn(*args))
+            except Exception as error:
+                future.set_exception(error)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = Executor()
+    progress = RawArray("d", jobs.PROGRESS_SLOTS * len(jobs.PROGRESS_FIELDS))
+    monkeypatch.setattr(jobs, "EXECUTOR", executor)
+    monkeypatch.setattr(jobs, "PROGRESS", progress)
+    monkeypatch.setattr(jobs, "_WORKER_PROGRESS", progress)
+    monkeypatch.setattr(jobs, "JOBS", {})
+    monkeypatch.setattr(jobs, "FREE_SLOTS", list(range(jobs.PROGRESS_SLOTS)))
+    return executor
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """
+    the shifts saved to the database, by job, instead of saving them
+    """
+
+    saved = []
+
+    def save_shifts(assignments, results):
+        saved.append((assignments, results))
+        first = len(saved) * 100
+        return list(range(first, first + len(results))), ""
+
+    monkeypatch.setattr(jobs, "save_shifts", save_shifts)
+    return saved
+
+
+def test_circuit_job(executor, saved):
+    job_id = jobs.submit_circuit(shift_info(BUILDINGS))
+
+    # one task (and one progress slot) per sub-circuit
+    assert len(executor.tasks) == 2
+    assert len(jobs.FREE_SLOTS) == jobs.PROGRESS_SLOTS - 2
+    status = jobs.job_status(job_id)
+    assert (status["status"], status["completed"], status["progress"]) == ("running", 0, {})
+
+    executor.run()
+
+    status = jobs.job_status(job_id)
+    assert (status["status"], status["total"], status["completed"]) == ("done", 1, 1)
+    assert status["shift_ids"] == [100]
+    # the sub-circuits' progress, combined
+    assert status["progress"]["attempts"] >= 2
+    assert status["progress"]["required"] == 16
+    # the slots are handed back, the final progress is kept with the job
+    assert len(jobs.FREE_SLOTS) == jobs.PROGRESS_SLOTS
+    assert jobs.job_status(job_id)["progress"] == status["progress"]
+
+    ((assignments, ((start, end, paths, circuit, quality),)),) = saved
+    assert assignments == SENTRIES
+    assert end - start == 3600
+    # the sub-circuits merged into one
+    assert sorted(route.id for route in circuit) == ["a0", "a1", "a2"]
+    assert quality["required"] == 16 and sum(freq for _, freq in paths) > 0
+
+
+def test_schedule_job(executor, saved):
+    job_id = jobs.submit_schedule([shift_info(SQUARE, 8), shift_info(BUILDINGS, 16)])
+
+    assert len(executor.tasks) == 3
+    # the progress of bulk jobs is not followed
+    assert len(jobs.FREE_SLOTS) == jobs.PROGRESS_SLOTS
+
+    executor.run()
+
+    status = jobs.job_status(job_id)
+    assert (status["status"], status["completed"], status["shift_ids"]) == ("done", 2, [100, 101])
+    # saved at once, in submission order
+    ((_, results),) = saved
+    assert [end - start for start, end, *_ in results] == [3600, 3600]
+    assert results[1][0] - results[0][0] == 8 * 3600
+
+
+def test_failed_job_holds_its_slots_until_its_tasks_are_done(executor, saved, monkeypatch):
+    generate = jobs._generate
+
+    def failing(slot, part_info, *args):
+        if 5 in part_info["checkpoints"]:
+            raise RuntimeError("out of memory")
+        return generate(slot, part_info, *args)
+
+    monkeypatch.setattr(jobs, "_generate", failing)
+    job_id = jobs.submit_circuit(shift_info(BUILDINGS))
+
+    # the failing sub-circuit is done first
+    executor.run(1)
+
+    status = jobs.job_status(job_id)
+    assert status["status"] == "failed"
+    assert status["message"] == "Circuit generation failed: out of memory"
+    # the other sub-circuit is still being generated, and writes its progress to its slot
+    assert len(jobs.FREE_SLOTS) == jobs.PROGRESS_SLOTS - 2
+
+    executor.run()
+
+    assert jobs.job_status(job_id)["status"] == "failed"
+    assert len(jobs.FREE_SLOTS) == jobs.PROGRESS_SLOTS
+    assert saved == []
+
+
+def test_jobs_past_the_free_slots_run_without_progress(executor, saved, monkeypatch):
+    monkeypatch.setattr(jobs, "FREE_SLOTS", [0, 1])
+    running = [jobs.submit_circuit(shift_info(SQUARE, hour)) for hour in (8, 9)]
+
+    # no slot is free, the job's progress is not followed
+    job_id = jobs.submit_circuit(shift_info(SQUARE, 10))
+    assert jobs.FREE_SLOTS == [] and jobs.JOBS[job_id]["slots"] == []
+    # nor does it take over a running job's slot
+    taken = [slot for running_id in running for slot in jobs.JOBS[running_id]["slots"]]
+    assert sorted(taken) == [0, 1]
+
+    executor.run()
+
+    for done_id in running:
+        assert jobs.job_status(done_id)["progress"]["attempts"] >= 1
+    status = jobs.job_status(job_id)
+    assert (status["status"], status["progress"]) == ("done", {})
+    assert sorted(jobs.FREE_SLOTS) == [0, 1]
+
+    # the slots handed back are used again
+    job_id = jobs.submit_circuit(shift_info(SQUARE, 11))
+    assert len(jobs.JOBS[job_id]["slots"]) == 1
+
+
+def test_finished_jobs_are_forgotten(executor, saved, monkeypatch):
+    monkeypatch.setitem(jobs.app.config, "CIRCUIT_JOB_TTL", 600)
+    done_id = jobs.submit_circuit(shift_info(SQUARE))
+    executor.run()
+    running_id = jobs.submit_circuit(shift_info(BUILDINGS))
+    executor.run(0)
+
+    # long after they were submitted, but still within the TTL of finishing
+    for job in jobs.JOBS.values():
+        job["submitted"] -= 3600
+    assert jobs.job_status(done_id)["status"] == "done"
+
+    jobs.JOBS[done_id]["finished"] -= 601
+    assert jobs.job_status(done_id) is None
+    assert jobs.job_status(running_id)["status"] == "running"
+
+    # a failed job is kept while its tasks are running
+    jobs.JOBS[running_id] |= {"status": "failed", "finished": jobs.time.time() - 601}
+    assert jobs.job_status(running_id)["status"] == "failed"
+    executor.run()
+    assert jobs.job_status(running_id) is None
+    assert len(jobs.FREE_SLOTS) == jobs.PROGRESS_SLOTS
+
+
+def test_broken_pool_is_replaced(monkeypatch):
+    monkeypatch.setattr(jobs, "EXECUTOR", None)
+    monkeypatch.setitem(jobs.app.config, "CIRCUIT_WORKERS", 1)
+
+    broken = jobs._get_executor()
+    try:
+        # a worker process dying, e.g. killed for running out of memory
+        with pytest.raises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result(timeout=30)
+
+        executor = jobs._get_executor()
+        assert executor is not broken
+        assert executor.submit(pow, 2, 10).result(timeout=30) == 1024
+        assert jobs._get_executor() is executor
+    finally:
+        jobs._get_executor().shutdown()
+        broken.shutdown()
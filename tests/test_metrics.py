@@ -0,0 +1,151 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from appcore import metrics
+from appcore.mqtts import DONE, shift_topic
+
+# a sample line of the Prometheus text format: name, optional labels, value
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+SAMPLE = re.compile(
+    rf"^[a-zA-Z_:][a-zA-Z0-9_:]*(?:\{{{LABEL}(?:,{LABEL})*\}})? "
+    r"(?:[+-]?(?:\d+\.?\d*(?:e[+-]?\d+)?|Inf)|NaN)$"
+)
+
+
+def assert_text_format(text: str) -> None:
+    """
+    every line is a HELP or TYPE comment or a sample, and the text ends with a line feed
+    """
+
+    assert text.endswith("\n")
+    for line in text[:-1].split("\n"):
+        if line.startswith("# HELP "):
+            assert "\n" not in line
+        elif line.startswith("# TYPE "):
+            assert line.split()[3] in ("counter", "gauge", "histogram", "summary", "untyped")
+        else:
+            assert SAMPLE.match(line), line
+
+
+def test_counter_and_gauge_lines():
+    registry = metrics.Registry()
+    messages = registry.counter("messages_total", "Messages handled.", ["topic"])
+    queued = registry.gauge("queued", "Check-ins queued.")
+    messages.inc(topic="a/b")
+    messages.inc(2, topic="a/b")
+    messages.inc(topic="c")
+    queued.set(7)
+
+    text = metrics.render([(registry.collect(), {})])
+
+    assert text == (
+        "# HELP messages_total Messages handled.\n"
+        "# TYPE messages_total counter\n"
+        'messages_total{topic="a/b"} 3\n'
+        'messages_total{topic="c"} 1\n'
+        "# HELP queued Check-ins queued.\n"
+        "# TYPE queued gauge\n"
+        "queued 7\n"
+    )
+    assert_text_format(text)
+
+
+def test_histogram_lines():
+    registry = metrics.Registry()
+    seconds = registry.histogram("handling_seconds", "Time taken.", ["topic"])
+    for value in (0.001, 0.02, 0.02, 3, 60):
+        seconds.observe(value, topic="a")
+
+    text = metrics.render([(registry.collect(), {})])
+    lines = text.splitlines()
+
+    assert lines[:2] == ["# HELP handling_seconds Time taken.", "# TYPE handling_seconds histogram"]
+    buckets = [line for line in lines if line.startswith("handling_seconds_bucket")]
+    # cumulative counts, one bucket per bound and +Inf
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == [1, 1, 3, 3, 3, 3, 3, 3, 3, 4, 4, 5]
+    assert buckets[0] == 'handling_seconds_bucket{topic="a",le="0.005"} 1'
+    assert buckets[-1] == 'handling_seconds_bucket{topic="a",le="+Inf"} 5'
+    assert lines[-2:] == [
+        f'handling_seconds_sum{{topic="a"}} {0.001 + 0.02 + 0.02 + 3 + 60}',
+        'handling_seconds_count{topic="a"} 5',
+    ]
+    assert_text_format(text)
+
+
+def test_label_values_and_help_are_escaped():
+    registry = metrics.Registry()
+    gauge = registry.gauge("odd", 'Help with a \\ backslash,\na line feed and "quotes".', ["name"])
+    gauge.set(1, name='say "hi"\\\n')
+    gauge.set(float("inf"), name="inf")
+    gauge.set(float("nan"), name="nan")
+
+    text = metrics.render([(registry.collect(), {})])
+
+    assert text.splitlines() == [
+        '# HELP odd Help with a \\\\ backslash,\\na line feed and "quotes".',
+        "# TYPE odd gauge",
+        'odd{name="say \\"hi\\"\\\\\\n"} 1',
+        'odd{name="inf"} +Inf',
+        'odd{name="nan"} NaN',
+    ]
+    assert_text_format(text)
+
+
+def test_sources_are_rendered_together():
+    # the web app's metrics, and those published by two handler shards
+    app, handlers = metrics.Registry(), [metrics.Registry(), metrics.Registry()]
+    for number, registry in enumerate([app, *handlers]):
+        registry.counter("messages_total", "Messages handled.", ["topic"]).inc(number, topic="t")
+    handlers[0].gauge("queued", "Check-ins queued.").set(4)
+
+    text = metrics.render(
+        [(app.collect(), {})]
+        + [(registry.collect(), {"handler": f"h{n}"}) for n, registry in enumerate(handlers)]
+    )
+
+    assert text == (
+        "# HELP messages_total Messages handled.\n"
+        "# TYPE messages_total counter\n"
+        'messages_total{topic="t"} 0\n'
+        'messages_total{topic="t",handler="h0"} 1\n'
+        'messages_total{topic="t",handler="h1"} 2\n'
+        "# HELP queued Check-ins queued.\n"
+        "# TYPE queued gauge\n"
+        'queued{handler="h0"} 4\n'
+    )
+    assert_text_format(text)
+
+
+def test_measured_messages_by_topic():
+    registry = metrics.Registry()
+    messages = registry.counter("messages_total", "Messages handled.", ["topic"])
+    seconds = registry.histogram("message_seconds", "Time taken.", ["topic"])
+
+    @metrics.measure_messages(messages=messages, seconds=seconds)
+    def on_message(client, userdata, message):
+        if message.payload == b"bad":
+            raise ValueError(message.payload)
+        return message.payload
+
+    topics = [
+        "sentry-platform/checkpoints/connected",
+        "sentry-platform/circuit-handler-a/connected",
+        DONE,
+        shift_topic(DONE, "shift-1"),
+    ]
+    for topic in topics:
+        assert on_message(None, None, SimpleNamespace(topic=topic, payload=b"ok")) == b"ok"
+    # failing messages are counted too
+    with pytest.raises(ValueError):
+        on_message(None, None, SimpleNamespace(topic=topics[2], payload=b"bad"))
+
+    text = metrics.render([(registry.collect(), {})])
+
+    assert 'messages_total{topic="sentry-platform/+/connected"} 2' in text
+    # the per-shift topics under their topic without the shift key
+    assert f'messages_total{{topic="{DONE}"}} 3' in text
+    assert f'message_seconds_count{{topic="{DONE}"}} 3' in text
+    assert_text_format(text)
@@ -0,0 +1,92 @@
+import random
+
+import pytest
+from sqlalchemy import Column, Integer, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from appcore.utils import keyset_page
+
+Base = declarative_base()
+
+
+class Shift(Base):
+    """
+    the shift logs' columns the pages are read by (see Shift in models.py)
+    """
+
+    __tablename__ = "shifts"
+
+    id = Column(Integer, primary_key=True)
+    shift_start = Column(Integer, unique=True, nullable=False)
+    completed = Column(Integer, default=0)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        # shifts starting every 8 hours, saved in no particular order
+        starts = [1_700_000_000 + 28_800 * number for number in range(23)]
+        random.Random(0).shuffle(starts)
+        session.add_all(Shift(shift_start=start, completed=start // 28_800 % 2) for start in starts)
+        session.commit()
+        yield session
+
+
+def starts(page):
+    return [shift.shift_start for shift in page]
+
+
+def test_pages_cover_every_shift_newest_first(session):
+    query = session.query(Shift)
+    newest_first = sorted(starts(query.all()), reverse=True)
+
+    # walking back through the older pages
+    pages = []
+    page, newer, older = keyset_page(query, Shift.shift_start, 5)
+    assert not newer
+    while True:
+        pages.append(starts(page))
+        if not older:
+            break
+        page, newer, older = keyset_page(query, Shift.shift_start, 5, after=page[-1].shift_start)
+        assert newer
+
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [start for page in pages for start in page] == newest_first
+
+    # and forward again through the newer pages, from the oldest one
+    page, newer, older = keyset_page(query, Shift.shift_start, 5, before=pages[-1][0])
+    assert starts(page) == pages[-2] and newer and older
+    page, newer, older = keyset_page(query, Shift.shift_start, 5, before=pages[1][0])
+    assert starts(page) == pages[0] and not newer and older
+
+
+def test_newer_page_stops_at_the_newest_shift(session):
+    query = session.query(Shift)
+    newest_first = sorted(starts(query.all()), reverse=True)
+
+    page, newer, older = keyset_page(query, Shift.shift_start, 5, before=newest_first[3])
+    assert starts(page) == newest_first[:3]
+    assert not newer and older
+
+
+def test_pages_of_a_filtered_query(session):
+    query = session.query(Shift).filter(Shift.completed == 1)
+    expected = sorted(starts(query.all()), reverse=True)
+
+    page, newer, older = keyset_page(query, Shift.shift_start, 50)
+    assert starts(page) == expected
+    assert not newer and not older
+
+    page, newer, older = keyset_page(query, Shift.shift_start, 2, after=expected[1])
+    assert starts(page) == expected[2:4]
+    # the filter applies to whether there are other pages too
+    assert newer and older == (len(expected) > 4)
+
+
+def test_empty_page(session):
+    query = session.query(Shift)
+
+    assert keyset_page(query, Shift.shift_start, 5, after=0) == ([], False, False)
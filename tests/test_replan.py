@@ -0,0 +1,208 @@
+import copy
+from collections import Counter
+from datetime import date, time
+
+import pytest
+
+from appcore.circuits import SentryRoute
+from appcore.utils import generate_circuit, merge_circuits, replan_circuit, split_circuit
+
+# the 3 x 3 grid of the adjacency dictionary example (see generate_adjacency_graph)
+GRID = {
+    1: [(2, 90), (4, 70)],
+    2: [(1, 90), (3, 90), (5, 70)],
+    3: [(2, 90), (6, 70)],
+    4: [(5, 90), (1, 70), (7, 60)],
+    5: [(4, 90), (6, 90), (2, 70), (8, 60)],
+    6: [(5, 90), (3, 70), (9, 60)],
+    7: [(8, 90), (4, 60)],
+    8: [(7, 90), (9, 90), (5, 60)],
+    9: [(8, 90), (6, 60)],
+}
+
+# two buildings, cut off from each other
+BUILDINGS = {
+    1: [(2, 60), (4, 60)],
+    2: [(1, 60), (3, 60)],
+    3: [(2, 60), (4, 60)],
+    4: [(3, 60), (1, 60)],
+    5: [(6, 60), (8, 60)],
+    6: [(5, 60), (7, 60)],
+    7: [(6, 60), (8, 60)],
+    8: [(7, 60), (5, 60)],
+}
+
+SENTRIES = [(f"sentry {number}", f"card {number}", f"a{number}") for number in range(4)]
+
+
+def shift(checkpoints: dict, seed: int = 0) -> tuple:
+    """
+    a 2 hour shift's circuit, generated per sub-circuit as the web app does (see jobs.py)
+    """
+
+    sub_circuits = [[1, 2, 3, 4], [5, 6, 7, 8]] if checkpoints is BUILDINGS else [list(checkpoints)]
+    parts = [
+        generate_circuit(sentries, part, date(2024, 1, 1), time(8), 2, 0, seed=seed)
+        for sentries, part in split_circuit(SENTRIES, checkpoints, sub_circuits)
+    ]
+    return merge_circuits(parts)
+
+
+def durations(checkpoints: dict) -> dict:
+    return {
+        (checkpoint, neighbour): duration
+        for checkpoint, check_paths in checkpoints.items()
+        for neighbour, duration in check_paths
+    }
+
+
+def check_tail(route: SentryRoute, split: int, now: int, checkpoints: dict, blocked: set):
+    """
+    the re-planned tail starts where the sentry is expected last, and walks open paths one at a time
+    """
+
+    patrolled = durations(checkpoints)
+    time = max(route.times[split - 1], now)
+    for first, second, arrival in zip(
+        route.checkpoints[split - 1 :], route.checkpoints[split:], route.times[split:]
+    ):
+        assert (first, second) in patrolled
+        assert (first, second) not in blocked and (second, first) not in blocked
+        time += patrolled[first, second]
+        assert arrival == time
+
+
+def all_freqs(circuit: list[SentryRoute]) -> Counter:
+    return Counter(path for route in circuit for path in route.paths())
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_off_duty_sentry_load_is_shared(seed):
+    shift_start, shift_end, path_freqs, circuit = shift(GRID, seed)
+    now = shift_start + 2400
+    splits = [max(route.split(now), 1) for route in circuit]
+    # the sentries have validly checked in at every other checkpoint so far
+    for route, split in zip(circuit, splits):
+        for index in range(0, split, 2):
+            route.check(index)
+    before = copy.deepcopy(circuit)
+
+    path_freqs, updates = replan_circuit(
+        circuit, GRID, path_freqs, now, shift_end, off_duty={"a1"}, seed=seed
+    )
+
+    for route, old, split in zip(circuit, before, splits):
+        # past check-ins, and their checked state, are kept
+        assert route.checkpoints[:split] == old.checkpoints[:split]
+        assert route.times[:split] == old.times[:split]
+        assert [route.is_checked(index) for index in range(split)] == [
+            index % 2 == 0 for index in range(split)
+        ]
+        if route.id == "a1":
+            # the off-duty sentry's route ends at its last expected checkpoint
+            assert len(route) == split and route.times[-1] <= now
+        else:
+            check_tail(route, split, now, GRID, set())
+            assert route.times[-1] >= shift_end
+
+    assert Counter(dict(path_freqs)) == all_freqs(circuit)
+    assert [(update["id"], update["on_duty"]) for update in updates] == [
+        (route.id, route.id != "a1") for route in circuit
+    ]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_blocked_paths_are_avoided(seed):
+    shift_start, shift_end, path_freqs, circuit = shift(GRID, seed)
+    before = copy.deepcopy(circuit)
+    now = shift_start + 3000
+    splits = [max(route.split(now), 1) for route in circuit]
+    blocked = {(5, 6), (4, 7)}
+
+    path_freqs, updates = replan_circuit(
+        circuit, GRID, path_freqs, now, shift_end, blocked=blocked, seed=seed
+    )
+
+    replanned = {update["id"] for update in updates}
+    for route, old, split in zip(circuit, before, splits):
+        assert route.checkpoints[:split] == old.checkpoints[:split]
+        check_tail(route, split, now, GRID, blocked)
+        # only the tails that crossed a blocked path are re-planned
+        crossed = any(path in blocked or path[::-1] in blocked for path in old.paths(split))
+        assert (route.id in replanned) == crossed
+        if not crossed:
+            assert route.checkpoints == old.checkpoints and route.times == old.times
+
+    assert Counter(dict(path_freqs)) == all_freqs(circuit)
+
+
+def test_updates_stop_at_until():
+    shift_start, shift_end, path_freqs, circuit = shift(GRID)
+    now = shift_start + 1200
+    splits = {route.id: max(route.split(now), 1) for route in circuit}
+
+    _, updates = replan_circuit(
+        circuit, GRID, path_freqs, now, shift_end, off_duty={"a0"}, until=now + 600
+    )
+
+    for update in updates:
+        route = next(route for route in circuit if route.id == update["id"])
+        stop = max(route.split(now + 600), splits[route.id])
+        assert update == {"on_duty": route.id != "a0"} | route.to_dict(
+            start=splits[route.id], stop=stop
+        )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_sub_circuits_are_replanned_separately(seed):
+    shift_start, shift_end, path_freqs, circuit = shift(BUILDINGS, seed)
+    assert [route.checkpoints[0] in (1, 2, 3, 4) for route in circuit] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    before = copy.deepcopy(circuit)
+    now = shift_start + 1800
+
+    path_freqs, updates = replan_circuit(
+        circuit, BUILDINGS, path_freqs, now, shift_end, off_duty={"a0"}, seed=seed
+    )
+
+    # the other building's sentries do not share the load, their routes are left as they are
+    assert [update["id"] for update in updates] == ["a0", "a1"]
+    for route, old in zip(circuit[2:], before[2:]):
+        assert route.checkpoints == old.checkpoints and route.times == old.times
+
+    # the remaining sentry patrols its own building evenly (by the halved weights), rather than
+    # heading for the other building's unreachable paths, i.e. walking at random (spread of up to ~14)
+    split = max(before[1].split(now), 1)
+    check_tail(circuit[1], split, now, BUILDINGS, set())
+    tail = Counter(circuit[1].paths(split))
+    assert len(tail) == 8
+    assert max(tail.values()) - min(tail.values()) <= 4
+
+    assert Counter(dict(path_freqs)) == all_freqs(circuit)
+
+
+def test_blocked_bridge_cuts_the_circuit():
+    # the two buildings joined by a single path, which becomes blocked
+    bridged = copy.deepcopy(BUILDINGS)
+    bridged[4].append((5, 60))
+    bridged[5].append((4, 60))
+    shift_start, shift_end, path_freqs, circuit = shift(bridged)
+    now = shift_start + 1800
+    splits = [max(route.split(now), 1) for route in circuit]
+
+    path_freqs, _ = replan_circuit(
+        circuit, bridged, path_freqs, now, shift_end, blocked={(4, 5)}, off_duty={"a3"}
+    )
+
+    for route, split in zip(circuit, splits):
+        if route.id != "a3":
+            check_tail(route, split, now, bridged, {(4, 5)})
+            # each sentry stays in the building it was in when the bridge was blocked
+            building = {1, 2, 3, 4} if route.checkpoints[split - 1] <= 4 else {5, 6, 7, 8}
+            assert set(route.checkpoints[split:]) <= building
+
+    assert Counter(dict(path_freqs)) == all_freqs(circuit)
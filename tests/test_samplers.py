@@ -0,0 +1,81 @@
+import math
+import random
+import sys
+
+import pytest
+
+from appcore.samplers import CircuitGraph, PathSampler
+
+
+def frequencies(sampler: PathSampler, rng: random.Random, draws: int) -> list[float]:
+    counts = [0] * sampler.size
+    for _ in range(draws):
+        counts[sampler.sample(rng)] += 1
+    return [count / draws for count in counts]
+
+
+def assert_matches_weights(sampler: PathSampler, rng: random.Random, draws: int = 40_000):
+    """
+    each path is picked about as often as its share of the total weight (within 5 standard deviations)
+    """
+
+    total = sum(sampler.weights)
+    for frequency, weight in zip(frequencies(sampler, rng, draws), sampler.weights):
+        share = weight / total
+        assert abs(frequency - share) <= 5 * math.sqrt(share * (1 - share) / draws) + 1e-9
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, 13])
+def test_sampling_matches_the_weights(size):
+    rng = random.Random(size)
+    sampler = PathSampler([rng.choice((0.5, 1, 2, 3, 10)) for _ in range(size)])
+
+    assert_matches_weights(sampler, rng)
+
+
+def test_paths_without_weight_are_never_picked():
+    rng = random.Random(1)
+    sampler = PathSampler([0, 3, 0, 1, 0])
+
+    assert set(sampler.sample(rng) for _ in range(5000)) == {1, 3}
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_updates_keep_the_tree_in_step(seed):
+    rng = random.Random(seed)
+    sampler = PathSampler([rng.random() for _ in range(11)])
+
+    for _ in range(200):
+        index = rng.randrange(sampler.size)
+        if rng.random() < 0.5:
+            sampler.update(index, rng.random() * 5)
+        else:
+            sampler.scale(index, rng.choice((0.5, 2.0)))
+
+    assert sampler.total() == pytest.approx(sum(sampler.weights))
+    assert_matches_weights(sampler, rng)
+
+
+def test_halving_past_the_rescale_keeps_the_relative_weights():
+    rng = random.Random(4)
+    # every path starts at the same weight, as in a generation (see CircuitGraph.samplers)
+    (sampler,) = CircuitGraph({1: [(2, 60), (3, 60), (4, 60), (5, 60)]}).samplers().values()
+    assert sampler.weights == [float(sys.maxsize)] * 4
+    halvings = [0] * sampler.size
+
+    # far more halvings than the starting weights (~2**63) allow without rescaling
+    rescaled = 0
+    for _ in range(2000):
+        index = rng.choice((0, 0, 1, 1, 2, 3))
+        before = sampler.weights[index]
+        sampler.scale(index, 0.5)
+        halvings[index] += 1
+        rescaled += sampler.weights[index] != before / 2
+
+    assert rescaled and min(halvings) > 64
+    assert all(weight > 0 for weight in sampler.weights)
+    # the weights are powers of two apart, by the difference of their halvings (exactly)
+    for index, weight in enumerate(sampler.weights):
+        assert weight / sampler.weights[0] == 2.0 ** (halvings[0] - halvings[index])
+    assert sampler.total() == pytest.approx(sum(sampler.weights))
+    assert_matches_weights(sampler, rng)
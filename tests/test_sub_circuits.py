@@ -0,0 +1,86 @@
+import random
+from collections import Counter
+from datetime import date, time
+
+import pytest
+
+from appcore.utils import generate_circuit, merge_circuits, split_circuit, validate_paths
+
+
+def buildings(sizes: list[int]) -> dict:
+    """
+    separate buildings, each a ring of checkpoints of the given size
+    """
+
+    checkpoints = {}
+    first = 1
+    for size in sizes:
+        ring = list(range(first, first + size))
+        for index, checkpoint in enumerate(ring):
+            checkpoints[checkpoint] = [(ring[index - 1], 60), (ring[(index + 1) % size], 60)]
+        first += size
+    return checkpoints
+
+
+def sentries(count: int) -> list[tuple]:
+    return [(f"sentry {number}", f"card {number}", f"a{number}") for number in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_sentries_are_shared_by_size(seed):
+    rng = random.Random(seed)
+    sizes = [rng.randrange(3, 30) for _ in range(rng.randrange(1, 6))]
+    checkpoints = buildings(sizes)
+    count, sub_circuits = validate_paths(checkpoints)
+    assert count == len(sizes)
+    total = rng.randrange(count, 40)
+
+    parts = split_circuit(sentries(total), checkpoints, sub_circuits)
+
+    counts = [len(part_sentries) for part_sentries, _ in parts]
+    # every sentry is assigned once, and every sub-circuit gets one
+    assert sum(counts) == total and min(counts) >= 1
+    assert [sentry for part_sentries, _ in parts for sentry in part_sentries] == sentries(total)
+    # the spare sentries by size (number of paths), off by less than one from the exact share
+    paths = [sum(len(check_paths) for check_paths in part.values()) for _, part in parts]
+    for part_count, part_paths in zip(counts, paths):
+        assert abs(part_count - 1 - (total - count) * part_paths / sum(paths)) < 1
+    assert [set(part) for _, part in parts] == [set(chks) for chks in sub_circuits]
+
+
+def test_largest_remainders_get_the_leftover_sentries():
+    # 3 spare sentries over 10 + 6 + 4 paths: exact shares 1.5, 0.9 and 0.6
+    checkpoints = buildings([5, 3, 2])
+    _, sub_circuits = validate_paths(checkpoints)
+
+    parts = split_circuit(sentries(6), checkpoints, sub_circuits)
+
+    assert [len(part_sentries) for part_sentries, _ in parts] == [2, 2, 2]
+
+
+def test_too_few_sentries_for_the_sub_circuits():
+    checkpoints = buildings([4, 4, 4])
+    _, sub_circuits = validate_paths(checkpoints)
+
+    with pytest.raises(ValueError):
+        split_circuit(sentries(2), checkpoints, sub_circuits)
+
+
+def test_merged_circuit_keeps_every_part():
+    checkpoints = buildings([4, 6])
+    _, sub_circuits = validate_paths(checkpoints)
+    parts = [
+        generate_circuit(part_sentries, part, date(2024, 1, 1), time(8), 1, 0, seed=1)
+        for part_sentries, part in split_circuit(sentries(3), checkpoints, sub_circuits)
+    ]
+
+    shift_start, shift_end, path_freqs, ind_routes = merge_circuits(parts)
+
+    assert (shift_start, shift_end) == parts[0][:2]
+    assert ind_routes == [route for *_, part_routes in parts for route in part_routes]
+    # the frequencies of every part, most patrolled first
+    merged = Counter(dict(path_freqs))
+    assert len(merged) == len(path_freqs)
+    assert merged == sum((Counter(dict(part_freqs)) for _, _, part_freqs, _ in parts), Counter())
+    assert [freq for _, freq in path_freqs] == sorted(merged.values(), reverse=True)
+    assert merged == Counter(path for route in ind_routes for path in route.paths())
@@ -0,0 +1,83 @@
+import json
+import random
+
+import pytest
+
+from appcore.circuits import SentryRoute
+from appcore.wire import HEADER, MAGIC, VERSION, decode_message, encode_message
+
+
+def random_routes(seed: int, count: int = 6) -> list[dict]:
+    """
+    routes in compact form (SentryRoute.to_dict), as sent in the circuit messages
+    """
+
+    rng = random.Random(seed)
+    routes = []
+    for number in range(count):
+        # the same sentry may be on duty under several cards, a route may be empty
+        route = SentryRoute(f"sentry {number % 3}", f"card {number}", f"a{number}")
+        time = 1_700_000_000 + rng.randrange(3600)
+        for _ in range(rng.choice((0, 1, 9, 40))):
+            route.append(rng.randrange(1, 300), time)
+            time += rng.choice((0, 45, 120, 900))
+        for index in range(len(route)):
+            if rng.random() < 0.5:
+                route.check(index)
+        routes.append(route.to_dict())
+    return routes
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("binary", [True, False])
+def test_circuit_message_round_trip(seed, binary):
+    message = {"until": 1_700_003_600, "final": seed % 2 == 0, "routes": random_routes(seed)}
+
+    assert decode_message(encode_message(message, binary=binary)) == message
+
+
+def test_update_message_round_trip():
+    # re-planned route tails carry whether the sentry is still on duty, and may have no name or card
+    routes = random_routes(1, count=3)
+    routes[0] |= {"on_duty": False, "checkpoints": [], "times": [], "checked": ""}
+    routes[1] |= {"on_duty": True}
+    routes[2] |= {"name": None, "card": None}
+    message = {"from": 1_700_000_000, "routes": routes}
+
+    assert decode_message(encode_message(message)) == message
+
+
+def test_binary_form_is_smaller():
+    message = {"until": 1_700_003_600, "final": False, "routes": random_routes(3, count=20)}
+
+    assert len(encode_message(message)) < len(encode_message(message, binary=False)) / 2
+
+
+def test_extreme_numbers_round_trip():
+    # the varints are zigzag-coded, negative numbers (e.g. a time difference) and large ones fit too
+    route = {
+        "name": None,
+        "card": None,
+        "id": "a1",
+        "checkpoints": [-1, 2**40, 0],
+        "times": [2**40, -5, 0],
+        "checked": "05",
+    }
+    message = {"routes": [route]}
+
+    assert decode_message(encode_message(message)) == message
+
+
+def test_unknown_version_is_rejected():
+    payload = encode_message({"routes": []})
+    fields_length = HEADER.unpack_from(payload)[2]
+    newer = HEADER.pack(MAGIC, VERSION + 1, fields_length) + payload[HEADER.size :]
+
+    with pytest.raises(ValueError):
+        decode_message(newer)
+
+
+def test_json_payload_as_bytes():
+    message = {"until": 1, "final": True, "routes": random_routes(2, count=2)}
+
+    assert decode_message(json.dumps(message).encode()) == message